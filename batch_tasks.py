@@ -0,0 +1,156 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+from config import MAX_CONCURRENT_BATCHES, BATCH_CANCEL_GRACE
+
+logger = logging.getLogger(__name__)
+
+# States a batch moves through; the last three are final
+QUEUED, RUNNING, STOPPING, DONE, FAILED, CANCELLED = (
+    'queued', 'running', 'stopping', 'done', 'failed', 'cancelled'
+)
+
+
+class BatchTask:
+    """One user's batch: its asyncio task, state and timings"""
+    
+    def __init__(self, user_id: int, chat_id: int, total: int):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.total = total
+        self.state = QUEUED
+        self.task: Optional[asyncio.Task] = None
+        self.created = time.time()
+        self.started = 0.0
+        self.finished = 0.0
+        self.error: Optional[BaseException] = None
+        self._force: Optional[asyncio.TimerHandle] = None
+    
+    @property
+    def live(self) -> bool:
+        return self.state in (QUEUED, RUNNING, STOPPING)
+
+
+class BatchRegistry:
+    """
+    Runs batches as supervised background tasks instead of inside pyrogram
+    handler workers, so commands and callbacks stay responsive while any
+    number of batches run. At most MAX_CONCURRENT_BATCHES run at once (the
+    rest wait in line), one batch per user; cancellation is cooperative
+    first and a hard task cancel after BATCH_CANCEL_GRACE seconds.
+    """
+    
+    def __init__(self, max_running: int = MAX_CONCURRENT_BATCHES):
+        self.max_running = max_running
+        self._slots = asyncio.Semaphore(max_running)
+        self._batches: Dict[int, BatchTask] = {}
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+    
+    def get(self, user_id: int) -> Optional[BatchTask]:
+        batch = self._batches.get(user_id)
+        return batch if batch and batch.live else None
+    
+    def is_busy(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+    
+    def counts(self) -> Dict[str, int]:
+        states = [b.state for b in self._batches.values()]
+        return {state: states.count(state) for state in (QUEUED, RUNNING, STOPPING)}
+    
+    def queue_position(self, user_id: int) -> int:
+        """Batches that must finish before this one gets a slot (0 = runs now)"""
+        batch = self.get(user_id)
+        if not batch or batch.state != QUEUED:
+            return 0
+        before = 0
+        for other in self._batches.values():  # Insertion order = arrival order
+            if other is batch:
+                break
+            before += other.live
+        return max(0, before - self.max_running + 1)
+    
+    def start(
+        self,
+        user_id: int,
+        chat_id: int,
+        total: int,
+        job: Callable[[], Awaitable],
+        on_done: Optional[Callable[[BatchTask], None]] = None
+    ) -> Optional[BatchTask]:
+        """Schedule a batch; None if the user already has one"""
+        if self.is_busy(user_id):
+            return None
+        batch = BatchTask(user_id, chat_id, total)
+        self._batches[user_id] = batch
+        batch.task = asyncio.create_task(self._supervise(batch, job, on_done), name=f"batch-{user_id}")
+        return batch
+    
+    async def _supervise(self, batch: BatchTask, job: Callable[[], Awaitable], on_done):
+        try:
+            async with self._slots:
+                if batch.state == QUEUED:
+                    batch.state = RUNNING
+                batch.started = time.time()
+                logger.info(f"▶️ Batch started for user {batch.user_id} ({batch.total} items)")
+                await job()
+            batch.state = CANCELLED if batch.state == STOPPING else DONE
+        except asyncio.CancelledError:
+            batch.state = CANCELLED
+        except Exception as e:
+            batch.state = FAILED
+            batch.error = e
+            logger.error(f"💥 Batch for user {batch.user_id} crashed: {e}", exc_info=True)
+        finally:
+            batch.finished = time.time()
+            if batch._force:
+                batch._force.cancel()
+            if batch.state == DONE:
+                self.completed += 1
+            elif batch.state == FAILED:
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            if self._batches.get(batch.user_id) is batch:
+                del self._batches[batch.user_id]
+            logger.info(f"⏹️ Batch for user {batch.user_id} {batch.state}")
+            if on_done:
+                try:
+                    on_done(batch)
+                except Exception as e:
+                    logger.error(f"Batch cleanup error: {e}")
+    
+    def cancel(self, user_id: int) -> bool:
+        """
+        Ask a user's batch to stop; the batch notices at its next item, and
+        is cancelled outright if it is still going after the grace period.
+        """
+        batch = self.get(user_id)
+        if not batch:
+            return False
+        if batch.state == QUEUED:
+            batch.task.cancel()
+            return True
+        if batch.state == RUNNING:
+            batch.state = STOPPING
+            batch._force = asyncio.get_running_loop().call_later(
+                BATCH_CANCEL_GRACE, self._force_cancel, batch
+            )
+        return True
+    
+    def _force_cancel(self, batch: BatchTask):
+        if batch.live and batch.task and not batch.task.done():
+            logger.warning(f"⛔ Batch for user {batch.user_id} ignored stop for {BATCH_CANCEL_GRACE}s, cancelling")
+            batch.task.cancel()
+    
+    async def shutdown(self):
+        """Cancel every batch (bot stopping)"""
+        tasks = [b.task for b in self._batches.values() if b.task and not b.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+batch_registry = BatchRegistry()
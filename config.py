@@ -11,12 +11,23 @@ PORT = int(os.getenv("PORT", "10000"))
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Disk Budget (admission control for DOWNLOAD_DIR)
+DISK_MIN_FREE = 536870912  # 512MB always kept free
+DISK_DEFAULT_VIDEO_RESERVATION = 1073741824  # 1GB when a video's size is unknown
+DISK_DEFAULT_FILE_RESERVATION = 52428800  # 50MB for images/documents of unknown size
+DISK_RECHECK_INTERVAL = 5  # Seconds between free-space rechecks while waiting
+
+# Per-job Workspaces (DOWNLOAD_DIR/jobs/<job>)
+WORKSPACE_ORPHAN_AGE = 600  # Seconds before an unowned workspace is reclaimed
+WORKSPACE_JANITOR_INTERVAL = 300  # Seconds between janitor sweeps
+
 # Quality Settings
 QUALITY_MAP = {
     "360p": "360",
     "480p": "480", 
     "720p": "720",
     "1080p": "1080",
+    "auto": "auto",  # Per item: highest variant that fits under MAX_FILE_SIZE
 }
 
 # Supported File Types
@@ -33,10 +44,81 @@ MAX_CONCURRENT_DOWNLOADS = 5  # Parallel downloads
 BUFFER_SIZE = 524288  # 512KB buffer (doubled)
 HTTP_CHUNK_SIZE = 2097152  # 2MB chunks (doubled)
 
+# Disk Writer Settings
+WRITE_BUFFER_SIZE = 4194304  # 4MB aligned buffers per pwrite
+WRITER_QUEUE_DEPTH = 8  # Buffers in flight per file before the download waits
+DIGEST_AHEAD_MAX = 67108864  # 64MB of out-of-order blocks held for the digest, else hash at close
+ADAPTIVE_CHUNK_MIN = 65536  # 64KB network reads on slow links
+ADAPTIVE_CHUNK_MAX = 4194304  # 4MB network reads on fast links
+ADAPTIVE_CHUNK_TARGET_SECONDS = 0.05  # Traffic covered by one read
+
+# Segmented downloads with stall detection / hedged requests
+RANGED_PART_SIZE = 16777216  # 16MB minimum per range
+RANGED_MAX_PARTS = 8  # Parallel ranges per file
+STALL_MIN_RATE = 65536  # 64KB/s throughput floor per request
+STALL_GRACE = 5  # Seconds a request runs before it can be judged slow
+HEDGE_SLOW_RATIO = 0.25  # Hedge a range below this share of its peers' median rate
+HEDGE_MIN_REMAINING = 1048576  # Not worth hedging under 1MB left
+HEDGE_MAX_PER_PART = 2  # Duplicate requests per range
+HEDGE_CHECK_INTERVAL = 1  # Seconds between stall checks
+YTDLP_SOCKET_TIMEOUT = 20  # yt-dlp gives up on a silent connection after this
+
+# Video routing: native engines before yt-dlp
+NATIVE_HLS = True  # Fetch VOD HLS natively (yt-dlp still takes what it can't handle)
+
+# Warm yt-dlp instances (reused instead of built per item)
+YDL_POOL_IDLE = 4  # Idle YoutubeDL instances kept per option set
+YDL_POOL_MAX_USES = 50  # Jobs served before an instance is rebuilt
+
+# Retry policy / per-host circuit breaker
+RETRY_BACKOFF_BASE = 1.0  # Seconds before the first retry, doubled per attempt
+RETRY_BACKOFF_MAX = 30  # Cap on a single backoff delay
+CIRCUIT_FAILURE_THRESHOLD = 3  # Consecutive failures before a host trips
+CIRCUIT_OPEN_SECONDS = 120  # Tripped hosts are skipped for this long
+FAILED_URL_TTL = 600  # Seconds a failed URL is not retried
+FAILED_URL_CACHE_SIZE = 5000
+
+# URL pass-through (Telegram fetches small public files itself)
+URL_PASSTHROUGH = True
+URL_PHOTO_MAX = 5242880  # 5MB: Telegram's limit for photos sent by URL
+URL_DOCUMENT_MAX = 20971520  # 20MB: Telegram's limit for files sent by URL
+URL_PHOTO_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+URL_DOCUMENT_TYPES = ('application/pdf', 'application/zip')  # Only types Telegram accepts by URL
+
+# In-memory path for small images/documents (no disk round-trip)
+MEMORY_PATH_MAX = 8388608  # 8MB: files up to this size stay in RAM
+MEMORY_POOL_CAP = 134217728  # 128MB of buffers in use at once, then disk
+MEMORY_POOL_IDLE_BUFFERS = 4  # Buffers kept around for reuse when idle
+
+# Albums (send_media_group) for runs of consecutive images/documents
+ALBUM_SIZE = 10  # Telegram's media group limit (1 = albums off)
+ALBUM_DOCUMENTS = True  # Group consecutive documents too
+ALBUM_FLOODWAIT_RETRIES = 3  # Flood waits sat out per album before giving up on it
+
+# Failed-link digest (instead of one message per failed/skipped link)
+FAILED_DIGEST_INTERVAL = 300  # Seconds between periodic digests during a batch
+FAILED_DIGEST_MAX_CHARS = 3500  # Longer digests are sent as a TXT file
+
+# Batch dashboard (one live message per batch)
+DASHBOARD_INTERVAL = 3  # Seconds between dashboard edits (only when changed)
+DASHBOARD_MAX_ACTIVE = 8  # Active items listed on the dashboard
+
+# Batch tasks (run outside pyrogram's handler workers)
+MAX_CONCURRENT_BATCHES = 8  # Batches running at once; more wait in line
+BATCH_CANCEL_GRACE = 30  # Seconds a stopped batch gets before its task is cancelled
+
+# Prometheus /metrics
+METRICS_PREFIX = "txt2upload"  # Metric name prefix
+METRICS_MAX_HOSTS = 50  # Distinct host label values before the rest become "other"
+METRICS_STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)  # Seconds
+
+# Content dedupe
+CONTENT_INDEX_SIZE = 10000  # Delivered URLs/digests remembered per table (LRU)
+
 # Upload Settings - SUPERCHARGED
 UPLOAD_CHUNK_SIZE = 1048576  # 1MB chunks (doubled)
-MAX_RETRIES = 25  # More retries for stability
-FRAGMENT_RETRIES = 25
+MAX_RETRIES = 5  # Whole-request retries, with backoff (retry_policy)
+FRAGMENT_RETRIES = 10  # Per-fragment retries, with backoff
 CONNECTION_TIMEOUT = 3600  # 60 minutes
 
 # Advanced Speed Settings
@@ -50,15 +132,43 @@ CONNECTION_POOL_SIZE = 100  # Massive pool for parallel connections
 CONNECTION_POOL_PER_HOST = 50
 DNS_CACHE_TTL = 600  # 10 minutes
 
+# Pre-flight Probing (HEAD / Range GET before the batch starts)
+PREFLIGHT_ENABLED = True
+PREFLIGHT_CONCURRENCY = 32
+PREFLIGHT_WINDOW = 64  # Items probed ahead of the download cursor, one window at a time
+PREFLIGHT_TIMEOUT = 10  # Seconds per probe
+PREFLIGHT_CACHE_TTL = 1800  # Seconds
+MANIFEST_MAX_BYTES = 2097152  # 2MB cap when reading HLS/DASH manifests
+ESTIMATE_SAMPLE_SIZE = 200  # Items probed for the batch size/ETA estimate
+
 # Thumbnail Settings
-THUMBNAIL_TIME = "00:00:05"
 THUMBNAIL_SIZE = "640:360"  # Better quality
 THUMBNAIL_QUALITY = 2
+THUMBNAIL_SCAN_FRAMES = 25  # Frames decoded after the seek to pick a non-blank one
+THUMBNAIL_TIMEOUT = 15  # Seconds per ffmpeg run
+THUMBNAIL_WORKERS = max(2, os.cpu_count() or 2)  # Concurrent ffmpeg thumbnail jobs
+
+# Metadata/thumbnail prefetch from the remote URL while downloading
+PREFETCH_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.mov', '.m3u8', '.mpd', '.ts')
+REMOTE_PROBE_TIMEOUT = 15  # Seconds of network inactivity before ffprobe gives up
+PREFETCH_CANCEL_WAIT = 5  # Seconds to wait for a cancelled prefetch's ffmpeg/ffprobe to exit
+
+# In-place moov relocation (faststart) copy window
+FASTSTART_COPY_CHUNK = 8388608  # 8MB
 
 # File Splitting Settings
 MAX_FILE_SIZE = 1990  # MB (Telegram limit is 2GB, keep buffer)
 SPLIT_FILE_SIZE = 1900  # MB per part
 
+# Fit Mode (re-encode oversized videos into ONE file under MAX_FILE_SIZE)
+FIT_SIZE_MARGIN = 0.94  # Keep headroom for container overhead and rate control
+FIT_AUDIO_BITRATE = 128  # kbps
+FIT_MIN_VIDEO_BITRATE = 300  # kbps, below this splitting looks better
+FIT_MIN_CHUNK_SECONDS = 30  # Smallest keyframe-cut chunk per encoder job
+FIT_X264_PRESET = "veryfast"
+FIT_STEP_TIMEOUT = 7200  # Seconds per ffmpeg step
+REMUX_TIMEOUT = 1800  # Seconds for a stream-copy remux of a native HLS download
+
 # YouTube Support
 YOUTUBE_DLP_OPTS = {
     'format': 'best[height<=1080]',
@@ -66,6 +176,12 @@ YOUTUBE_DLP_OPTS = {
     'ignoreerrors': True,
     'extract_flat': False,
 }
+YOUTUBE_INFO_TTL = 1800  # Seconds extracted formats are reused (stream URLs expire)
+YOUTUBE_INFO_CACHE_SIZE = 256  # Videos kept in the extraction cache
+
+# Session Settings
+SESSION_SPILL_AFTER = 900  # Seconds idle before a session's items are spilled to disk
+SESSION_JANITOR_INTERVAL = 60  # Seconds between idle session scans
 
 # Progress Update Settings
 PROGRESS_UPDATE_INTERVAL = 0.5  # Seconds (faster updates)
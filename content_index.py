@@ -0,0 +1,61 @@
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+from config import CONTENT_INDEX_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class ContentIndex:
+    """
+    Per-chat index of already delivered content: by source URL and by the
+    BLAKE2b digest computed while downloading. Lets identical files (same
+    URL, or same bytes behind different CDN URLs) be re-sent with
+    copy_message instead of being uploaded again.
+    """
+    
+    def __init__(self, max_entries: int = CONTENT_INDEX_SIZE):
+        self.max_entries = max_entries
+        self._by_url: 'OrderedDict[Tuple[int, str], int]' = OrderedDict()
+        self._by_digest: 'OrderedDict[Tuple[int, str], int]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _get(table: OrderedDict, key) -> Optional[int]:
+        message_id = table.get(key)
+        if message_id is not None:
+            table.move_to_end(key)
+        return message_id
+    
+    def _put(self, table: OrderedDict, key, message_id: int):
+        table[key] = message_id
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+    
+    def lookup_url(self, chat_id: int, url: str) -> Optional[int]:
+        """Message id that already delivered this URL to the chat"""
+        message_id = self._get(self._by_url, (chat_id, url))
+        if message_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return message_id
+    
+    def lookup_digest(self, chat_id: int, digest: Optional[str]) -> Optional[int]:
+        """Message id that already delivered identical bytes to the chat"""
+        if not digest:
+            return None
+        message_id = self._get(self._by_digest, (chat_id, digest))
+        if message_id is not None:
+            self.hits += 1
+        return message_id
+    
+    def remember(self, chat_id: int, url: str, message_id: int, digest: Optional[str] = None):
+        self._put(self._by_url, (chat_id, url), message_id)
+        if digest:
+            self._put(self._by_digest, (chat_id, digest), message_id)
+
+
+content_index = ContentIndex()
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import Message, InlineKeyboardMarkup
+from config import DASHBOARD_INTERVAL, DASHBOARD_MAX_ACTIVE
+from utils import format_size, format_time
+from metrics import record_floodwait
+
+logger = logging.getLogger(__name__)
+
+_TELEGRAM_TEXT_LIMIT = 4096
+
+
+class ItemProgress:
+    """
+    Stand-in for a per-item progress message: edit_text()/delete() calls
+    from the download/upload code only update the batch dashboard.
+    """
+
+    def __init__(self, dashboard: 'BatchDashboard', idx: int, title: str):
+        self.dashboard = dashboard
+        self.idx = idx
+        self.title = title
+        self.text = "⏳ Queued"
+        self.started = time.time()
+
+    async def edit_text(self, text: str, *args, **kwargs) -> 'ItemProgress':
+        self.text = text
+        self.dashboard.changed = True
+        return self
+
+    edit = edit_text
+
+    async def delete(self, *args, **kwargs) -> bool:
+        self.dashboard.finish(self.idx)
+        return True
+
+    def summary(self) -> List[str]:
+        """Compact status lines for the dashboard"""
+        lines = [line.replace("**", "").strip() for line in self.text.splitlines()]
+        return [line for line in lines if line][:4]
+
+
+class BatchDashboard:
+    """
+    One persistent message per batch showing active items, counters,
+    throughput and ETA. Re-rendered at most every DASHBOARD_INTERVAL
+    seconds and only when something changed; the Stop button stays on it.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        header: str,
+        total: int,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        rate_source=None
+    ):
+        self.message = message
+        self.header = header
+        self.total = total
+        self.reply_markup = reply_markup
+        self.rate_source = rate_source
+        self.active: Dict[int, ItemProgress] = {}
+        self.success = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.time()
+        self.changed = True
+        self.edits = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def item(self, idx: int, title: str) -> ItemProgress:
+        """Register an item entering the pipeline"""
+        progress = ItemProgress(self, idx, title)
+        self.active[idx] = progress
+        self.changed = True
+        return progress
+
+    def finish(self, idx: int):
+        if self.active.pop(idx, None) is not None:
+            self.changed = True
+
+    def counts(self, success: int, failed: int, skipped: int = 0):
+        if (success, failed, skipped) != (self.success, self.failed, self.skipped):
+            self.success, self.failed, self.skipped = success, failed, skipped
+            self.changed = True
+
+    def render(self, final: Optional[str] = None) -> str:
+        done = self.success + self.failed + self.skipped
+        elapsed = time.time() - self.started
+        eta = int(elapsed / done * (self.total - done)) if done else 0
+        rate = getattr(self.rate_source, 'rate', 0)
+
+        text = (
+            f"{self.header}\n\n"
+            f"✔️ Success: {self.success} | ❌ Failed: {self.failed}"
+            + (f" | ⏭️ Skipped: {self.skipped}" if self.skipped else "")
+            + f" | 📦 {done}/{self.total}\n"
+            f"🚀 Throughput: {format_size(int(rate))}/s\n"
+            f"⏱️ Elapsed: {format_time(int(elapsed))}"
+            + (f" | ETA: {format_time(eta)}" if eta and not final else "")
+        )
+
+        if final:
+            return f"{text}\n\n{final}"
+
+        if self.active:
+            blocks = []
+            for progress in list(self.active.values())[:DASHBOARD_MAX_ACTIVE]:
+                status = "\n".join(f"   {line}" for line in progress.summary())
+                blocks.append(f"▶️ #{progress.idx} {progress.title[:40]}\n{status}")
+            hidden = len(self.active) - DASHBOARD_MAX_ACTIVE
+            if hidden > 0:
+                blocks.append(f"… and {hidden} more")
+            text += "\n\n" + "\n\n".join(blocks)
+
+        return text[:_TELEGRAM_TEXT_LIMIT]
+
+    async def _push(self, text: str):
+        try:
+            await self.message.edit_text(text, reply_markup=self.reply_markup)
+            self.edits += 1
+        except MessageNotModified:
+            pass
+        except FloodWait as e:
+            logger.warning(f"Dashboard flood wait {e.value}s")
+            record_floodwait('dashboard', e.value)
+            await asyncio.sleep(e.value)
+        except Exception as e:
+            logger.debug(f"Dashboard update error: {e}")
+
+    async def _run(self):
+        while True:
+            if self.changed:
+                self.changed = False
+                await self._push(self.render())
+            await asyncio.sleep(DASHBOARD_INTERVAL)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, final: str):
+        """Stop the renderer and leave the final state on the message"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.reply_markup = None
+        await self._push(self.render(final))
@@ -0,0 +1,116 @@
+import os
+import shutil
+import asyncio
+import logging
+from typing import Dict, List
+from config import DOWNLOAD_DIR, DISK_MIN_FREE, DISK_RECHECK_INTERVAL
+from utils import format_size
+
+logger = logging.getLogger(__name__)
+
+
+class Reservation:
+    """Bytes promised to one job, minus what it has already written"""
+    
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+        self.paths: List[str] = []
+    
+    def track(self, path: str):
+        """Count this file's (or directory's) size against the reservation"""
+        self.paths.append(str(path))
+    
+    def written(self) -> int:
+        total = 0
+        for path in self.paths:
+            try:
+                if os.path.isdir(path):
+                    # Whole tree: fit mode keeps its chunks in a subdirectory
+                    for root, _, files in os.walk(path):
+                        for name in files:
+                            try:
+                                total += os.path.getsize(os.path.join(root, name))
+                            except OSError:
+                                pass  # Removed while we walked
+                else:
+                    total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+    
+    def outstanding(self) -> int:
+        return max(0, self.nbytes - self.written())
+
+
+class DiskBudget:
+    """
+    Admission control for DOWNLOAD_DIR: every job reserves its expected
+    bytes before it starts and waits while free space minus outstanding
+    reservations would drop under DISK_MIN_FREE.
+    """
+    
+    def __init__(self, path, min_free: int):
+        self.path = str(path)
+        self.min_free = min_free
+        self.active: List[Reservation] = []
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+    
+    def _free(self) -> int:
+        return shutil.disk_usage(self.path).free
+    
+    def reserved(self) -> int:
+        return sum(r.outstanding() for r in self.active)
+    
+    def headroom(self) -> int:
+        """Bytes that can still be promised without hitting DISK_MIN_FREE"""
+        return self._free() - self.reserved() - self.min_free
+    
+    async def reserve(self, nbytes: int, on_wait=None) -> Reservation:
+        """Wait until nbytes fit on disk, then hold them for the caller"""
+        reservation = Reservation(nbytes)
+        async with self._cond:
+            notified = False
+            # A job larger than the whole disk still runs when it is alone
+            while self.active and self.headroom() < nbytes:
+                if not notified:
+                    notified = True
+                    logger.warning(
+                        f"💾 Disk pressure: need {format_size(nbytes)}, "
+                        f"headroom {format_size(self.headroom())}, holding job"
+                    )
+                    if on_wait:
+                        try:
+                            await on_wait()
+                        except Exception as e:
+                            logger.debug(f"Disk wait notify error: {e}")
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._cond.wait(), DISK_RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting -= 1
+            self.active.append(reservation)
+        return reservation
+    
+    async def release(self, reservation: Reservation):
+        async with self._cond:
+            if reservation in self.active:
+                self.active.remove(reservation)
+            self._cond.notify_all()
+    
+    def usage(self) -> Dict:
+        """Disk and reservation figures for monitoring"""
+        disk = shutil.disk_usage(self.path)
+        return {
+            'total': disk.total,
+            'used': disk.used,
+            'free': disk.free,
+            'reserved': self.reserved(),
+            'active_jobs': len(self.active),
+            'waiting_jobs': self.waiting,
+        }
+
+
+disk_budget = DiskBudget(DOWNLOAD_DIR, DISK_MIN_FREE)
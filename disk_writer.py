@@ -0,0 +1,277 @@
+import os
+import time
+import queue
+import hashlib
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+from config import (
+    WRITE_BUFFER_SIZE, WRITER_QUEUE_DEPTH, DIGEST_AHEAD_MAX, ADAPTIVE_CHUNK_MIN,
+    ADAPTIVE_CHUNK_MAX, ADAPTIVE_CHUNK_TARGET_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+_ALIGN = 4096
+
+# Content digest stored with each written file (xattr, or a sidecar file)
+DIGEST_XATTR = 'user.txt2upload.blake2b'
+DIGEST_SUFFIX = '.blake2b'
+
+
+def _new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def digest_bytes(data) -> str:
+    """Same digest as the writer computes, for in-memory downloads"""
+    hasher = _new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _hash_file(path: str) -> str:
+    hasher = _new_hasher()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(WRITE_BUFFER_SIZE)
+            if not block:
+                return hasher.hexdigest()
+            hasher.update(block)
+
+
+def store_digest(path: str, digest: str):
+    """Attach a content digest to a file"""
+    try:
+        os.setxattr(path, DIGEST_XATTR, digest.encode())
+    except (OSError, AttributeError):
+        with open(f"{path}{DIGEST_SUFFIX}", 'w') as f:
+            f.write(digest)
+
+
+def read_digest(path: str) -> Optional[str]:
+    """Digest recorded when the file was written, if any"""
+    try:
+        return os.getxattr(path, DIGEST_XATTR).decode()
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open(f"{path}{DIGEST_SUFFIX}") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class WriterStats:
+    """Process-wide writer figures: shows when the disk becomes the bottleneck"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active_writers = 0
+        self.queued_buffers = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.flush_latency = 0.0  # Smoothed seconds per pwrite
+        self.max_flush_latency = 0.0
+    
+    def record_flush(self, nbytes: int, seconds: float):
+        with self.lock:
+            self.flushes += 1
+            self.bytes_written += nbytes
+            self.queued_buffers -= 1
+            self.flush_latency = seconds if self.flushes == 1 else 0.2 * seconds + 0.8 * self.flush_latency
+            self.max_flush_latency = max(self.max_flush_latency, seconds)
+    
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'active_writers': self.active_writers,
+                'queue_depth': self.queued_buffers,
+                'flushes': self.flushes,
+                'bytes_written': self.bytes_written,
+                'flush_latency_ms': self.flush_latency * 1000,
+                'max_flush_latency_ms': self.max_flush_latency * 1000,
+            }
+
+
+writer_stats = WriterStats()
+
+
+def adaptive_chunk_size(bytes_per_second: float) -> int:
+    """Network read size that covers ~ADAPTIVE_CHUNK_TARGET_SECONDS of traffic"""
+    target = int(bytes_per_second * ADAPTIVE_CHUNK_TARGET_SECONDS)
+    size = ADAPTIVE_CHUNK_MIN
+    while size < target and size < ADAPTIVE_CHUNK_MAX:
+        size *= 2
+    return size
+
+
+class BufferedFileWriter:
+    """
+    Collects network chunks into large aligned buffers and writes them with
+    os.pwrite from ONE dedicated thread, instead of a thread-pool hop per
+    chunk. The file is preallocated when the final size is known, and a
+    BLAKE2b digest is computed on the same thread as the bytes are written.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, path: str, expected_size: int = 0):
+        self.path = str(path)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.offset = 0
+        self.buffer = bytearray()
+        self.error: Optional[BaseException] = None
+        self.digest: Optional[str] = None
+        self._hasher = _new_hasher()
+        self._hashed = 0  # Bytes fed to the hasher, in file order
+        self._ahead: Optional[Dict[int, bytes]] = {}  # Blocks written past the hashed prefix (None: over the cap)
+        self._ahead_bytes = 0
+        self._finished = False
+        self._expected_size = expected_size
+        self._queue: queue.Queue = queue.Queue(maxsize=WRITER_QUEUE_DEPTH)
+        
+        self._thread = threading.Thread(target=self._run, name="disk-writer", daemon=True)
+        self._thread.start()
+        with writer_stats.lock:
+            writer_stats.active_writers += 1
+    
+    def _preallocate(self):
+        # On the writer thread: a multi-GB fallocate on slow storage must not stall the loop
+        if self._expected_size > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, self._expected_size)
+            except OSError as e:
+                logger.debug(f"Preallocation skipped for {self.path}: {e}")
+    
+    def _run(self):
+        self._preallocate()
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            offset, data = item
+            if self.error:
+                with writer_stats.lock:
+                    writer_stats.queued_buffers -= 1
+                continue
+            start = time.perf_counter()
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(self.fd, view, offset)
+                    view = view[written:]
+                    offset += written
+                self._hash_block(offset - len(data), data)
+            except OSError as e:
+                self.error = e
+            writer_stats.record_flush(len(data), time.perf_counter() - start)
+    
+    def _hash_block(self, start: int, data: bytes):
+        """
+        Extend the in-order digest. Blocks written ahead of it (parallel
+        ranges) wait in memory until the prefix reaches them; past
+        DIGEST_AHEAD_MAX the file is hashed once at close instead.
+        """
+        if self._ahead is None:
+            return
+        end = start + len(data)
+        if end <= self._hashed:
+            return
+        if start > self._hashed:
+            held = self._ahead.get(start)
+            if held is None or len(held) < len(data):
+                self._ahead_bytes += len(data) - (len(held) if held else 0)
+                self._ahead[start] = data
+            if self._ahead_bytes > DIGEST_AHEAD_MAX:
+                logger.debug(f"Digest of {self.path} deferred to close: too many blocks out of order")
+                self._ahead = None
+                self._ahead_bytes = 0
+            return
+        self._hasher.update(memoryview(data)[self._hashed - start:])
+        self._hashed = end
+        while True:
+            reached = sorted(s for s in self._ahead if s <= self._hashed)
+            if not reached:
+                return
+            for s in reached:
+                block = self._ahead.pop(s)
+                self._ahead_bytes -= len(block)
+                if s + len(block) > self._hashed:
+                    self._hasher.update(memoryview(block)[self._hashed - s:])
+                    self._hashed = s + len(block)
+    
+    async def _enqueue(self, data: bytes, offset: Optional[int] = None):
+        with writer_stats.lock:
+            writer_stats.queued_buffers += 1
+        if offset is None:
+            offset = self.offset
+        item = (offset, data)
+        self.offset = max(self.offset, offset + len(data))
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Disk is slower than the network: wait for the writer thread
+            await asyncio.get_running_loop().run_in_executor(None, self._queue.put, item)
+    
+    async def write(self, chunk: bytes):
+        """Buffer a chunk; full WRITE_BUFFER_SIZE blocks go to the writer thread"""
+        if self.error:
+            raise self.error
+        self.buffer += chunk
+        if len(self.buffer) >= WRITE_BUFFER_SIZE:
+            cut = len(self.buffer) - len(self.buffer) % _ALIGN
+            data = bytes(self.buffer[:cut])
+            del self.buffer[:cut]
+            await self._enqueue(data)
+    
+    async def write_at(self, offset: int, data: bytes):
+        """Queue a block for an explicit offset (segmented downloads)"""
+        if self.error:
+            raise self.error
+        await self._enqueue(data, offset)
+    
+    async def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        await asyncio.get_running_loop().run_in_executor(None, self._queue.put, self._STOP)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        with writer_stats.lock:
+            writer_stats.active_writers -= 1
+    
+    def _close_fd(self):
+        # Once only: a second os.close could hit an fd another thread reopened
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+    
+    async def close(self):
+        """Flush the tail, trim preallocated space and close the file"""
+        try:
+            if self.buffer:
+                await self._enqueue(bytes(self.buffer))
+                self.buffer.clear()
+            await self._finish()
+            if self.error:
+                raise self.error
+            os.ftruncate(self.fd, self.offset)
+            if self._ahead is not None and self._hashed == self.offset:
+                self.digest = self._hasher.hexdigest()
+            else:
+                # Too much arrived out of order, or a gap the ranges never filled
+                self.digest = await asyncio.get_running_loop().run_in_executor(None, _hash_file, self.path)
+            store_digest(self.path, self.digest)
+        finally:
+            self._close_fd()
+    
+    async def abort(self):
+        """Stop writing and remove the partial file"""
+        self.error = self.error or OSError("aborted")
+        await self._finish()
+        self._close_fd()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
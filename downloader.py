@@ -2,21 +2,30 @@ import os
 import ssl
 import asyncio
 import aiohttp
-import aiofiles
-import yt_dlp
 import logging
 import time
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 from pyrogram.types import Message
 from config import (
-    DOWNLOAD_DIR, CHUNK_SIZE, CONCURRENT_FRAGMENTS, 
+    DOWNLOAD_DIR, CONCURRENT_FRAGMENTS, 
     MAX_RETRIES, FRAGMENT_RETRIES, CONNECTION_TIMEOUT,
     HTTP_CHUNK_SIZE, BUFFER_SIZE, DYNAMIC_WORKERS,
     MIN_WORKERS, MAX_WORKERS, WORKER_ADJUST_THRESHOLD,
-    CONNECTION_POOL_SIZE, CONNECTION_POOL_PER_HOST, DNS_CACHE_TTL
+    CONNECTION_POOL_SIZE, CONNECTION_POOL_PER_HOST, DNS_CACHE_TTL,
+    STALL_MIN_RATE, YTDLP_SOCKET_TIMEOUT, NATIVE_HLS
 )
-from utils import format_size, format_time, create_progress_bar
+from utils import format_size, format_time, create_progress_bar, get_video_extension, is_youtube_url
+from disk_writer import BufferedFileWriter, adaptive_chunk_size, digest_bytes, store_digest, DIGEST_SUFFIX
+from memory_pool import MemoryFile, open_memory_file
+from hedged_fetch import HedgedRangeFetcher, can_split
+from retry_policy import circuit_breaker, record_outcome, is_retryable, backoff_delay
+from ydl_pool import ydl_pool
+from hls_fetch import HlsFetcher, HlsUnsupported
+from preflight import is_direct_media
+from video_processor import remux_to_mp4, merge_av
+from metrics import timed, record_transfer, host_label
+import youtube
 
 logger = logging.getLogger(__name__)
 
@@ -62,105 +71,542 @@ class DynamicWorkerManager:
 worker_manager = DynamicWorkerManager()
 
 
-async def download_file(
+class ThroughputTracker:
+    """Smoothed download throughput (bytes/s) measured over finished jobs"""
+    
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.rate = 0.0
+    
+    def record(self, nbytes: int, seconds: float, url: str = ''):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        if url:
+            record_transfer('download', host_label(url), nbytes, seconds)
+        sample = nbytes / seconds
+        self.rate = sample if self.rate == 0 else self.alpha * sample + (1 - self.alpha) * self.rate
+    
+    def eta(self, nbytes: int) -> int:
+        """Seconds to download nbytes at the measured rate (0 = unknown)"""
+        return int(nbytes / self.rate) if self.rate > 0 else 0
+
+
+throughput = ThroughputTracker()
+
+# Video download engines, cheapest first
+ROUTE_DIRECT, ROUTE_HLS, ROUTE_DASH, ROUTE_YOUTUBE, ROUTE_YTDLP = 'direct', 'hls', 'dash', 'youtube', 'yt-dlp'
+DIRECT_VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mkv', '.webm', '.mov')
+
+
+class RouteStats:
+    """Video items per download engine, and native attempts handed to yt-dlp"""
+    
+    def __init__(self):
+        self.counts = {route: 0 for route in (ROUTE_DIRECT, ROUTE_HLS, ROUTE_DASH, ROUTE_YOUTUBE, ROUTE_YTDLP)}
+        self.fallbacks = 0
+
+
+route_stats = RouteStats()
+
+FILE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0',
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Cache-Control': 'no-cache'
+}
+
+# Long-lived session for small in-memory downloads (no per-file pool setup)
+_memory_session: Optional[aiohttp.ClientSession] = None
+
+
+def _ssl_context() -> ssl.SSLContext:
+    # Enhanced SSL context with better performance
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')
+    return ssl_context
+
+
+def _new_session(ssl_context: ssl.SSLContext) -> aiohttp.ClientSession:
+    """Per-download session with a large keep-alive pool"""
+    # ULTRA-OPTIMIZED connector
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=CONNECTION_POOL_SIZE,
+        limit_per_host=CONNECTION_POOL_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        force_close=False,
+        enable_cleanup_closed=True,
+        keepalive_timeout=300,  # 5 minutes keepalive
+    )
+    
+    timeout = aiohttp.ClientTimeout(
+        total=CONNECTION_TIMEOUT,
+        connect=30,
+        sock_read=60
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def _download_file_once(
     url: str, 
     filename: str, 
-    progress_msg: Message, 
+    progress_msg: Optional[Message], 
     user_id: int,
-    active_downloads: Dict[int, bool]
+    active_downloads: Dict[int, bool],
+    dest_dir: Path = DOWNLOAD_DIR
 ) -> Optional[str]:
-    """ULTRA-FAST file downloader with 6x speed improvements"""
-    filepath = DOWNLOAD_DIR / filename
+    """One download attempt: raises on HTTP/network errors, None when cancelled"""
+    filepath = Path(dest_dir) / filename
     
-    try:
-        # Enhanced SSL context with better performance
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')
-        
-        # ULTRA-OPTIMIZED connector
-        connector = aiohttp.TCPConnector(
-            ssl=ssl_context,
-            limit=CONNECTION_POOL_SIZE,
-            limit_per_host=CONNECTION_POOL_PER_HOST,
-            ttl_dns_cache=DNS_CACHE_TTL,
-            force_close=False,
-            enable_cleanup_closed=True,
-            keepalive_timeout=300,  # 5 minutes keepalive
-        )
-        
-        timeout = aiohttp.ClientTimeout(
-            total=CONNECTION_TIMEOUT,
-            connect=30,
-            sock_read=60
-        )
+    ssl_context = _ssl_context()
+    
+    async with _new_session(ssl_context) as session:
+        headers = FILE_HEADERS
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0',
-                'Accept': '*/*',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Cache-Control': 'no-cache'
-            }
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history,
+                    status=response.status, message=response.reason or ""
+                )
             
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"HTTP {response.status} for {url}")
-                    return None
-                
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded = 0
-                start_time = time.time()
-                last_update = 0
-                update_threshold = 256 * 1024  # Update every 256KB (more frequent)
-                
-                # Use larger write buffer for speed
-                async with aiofiles.open(filepath, 'wb', buffering=BUFFER_SIZE) as f:
-                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            total_size = int(response.headers.get('content-length', 0))
+            downloaded = 0
+            start_time = time.time()
+            last_update = 0
+            update_threshold = 256 * 1024  # Update every 256KB (more frequent)
+            
+            async def report(done: int):
+                if progress_msg is None:
+                    return  # Album members download quietly
+                try:
+                    percent = (done / total_size * 100) if total_size > 0 else 0
+                    elapsed = time.time() - start_time
+                    speed = done / elapsed if elapsed > 0 else 0
+                    
+                    eta = int((total_size - done) / speed) if speed > 0 else 0
+                    bar = create_progress_bar(percent)
+                    
+                    await progress_msg.edit_text(
+                        f"⚡ **ULTRA-FAST DOWNLOADING**\n\n"
+                        f"{bar}\n\n"
+                        f"📦 {format_size(done)} / {format_size(total_size)}\n"
+                        f"🚀 Speed: {format_size(int(speed))}/s\n"
+                        f"⏱️ ETA: {format_time(eta)}\n"
+                        f"💪 Workers: {worker_manager.current_workers}"
+                    )
+                except Exception as e:
+                    logger.debug(f"Progress update error: {e}")
+            
+            # Batched pwrite from a dedicated writer thread, preallocated
+            writer = BufferedFileWriter(filepath, total_size)
+            chunk_size = adaptive_chunk_size(throughput.rate)
+            last_resize = start_time
+            try:
+                if can_split(response, total_size):
+                    # Parallel ranges, slow ones hedged on a fresh connection
+                    fetcher = HedgedRangeFetcher(
+                        session, url, headers, total_size, writer, ssl_context, chunk_size
+                    )
+                    if not await fetcher.run(
+                        response, lambda: active_downloads.get(user_id, False), report
+                    ):
+                        if active_downloads.get(user_id, False):
+                            raise aiohttp.ClientPayloadError("range download failed")
+                        return None
+                    downloaded = fetcher.downloaded()
+                else:
+                    while True:
+                        chunk = await response.content.read(chunk_size)
+                        if not chunk:
+                            break
+                        
                         if not active_downloads.get(user_id, False):
-                            if filepath.exists():
-                                os.remove(filepath)
                             return None
                         
-                        await f.write(chunk)
+                        await writer.write(chunk)
                         downloaded += len(chunk)
                         
+                        # Re-pick the read size from the live throughput
+                        now = time.time()
+                        if now - last_resize >= 1:
+                            last_resize = now
+                            chunk_size = adaptive_chunk_size(downloaded / (now - start_time))
+                        
                         # More frequent progress updates
                         if downloaded - last_update >= update_threshold:
                             last_update = downloaded
-                            try:
-                                percent = (downloaded / total_size * 100) if total_size > 0 else 0
-                                elapsed = time.time() - start_time
-                                speed = downloaded / elapsed if elapsed > 0 else 0
-                                
-                                eta = int((total_size - downloaded) / speed) if speed > 0 else 0
-                                bar = create_progress_bar(percent)
-                                
-                                await progress_msg.edit_text(
-                                    f"⚡ **ULTRA-FAST DOWNLOADING**\n\n"
-                                    f"{bar}\n\n"
-                                    f"📦 {format_size(downloaded)} / {format_size(total_size)}\n"
-                                    f"🚀 Speed: {format_size(int(speed))}/s\n"
-                                    f"⏱️ ETA: {format_time(eta)}\n"
-                                    f"💪 Workers: {worker_manager.current_workers}"
-                                )
-                            except Exception as e:
-                                logger.debug(f"Progress update error: {e}")
-                
-                if filepath.exists() and filepath.stat().st_size > 1024:
-                    return str(filepath)
-                return None
+                            await report(downloaded)
                 
-    except asyncio.TimeoutError:
-        logger.error(f"Download timeout for {url}")
+                await writer.close()
+                writer = None
+            finally:
+                if writer:
+                    await writer.abort()
+            
+            if filepath.exists() and filepath.stat().st_size > 1024:
+                throughput.record(downloaded, time.time() - start_time, url)
+                return str(filepath)
+            return None
+
+
+async def download_file(
+    url: str, 
+    filename: str, 
+    progress_msg: Optional[Message], 
+    user_id: int,
+    active_downloads: Dict[int, bool],
+    dest_dir: Path = DOWNLOAD_DIR
+) -> Optional[str]:
+    """ULTRA-FAST file downloader with 6x speed improvements"""
+    return await _with_retries(
+        url, user_id, active_downloads,
+        lambda: _download_file_once(url, filename, progress_msg, user_id, active_downloads, dest_dir)
+    )
+
+
+async def _with_retries(url: str, user_id: int, active_downloads: Dict[int, bool], attempt_fn):
+    """Run attempt_fn under the shared retry policy and circuit breaker"""
+    if not circuit_breaker.allow(url):
+        logger.warning(f"Circuit open, skipping {url}")
         return None
+    
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            result = await attempt_fn()
+            if result:
+                record_outcome(url)  # None = cancelled or too small: no verdict on the host
+            return result
+        except HlsUnsupported:
+            raise  # Not a network failure: the caller switches engines
+        except Exception as e:
+            if (
+                not is_retryable(e) or attempt == MAX_RETRIES
+                or not active_downloads.get(user_id, False)
+            ):
+                logger.error(f"File download error: {e or type(e).__name__} ({url})")
+                record_outcome(url, e.status if isinstance(e, aiohttp.ClientResponseError) else e)
+                return None
+            
+            delay = backoff_delay(attempt)
+            logger.warning(f"🔁 Retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s for {url}: {e or type(e).__name__}")
+            await asyncio.sleep(delay)
+
+
+async def _download_hls_once(
+    url: str,
+    quality: str,
+    filename: str,
+    progress_msg: Optional[Message],
+    user_id: int,
+    active_downloads: Dict[int, bool],
+    dest_dir: Path
+) -> Optional[str]:
+    """One native HLS attempt: segments to a TS/fMP4 file, then a stream-copy remux"""
+    dest_dir = Path(dest_dir)
+    
+    async with _new_session(_ssl_context()) as session:
+        fetcher = HlsFetcher(
+            session, url, FILE_HEADERS,
+            int(quality) if quality.isdigit() else 1080,
+            worker_manager.current_workers
+        )
+        fmp4 = await fetcher.resolve()
+        raw_path = dest_dir / f"{Path(filename).stem}.hls{'.mp4' if fmp4 else '.ts'}"
+        start_time = time.time()
+        last_update = 0.0
+        
+        async def report(f: HlsFetcher):
+            nonlocal last_update
+            now = time.time()
+            if progress_msg is None or now - last_update < 1:
+                return
+            last_update = now
+            try:
+                total = len(f.segments)
+                speed = f.downloaded / max(now - start_time, 1e-3)
+                eta = int((now - start_time) / f.done_segments * (total - f.done_segments))
+                await progress_msg.edit_text(
+                    f"📺 **NATIVE HLS DOWNLOAD**\n\n"
+                    f"{create_progress_bar(f.done_segments / total * 100)}\n\n"
+                    f"🧩 Segments: {f.done_segments}/{total} ({format_size(f.downloaded)})\n"
+                    f"🚀 Speed: {format_size(int(speed))}/s\n"
+                    f"⏱️ ETA: {format_time(eta)}\n"
+                    f"💪 Workers: {fetcher.concurrency}"
+                )
+            except Exception as e:
+                logger.debug(f"Progress update error: {e}")
+        
+        writer = BufferedFileWriter(raw_path)
+        try:
+            if not await fetcher.run(writer, lambda: active_downloads.get(user_id, False), report):
+                return None
+            await writer.close()
+            digest = writer.digest
+            writer = None
+        finally:
+            if writer:
+                await writer.abort()
+    
+    try:
+        final_path = dest_dir / filename
+        if not await asyncio.get_running_loop().run_in_executor(None, remux_to_mp4, str(raw_path), str(final_path)):
+            raise HlsUnsupported("remux failed")
+        # The segment bytes identify the video; the remux is a pure function of them
+        if digest:
+            store_digest(str(final_path), digest)
+    finally:
+        raw_path.unlink(missing_ok=True)
+        Path(f"{raw_path}{DIGEST_SUFFIX}").unlink(missing_ok=True)
+    
+    throughput.record(fetcher.downloaded, time.time() - start_time, url)
+    logger.info(f"✅ HLS ready: {final_path} ({len(fetcher.segments)} segments, {format_size(fetcher.downloaded)})")
+    return str(final_path)
+
+
+def pick_route(url: str, probe: Optional[Dict] = None) -> str:
+    """Cheapest engine for a video URL, from its probe and extension"""
+    if is_youtube_url(url):
+        return ROUTE_YOUTUBE
+    
+    path = url.split('?', 1)[0].lower()
+    content_type = (probe or {}).get('content_type', '').lower()
+    
+    if 'mpegurl' in content_type or path.endswith('.m3u8'):
+        return ROUTE_HLS
+    if 'dash+xml' in content_type or path.endswith('.mpd'):
+        return ROUTE_DASH
+    if is_direct_media(probe) or (path.endswith(DIRECT_VIDEO_EXTENSIONS) and not content_type.startswith('text/')):
+        return ROUTE_DIRECT
+    return ROUTE_YTDLP
+
+
+@timed('download')
+async def download_routed(
+    url: str,
+    quality: str,
+    filename: str,
+    progress_msg: Message,
+    user_id: int,
+    active_downloads: Dict[int, bool],
+    download_progress: Dict[int, dict],
+    dest_dir: Path = DOWNLOAD_DIR,
+    probe: Optional[Dict] = None
+) -> Optional[str]:
+    """Download a video with the cheapest engine that can handle it"""
+    route = pick_route(url, probe)
+    if route == ROUTE_HLS and not NATIVE_HLS:
+        route = ROUTE_YTDLP
+    route_stats.counts[route] += 1
+    logger.info(f"🧭 Route {route}: {url}")
+    
+    if route == ROUTE_DIRECT:
+        # Plain media file: no extraction, ranged HTTP straight to disk
+        return await download_file(
+            url, f"{Path(filename).stem}{get_video_extension(url)}",
+            progress_msg, user_id, active_downloads, dest_dir
+        )
+    
+    if route == ROUTE_YOUTUBE:
+        return await download_youtube(
+            url, quality, filename, progress_msg,
+            user_id, active_downloads, download_progress, dest_dir
+        )
+    
+    if route == ROUTE_HLS:
+        try:
+            return await _with_retries(
+                url, user_id, active_downloads,
+                lambda: _download_hls_once(url, quality, filename, progress_msg, user_id, active_downloads, dest_dir)
+            )
+        except HlsUnsupported as e:
+            route_stats.fallbacks += 1
+            logger.info(f"↪️ Native HLS skipped ({e}), using yt-dlp: {url}")
+    
+    # DASH (audio/video merge) and pages that need extraction
+    return await download_video(
+        url, quality, filename, progress_msg,
+        user_id, active_downloads, download_progress, dest_dir
+    )
+
+
+async def download_youtube(
+    url: str,
+    quality: str,
+    filename: str,
+    progress_msg: Message,
+    user_id: int,
+    active_downloads: Dict[int, bool],
+    download_progress: Dict[int, dict],
+    dest_dir: Path = DOWNLOAD_DIR
+) -> Optional[str]:
+    """
+    YouTube without the generic pipeline: a progressive format when one
+    reaches the wanted height, else video and audio streams fetched in
+    parallel and stream-copy merged. 'UNSUPPORTED' sends the link instead.
+    """
+    dest_dir = Path(dest_dir)
+    stem = Path(filename).stem
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+    
+    try:
+        await progress_msg.edit_text("🔎 Reading YouTube formats...")
+        info = await loop.run_in_executor(None, youtube.extract_info, url)
+        formats = youtube.pick_formats(info, int(quality) if quality.isdigit() else 1080) if info else []
+        if not formats:
+            record_outcome(url, "video unavailable")
+            return 'UNSUPPORTED'
+        
+        # Per-stream byte counts feed the usual video progress display
+        streams: Dict[str, Tuple[int, int, float]] = {}
+        
+        def make_hook(format_id: str):
+            def hook(d):
+                if not active_downloads.get(user_id, False):
+                    raise Exception("Download cancelled by user")
+                if d['status'] != 'downloading':
+                    return
+                total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                streams[format_id] = (d.get('downloaded_bytes', 0), total, d.get('speed') or 0)
+                done = sum(s[0] for s in streams.values())
+                size = sum(s[1] for s in streams.values())
+                speed = sum(s[2] for s in streams.values())
+                if size > 0:
+                    download_progress[user_id] = {
+                        'percent': done / size * 100,
+                        'downloaded': done,
+                        'total': size,
+                        'speed': speed,
+                        'eta': int((size - done) / speed) if speed else 0,
+                        'workers': len(formats)
+                    }
+            return hook
+        
+        download_progress[user_id] = {'percent': 0}
+        progress_task = asyncio.create_task(
+            update_video_progress(progress_msg, user_id, download_progress, active_downloads)
+        )
+        try:
+            paths = [str(dest_dir / f"{stem}.f{f['format_id']}.{f['ext']}") for f in formats]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(None, youtube.download_stream, info, f, path, make_hook(f['format_id']))
+                for f, path in zip(formats, paths)
+            ), return_exceptions=True)
+        finally:
+            progress_task.cancel()
+            download_progress.pop(user_id, None)
+        
+        if not active_downloads.get(user_id, False):
+            return None
+        errors = [r for r in results if r is not True]
+        if errors:
+            error = next((e for e in errors if isinstance(e, BaseException)), "stream download failed")
+            logger.error(f"YouTube download error: {error} ({url})")
+            record_outcome(url, error)
+            return None
+        
+        if len(formats) == 1:
+            final_path = dest_dir / f"{stem}.{formats[0]['ext']}"
+            os.rename(paths[0], final_path)
+        else:
+            await progress_msg.edit_text("🔗 Merging video and audio...")
+            final_path = dest_dir / f"{stem}.{youtube.merged_extension(*formats)}"
+            merged = await loop.run_in_executor(None, merge_av, paths[0], paths[1], str(final_path))
+            for path in paths:
+                Path(path).unlink(missing_ok=True)
+            if not merged:
+                return None
+        
+        record_outcome(url)
+        size = final_path.stat().st_size
+        throughput.record(size, time.time() - start_time, url)
+        kind = "progressive" if len(formats) == 1 else "video+audio"
+        logger.info(f"✅ YouTube ready ({kind} {formats[0].get('height')}p): {final_path} ({format_size(size)})")
+        return str(final_path)
+    
     except Exception as e:
-        logger.error(f"File download error: {e}")
+        logger.error(f"YouTube download error: {e}")
+        download_progress.pop(user_id, None)
         return None
 
 
+def _get_memory_session() -> aiohttp.ClientSession:
+    global _memory_session
+    if _memory_session is None or _memory_session.closed:
+        connector = aiohttp.TCPConnector(
+            ssl=_ssl_context(),
+            limit=CONNECTION_POOL_SIZE,
+            limit_per_host=CONNECTION_POOL_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=300,
+        )
+        _memory_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=300, connect=30, sock_read=60)
+        )
+    return _memory_session
+
+
+async def _download_to_memory_once(
+    url: str,
+    target: MemoryFile,
+    user_id: int,
+    active_downloads: Dict[int, bool]
+) -> bool:
+    start_time = time.time()
+    async with _get_memory_session().get(url, headers=FILE_HEADERS) as response:
+        if response.status != 200:
+            raise aiohttp.ClientResponseError(
+                response.request_info, response.history,
+                status=response.status, message=response.reason or ""
+            )
+        
+        buffer = target.buffer
+        size = 0
+        async for chunk in response.content.iter_any():
+            if not active_downloads.get(user_id, False):
+                return False
+            end = size + len(chunk)
+            if end > len(buffer):
+                # Bigger than the probe said: let the caller use the disk path
+                logger.info(f"In-memory download over {format_size(len(buffer))}, using disk: {url}")
+                return False
+            buffer[size:end] = chunk
+            size = end
+        
+        target.size = size
+        target.seek(0)
+        with memoryview(buffer) as view:
+            target.digest = digest_bytes(view[:size])
+        record_transfer('download', host_label(url), size, time.time() - start_time)
+        return size > 0
+
+
+async def download_to_memory(
+    url: str,
+    filename: str,
+    user_id: int,
+    active_downloads: Dict[int, bool]
+) -> Optional[MemoryFile]:
+    """Download a small file into a pooled buffer (None if it does not fit or fails)"""
+    target = open_memory_file(filename)
+    if target is None:
+        return None
+    
+    ok = await _with_retries(
+        url, user_id, active_downloads,
+        lambda: _download_to_memory_once(url, target, user_id, active_downloads)
+    )
+    if not ok:
+        target.close()
+        return None
+    return target
+
+
 def download_video_sync(
     url: str, 
     quality: str, 
@@ -228,22 +674,26 @@ def download_video_sync(
                 'Sec-Fetch-Mode': 'navigate',
             },
             
-            # Ultra-fast post-processing
+            # Stream-copy post-processing; faststart is handled in place
+            # by video_processor.ensure_faststart only when actually needed
             'postprocessor_args': {
-                'ffmpeg': [
-                    '-c', 'copy', 
-                    '-movflags', '+faststart',
-                    '-threads', '8',  # More threads
-                    '-preset', 'ultrafast'
-                ]
+                'ffmpeg': ['-c', 'copy']
             },
             
             'progress_hooks': [progress_hook],
             'extractor_retries': MAX_RETRIES,
             'file_access_retries': MAX_RETRIES,
+            'retry_sleep_functions': {
+                'http': lambda n: backoff_delay(n),
+                'fragment': lambda n: backoff_delay(n),
+                'extractor': lambda n: backoff_delay(n),
+            },
             
             # Additional ultra-speed settings
-            'socket_timeout': 60,
+            # Stall detection: a silent socket or a transfer under the
+            # throughput floor is dropped and retried instead of waited out
+            'socket_timeout': YTDLP_SOCKET_TIMEOUT,
+            'throttledratelimit': STALL_MIN_RATE,
             'hls_prefer_native': True,
             'external_downloader_args': [
                 '-threads', '8',
@@ -255,17 +705,20 @@ def download_video_sync(
             'source_address': '0.0.0.0',
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with ydl_pool.checkout(ydl_opts) as ydl:
             if not active_downloads.get(user_id, False):
                 return False
             
             logger.info(f"🚀 Starting ULTRA download: {url} with {current_workers} workers")
             ydl.download([url])
             logger.info(f"✅ Download completed: {url}")
+            record_outcome(url)
             return True
             
     except Exception as e:
         error_msg = str(e).lower()
+        if active_downloads.get(user_id, False):
+            record_outcome(url, e)
         # Check if it's a YouTube video or unsupported format
         if 'youtube' in error_msg or 'unsupported' in error_msg:
             logger.warning(f"Unsupported video type: {url}")
@@ -331,14 +784,17 @@ async def download_video(
     progress_msg: Message,
     user_id: int,
     active_downloads: Dict[int, bool],
-    download_progress: Dict[int, dict]
+    download_progress: Dict[int, dict],
+    dest_dir: Path = DOWNLOAD_DIR
 ) -> Optional[str]:
     """Download video with ULTRA-FAST speed and enhanced error handling"""
+    dest_dir = Path(dest_dir)
     temp_name = f"temp_{user_id}_{filename.replace('.mp4', '')}"
-    output_path = str(DOWNLOAD_DIR / temp_name)
+    output_path = str(dest_dir / temp_name)
     
     try:
         download_progress[user_id] = {'percent': 0}
+        start_time = time.time()
         
         await progress_msg.edit_text("🚀 Initializing ULTRA-FAST download...")
         
@@ -386,9 +842,9 @@ async def download_video(
             if p.exists() and p.stat().st_size > 10240:
                 possible_files.append(p)
         
-        # Check temp files
-        for file in DOWNLOAD_DIR.glob(f"temp_{user_id}_*"):
-            if file.is_file() and file.stat().st_size > 10240:
+        # Check this job's own temp files (never another job's)
+        for file in dest_dir.glob(f"{temp_name}*"):
+            if file.is_file() and not file.name.endswith('.part') and file.stat().st_size > 10240:
                 possible_files.append(file)
         
         if not possible_files:
@@ -397,7 +853,7 @@ async def download_video(
         
         # Get largest file (most complete)
         output_file = max(possible_files, key=lambda p: p.stat().st_size)
-        final_path = DOWNLOAD_DIR / filename
+        final_path = dest_dir / filename
         
         # Rename to final path
         if output_file != final_path:
@@ -406,6 +862,7 @@ async def download_video(
             final_path = output_file
         
         if final_path.exists() and final_path.stat().st_size > 10240:
+            throughput.record(final_path.stat().st_size, time.time() - start_time, url)
             logger.info(f"Video ready: {final_path} ({format_size(final_path.stat().st_size)})")
             return str(final_path)
         
@@ -1,14 +1,45 @@
 import os
 import asyncio
-import aiofiles
 import logging
+from itertools import chain, groupby
+from typing import Dict, Optional, Tuple
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from config import DOWNLOAD_DIR, QUALITY_MAP
-from utils import parse_content, sanitize_filename, is_youtube_url, create_failed_link_file
-from video_processor import get_video_info, generate_thumbnail, validate_video_file
-from downloader import download_video, download_file
-from uploader import upload_video, upload_photo, upload_document, send_failed_link
+from config import (
+    DOWNLOAD_DIR, QUALITY_MAP, MAX_FILE_SIZE,
+    SESSION_SPILL_AFTER, SESSION_JANITOR_INTERVAL, PREFLIGHT_ENABLED, PREFLIGHT_WINDOW,
+    DISK_DEFAULT_VIDEO_RESERVATION, DISK_DEFAULT_FILE_RESERVATION, MEMORY_PATH_MAX,
+    ALBUM_SIZE, ALBUM_DOCUMENTS
+)
+from item_store import ItemView
+from utils import (
+    parse_file, sanitize_filename, is_youtube_url,
+    format_size, format_time, get_host
+)
+from video_processor import (
+    get_video_info, extract_thumbnail, validate_video_file,
+    can_prefetch, prefetch_media_meta, collect_prefetch, ensure_faststart,
+    transcode_to_fit
+)
+from downloader import download_routed, download_file, download_to_memory, throughput
+from memory_pool import MemoryFile, discard_source
+from preflight import (
+    preflight_items, type_from_content_type,
+    estimate_batch, pick_auto_height, estimate_item_bytes, can_pass_through
+)
+from disk_budget import disk_budget
+from workspace import Workspace
+from uploader import (
+    upload_video, upload_photo, upload_document, send_by_url,
+    upload_media_group, FailedLinkDigest
+)
+from disk_writer import read_digest
+from content_index import content_index
+from dashboard import BatchDashboard, ItemProgress
+from retry_policy import circuit_breaker, failed_urls
+from batch_tasks import batch_registry
+from metrics import timed
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +49,80 @@ active_downloads = {}
 download_progress = {}
 
 
+def quality_keyboard(fit: bool = False, report_each: bool = False, skip_youtube: bool = False) -> InlineKeyboardMarkup:
+    """Quality selection keyboard with the fit-under-2GB, failure-report and YouTube toggles"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("360p", callback_data="q_360p"),
+            InlineKeyboardButton("480p", callback_data="q_480p")
+        ],
+        [
+            InlineKeyboardButton("720p ⭐", callback_data="q_720p"),
+            InlineKeyboardButton("1080p 🔥", callback_data="q_1080p")
+        ],
+        [
+            InlineKeyboardButton("🤖 Auto (best under 2GB)", callback_data="q_auto")
+        ],
+        [
+            InlineKeyboardButton(
+                f"{'✅' if fit else '⬜'} Fit large videos under 2GB",
+                callback_data="fit_toggle"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                f"{'✅' if report_each else '⬜'} Report each failed link right away",
+                callback_data="report_toggle"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                f"{'✅' if skip_youtube else '⬜'} Skip YouTube (send links only)",
+                callback_data="youtube_toggle"
+            )
+        ]
+    ])
+
+
+def stop_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⛔ Stop All", callback_data="stop")
+    ]])
+
+
+async def show_batch_estimate(msg: Message, text: str, user_id: int):
+    """Append the pre-flight size/ETA estimate to the quality prompt"""
+    try:
+        start, end = user_data[user_id]['range']
+        items = user_data[user_id]['items'][start-1:end]
+        
+        heights = [int(q) for q in QUALITY_MAP.values() if q.isdigit()]
+        estimate = await estimate_batch(items, heights, MAX_FILE_SIZE * 1024 * 1024)
+        if not estimate['known']:
+            return
+        
+        lines = [
+            f"• {h}p: {format_size(size)} (ETA {format_time(throughput.eta(size)) if throughput.rate else '—'})"
+            for h, size in estimate['totals'].items()
+        ]
+        lines.append(f"• Auto: {format_size(estimate['auto'])}")
+        
+        if user_id not in user_data or 'range' not in user_data[user_id]:
+            return
+        await msg.edit_text(
+            f"{text}\n\n"
+            f"📏 **Estimated Size** ({estimate['known']}/{estimate['sampled']} sampled items known):\n"
+            + "\n".join(lines),
+            reply_markup=quality_keyboard(
+                user_data[user_id].get('fit', False),
+                user_data[user_id].get('report_each', False),
+                user_data[user_id].get('skip_youtube', False)
+            )
+        )
+    except Exception as e:
+        logger.debug(f"Batch estimate error: {e}")
+
+
 def setup_handlers(app: Client):
     """Setup all bot handlers"""
     
@@ -39,7 +144,7 @@ def setup_handlers(app: Client):
             "• Images: PNG, JPG, GIF, WEBP, BMP, SVG\n"
             "• Documents: PDF, DOC, DOCX, TXT, ZIP, RAR\n\n"
             "🖼️ **Enhanced Features:**\n"
-            "• Never Blank Thumbnails (4 fallback methods)\n"
+            "• Smart Single-Pass Thumbnails\n"
             "• Accurate Duration Tracking\n"
             "• Live Speed Monitoring\n"
             "• Dynamic Worker Adjustment\n"
@@ -54,19 +159,22 @@ def setup_handlers(app: Client):
         user_id = message.from_user.id
         file_name = message.document.file_name
         
-        if not (file_name.endswith('.txt') or file_name.endswith('.html')):
+        if not file_name.lower().endswith(('.txt', '.html', '.htm')):
             await message.reply_text("❌ Please send TXT or HTML file only!")
             return
         
+        if batch_registry.is_busy(user_id):
+            await message.reply_text("⏳ A batch is still running! Send /cancel first or wait for it to finish.")
+            return
+        
         status = await message.reply_text("📥 Processing your file...")
         
         try:
             file_path = await message.download(file_name=f"{DOWNLOAD_DIR}/{user_id}_{file_name}")
             
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-            
-            items = parse_content(content)
+            # Stream-parse off the event loop (huge course dumps)
+            loop = asyncio.get_running_loop()
+            items = await loop.run_in_executor(None, parse_file, file_path)
             
             if not items:
                 await status.edit_text("❌ No supported links found in file!")
@@ -74,11 +182,10 @@ def setup_handlers(app: Client):
                 return
             
             # Count by type
-            type_counts = {}
-            for item in items:
-                ftype = item['type']
-                type_counts[ftype] = type_counts.get(ftype, 0) + 1
+            type_counts = items.type_counts()
             
+            if user_id in user_data:
+                user_data[user_id]['items'].discard()
             user_data[user_id] = {'items': items, 'file_path': file_path}
             
             kb = InlineKeyboardMarkup([
@@ -87,6 +194,7 @@ def setup_handlers(app: Client):
             ])
             
             type_info = "\n".join([
+                f"🔗 Other links (type checked before download): {c}" if t == 'unknown' else
                 f"{'🎬' if t == 'video' else '🖼️' if t == 'image' else '📄'} {t.title()}s: {c}" 
                 for t, c in type_counts.items()
             ])
@@ -119,24 +227,20 @@ def setup_handlers(app: Client):
         if action == "download_all":
             user_data[user_id]['range'] = (1, len(items))
             
-            kb = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("360p", callback_data="q_360p"),
-                    InlineKeyboardButton("480p", callback_data="q_480p")
-                ],
-                [
-                    InlineKeyboardButton("720p ⭐", callback_data="q_720p"),
-                    InlineKeyboardButton("1080p 🔥", callback_data="q_1080p")
-                ]
-            ])
+            kb = quality_keyboard(
+                user_data[user_id].get('fit', False),
+                user_data[user_id].get('report_each', False),
+                user_data[user_id].get('skip_youtube', False)
+            )
             
-            await callback.message.edit_text(
+            text = (
                 f"📦 **Downloading All {len(items)} Items**\n\n"
                 f"🎬 Select video quality:\n"
                 f"(Images & documents process automatically)\n\n"
-                f"⚡ ULTRA-SPEED mode activated!",
-                reply_markup=kb
+                f"⚡ ULTRA-SPEED mode activated!"
             )
+            await callback.message.edit_text(text, reply_markup=kb)
+            asyncio.create_task(show_batch_estimate(callback.message, text, user_id))
         else:
             await callback.message.edit_text(
                 f"📊 **Range Selection Mode**\n\n"
@@ -178,26 +282,22 @@ def setup_handlers(app: Client):
             
             user_data[user_id]['range'] = (start, end)
             
-            kb = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("360p", callback_data="q_360p"),
-                    InlineKeyboardButton("480p", callback_data="q_480p")
-                ],
-                [
-                    InlineKeyboardButton("720p ⭐", callback_data="q_720p"),
-                    InlineKeyboardButton("1080p 🔥", callback_data="q_1080p")
-                ]
-            ])
+            kb = quality_keyboard(
+                user_data[user_id].get('fit', False),
+                user_data[user_id].get('report_each', False),
+                user_data[user_id].get('skip_youtube', False)
+            )
             
             count = end - start + 1
-            await message.reply_text(
+            text = (
                 f"✅ **Range Confirmed!**\n\n"
                 f"📊 Range: {start}-{end}\n"
                 f"📦 Total: {count} item(s)\n\n"
                 f"🎬 Select video quality:\n"
-                f"⚡ ULTRA-SPEED ready!",
-                reply_markup=kb
+                f"⚡ ULTRA-SPEED ready!"
             )
+            prompt = await message.reply_text(text, reply_markup=kb)
+            asyncio.create_task(show_batch_estimate(prompt, text, user_id))
             
         except Exception as e:
             await message.reply_text(
@@ -208,6 +308,78 @@ def setup_handlers(app: Client):
             )
     
     
+    @app.on_callback_query(filters.regex("^fit_toggle$"))
+    async def fit_toggle_cb(client: Client, callback: CallbackQuery):
+        user_id = callback.from_user.id
+        
+        if user_id not in user_data or 'range' not in user_data[user_id]:
+            await callback.answer("❌ Session expired!", show_alert=True)
+            return
+        
+        fit = not user_data[user_id].get('fit', False)
+        user_data[user_id]['fit'] = fit
+        
+        await callback.message.edit_reply_markup(
+            quality_keyboard(
+                fit,
+                user_data[user_id].get('report_each', False),
+                user_data[user_id].get('skip_youtube', False)
+            )
+        )
+        await callback.answer(
+            "🎯 Oversized videos will be re-encoded into one file" if fit
+            else "📦 Oversized videos will be split into parts"
+        )
+    
+    
+    @app.on_callback_query(filters.regex("^report_toggle$"))
+    async def report_toggle_cb(client: Client, callback: CallbackQuery):
+        user_id = callback.from_user.id
+        
+        if user_id not in user_data or 'range' not in user_data[user_id]:
+            await callback.answer("❌ Session expired!", show_alert=True)
+            return
+        
+        report_each = not user_data[user_id].get('report_each', False)
+        user_data[user_id]['report_each'] = report_each
+        
+        await callback.message.edit_reply_markup(
+            quality_keyboard(
+                user_data[user_id].get('fit', False),
+                report_each,
+                user_data[user_id].get('skip_youtube', False)
+            )
+        )
+        await callback.answer(
+            "📨 Each failed link will be sent right away" if report_each
+            else "📋 Failed links will be collected into a digest"
+        )
+    
+    
+    @app.on_callback_query(filters.regex("^youtube_toggle$"))
+    async def youtube_toggle_cb(client: Client, callback: CallbackQuery):
+        user_id = callback.from_user.id
+        
+        if user_id not in user_data or 'range' not in user_data[user_id]:
+            await callback.answer("❌ Session expired!", show_alert=True)
+            return
+        
+        skip_youtube = not user_data[user_id].get('skip_youtube', False)
+        user_data[user_id]['skip_youtube'] = skip_youtube
+        
+        await callback.message.edit_reply_markup(
+            quality_keyboard(
+                user_data[user_id].get('fit', False),
+                user_data[user_id].get('report_each', False),
+                skip_youtube
+            )
+        )
+        await callback.answer(
+            "🔗 YouTube links will be sent as links" if skip_youtube
+            else "🎬 YouTube videos will be downloaded"
+        )
+    
+    
     @app.on_callback_query(filters.regex(r"^q_"))
     async def quality_cb(client: Client, callback: CallbackQuery):
         user_id = callback.from_user.id
@@ -217,42 +389,68 @@ def setup_handlers(app: Client):
             await callback.answer("❌ Session expired!", show_alert=True)
             return
         
+        if batch_registry.is_busy(user_id):
+            await callback.answer("⏳ A batch is already running!", show_alert=True)
+            return
+        
         items = user_data[user_id]['items']
         file_path = user_data[user_id]['file_path']
         start, end = user_data[user_id]['range']
+        fit = user_data[user_id].get('fit', False)
+        report_each = user_data[user_id].get('report_each', False)
+        skip_youtube = user_data[user_id].get('skip_youtube', False)
         
         selected_items = items[start-1:end]
         active_downloads[user_id] = True
         
-        stop_kb = InlineKeyboardMarkup([[
-            InlineKeyboardButton("⛔ Stop All", callback_data="stop")
-        ]])
-        
-        await callback.message.edit_text(
+        text = (
             f"🚀 **ULTRA-SPEED Batch Download Started!**\n\n"
             f"⚡ Quality: {quality}\n"
             f"📊 Range: {start}-{end}\n"
             f"📦 Total: {len(selected_items)} items\n"
             f"💪 Dynamic Workers: Active\n"
-            f"📈 Auto File Splitting: Enabled\n\n"
-            f"⏳ Processing at maximum speed...",
-            reply_markup=stop_kb
+            f"📈 Large Files: {'Fit under 2GB' if fit else 'Auto Split'}\n\n"
+        )
+        await callback.message.edit_text(
+            f"{text}⏳ Processing at maximum speed...",
+            reply_markup=stop_keyboard()
         )
         
-        # Process batch
-        await process_batch(
-            client, callback.message, selected_items, 
-            quality, start, end, user_id
+        async def mark_cancelled():
+            try:
+                await callback.message.edit_text(f"{text}⛔ **Cancelled before it started**")
+            except Exception as e:
+                logger.debug(f"Queued batch message update error: {e}")
+        
+        def on_done(batch):
+            cleanup_user_data(user_id, file_path)
+            if not batch.started:
+                # Cancelled while queued: process_batch never took over the message
+                asyncio.create_task(mark_cancelled())
+        
+        # The batch runs as its own task; this handler worker is free again right away
+        batch_registry.start(
+            user_id, callback.message.chat.id, len(selected_items),
+            lambda: process_batch(
+                client, callback.message, selected_items,
+                quality, start, end, user_id, fit, report_each, skip_youtube
+            ),
+            on_done=on_done
         )
         
-        # Cleanup
-        cleanup_user_data(user_id, file_path)
+        ahead = batch_registry.queue_position(user_id)
+        if ahead:
+            await callback.message.edit_text(
+                f"{text}🕒 Queued - {ahead} batch(es) ahead...",
+                reply_markup=stop_keyboard()
+            )
     
     
     @app.on_callback_query(filters.regex("^stop$"))
     async def stop_cb(client: Client, callback: CallbackQuery):
         user_id = callback.from_user.id
         active_downloads[user_id] = False
+        batch_registry.cancel(user_id)
         await callback.answer("⛔ Stopping all downloads...", show_alert=True)
     
     
@@ -260,115 +458,254 @@ def setup_handlers(app: Client):
     async def cancel_cmd(client: Client, message: Message):
         user_id = message.from_user.id
         active_downloads[user_id] = False
+        if not batch_registry.cancel(user_id):
+            await message.reply_text("ℹ️ No batch is running.")
+            return
         await message.reply_text("⛔ All downloads cancelled!")
 
 
 async def process_batch(
     client: Client,
     message: Message,
-    items: list,
+    items: ItemView,
     quality: str,
     start: int,
     end: int,
-    user_id: int
+    user_id: int,
+    fit: bool = False,
+    report_each: bool = False,
+    skip_youtube: bool = False
 ):
     """Process batch of downloads with ULTRA-ENHANCED speed and error handling"""
     success = 0
     failed = 0
     youtube_links = 0
+    dead_links = 0
+    host_down = 0
+    failures = FailedLinkDigest(client, message.chat.id, immediate=report_each)
     
-    for idx, item in enumerate(items, start):
-        if not active_downloads.get(user_id, False):
-            await message.reply_text("⛔ **Download stopped by user!**")
-            break
+    # The batch's own message becomes its live dashboard
+    dashboard = BatchDashboard(
+        message,
+        f"🚀 **ULTRA-SPEED Batch** | ⚡ {quality} | 📊 Range: {start}-{end}",
+        len(items), stop_keyboard(), throughput
+    )
+    dashboard.start()
+    windows: Dict[int, asyncio.Task] = {}  # Pre-flight probe task per window of items
+    try:
+        # Items whose host circuit is open go to the back of the batch once
+        deferred = []
+        deferred_idx = set()
         
-        prog = await message.reply_text(
-            f"📦 **Processing Item {idx}/{end}**\n"
-            f"📝 {item['title'][:60]}...\n"
-            f"🚀 ULTRA-SPEED mode active"
-        )
+        # Run of consecutive images (or documents) waiting to go out as one album
+        album = []
         
-        try:
-            serial_caption = f"{idx}. {item['title']}"
+        async def flush_album():
+            nonlocal success, failed
+            if album and active_downloads.get(user_id, False):
+                try:
+                    delivered, lost = await send_album(client, message, list(album), user_id, failures, dashboard)
+                    success += delivered
+                    failed += lost
+                except Exception as e:
+                    logger.error(f"Album error: {e}")
+                    failed += len(album)
+            album.clear()
+        
+        async def report(idx, item, reason):
+            # Earlier album members go out first, so messages keep batch order
+            await flush_album()
+            await failures.add(item['title'], item['url'], idx, reason)
+        
+        # Pre-flight (reachability, content-type, size) in windows ahead of the
+        # cursor: downloads start right away and the next window probes meanwhile
+        probes = {}
+        merged = set()
+        
+        def start_window(window: int):
+            if PREFLIGHT_ENABLED and window not in windows and window * PREFLIGHT_WINDOW < len(items):
+                windows[window] = asyncio.create_task(preflight_items(
+                    items[window * PREFLIGHT_WINDOW:(window + 1) * PREFLIGHT_WINDOW]
+                ))
+        
+        async def probe_ahead(idx, item):
+            window = (idx - start) // PREFLIGHT_WINDOW
+            start_window(window)
+            start_window(window + 1)
+            task = windows.get(window)
+            if not task or window in merged:
+                return
+            if not task.done():
+                prog = dashboard.item(idx, item['title'])
+                await prog.edit_text(f"🔍 Checking the next {PREFLIGHT_WINDOW} links...")
+                try:
+                    while not task.done() and active_downloads.get(user_id, False):
+                        await asyncio.wait([task], timeout=1)
+                finally:
+                    dashboard.finish(idx)
+                if not task.done():
+                    return  # Stopped
+            merged.add(window)
+            try:
+                probes.update(task.result())
+            except Exception as e:
+                logger.error(f"Pre-flight error: {e}")
+        
+        for idx, item in chain(enumerate(items, start), deferred):
+            dashboard.counts(success, failed, youtube_links)
+            if not active_downloads.get(user_id, False):
+                await message.reply_text("⛔ **Download stopped by user!**")
+                break
             
-            # Check if YouTube link
-            if is_youtube_url(item['url']):
-                logger.info(f"YouTube link detected: {item['url']}")
-                await prog.edit_text(
-                    f"🎬 YouTube video detected!\n"
-                    f"Sending link for manual access..."
-                )
+            if idx not in deferred_idx:
+                await probe_ahead(idx, item)
+                if not active_downloads.get(user_id, False):
+                    continue  # Stopped while probing: the check above reports it
+            probe = probes.get(item['url'])
+            if probe:
+                if probe['reachable'] is False:
+                    await report(idx, item, f"Dead link (HTTP {probe['status']})")
+                    dead_links += 1
+                    failed += 1
+                    continue
                 
-                # Send as failed link with caption
-                await send_failed_link(
-                    client, message.chat.id, item['title'], 
-                    item['url'], idx, "YouTube video - Open link manually"
-                )
+                # Trust the server's content type over the URL extension
+                probed_type = type_from_content_type(probe['content_type'])
+                if probed_type:
+                    item.type = probed_type
+            
+            if item['type'] == 'unknown':
+                # Neither the URL nor the server's Content-Type says what this is
+                await report(idx, item, "Unsupported link type")
+                failed += 1
+                continue
+            
+            recent_failure = failed_urls.get(item['url'])
+            if recent_failure:
+                await report(idx, item, f"Failed recently: {recent_failure}")
+                failed += 1
+                continue
+            
+            if circuit_breaker.is_open(item['url']):
+                if idx not in deferred_idx:
+                    deferred_idx.add(idx)
+                    deferred.append((idx, item))
+                    continue
+                await report(idx, item, f"Host unavailable: {get_host(item['url'])}")
+                host_down += 1
+                failed += 1
+                continue
+            
+            # Skip YouTube: links are reported, not downloaded (no progress message needed)
+            if skip_youtube and is_youtube_url(item['url']):
+                logger.info(f"YouTube link detected: {item['url']}")
+                await report(idx, item, "YouTube video - Open link manually")
                 youtube_links += 1
-                await prog.delete()
                 continue
             
-            if item['type'] == 'video':
-                result = await process_video(
-                    client, message, item, quality, 
-                    serial_caption, idx, prog, user_id
+            if is_album_kind(item):
+                if album and album[0][1]['type'] != item['type']:
+                    await flush_album()
+                album.append((idx, item, probe))
+                if len(album) >= ALBUM_SIZE:
+                    await flush_album()
+                continue
+            await flush_album()
+            
+            prog = dashboard.item(idx, item['title'])
+            
+            reservation = None
+            workspace = None
+            try:
+                serial_caption = f"{idx}. {item['title']}"
+                
+                # Hold the job back until its expected bytes fit on disk
+                reservation = await disk_budget.reserve(
+                    expected_item_bytes(item, quality, fit, probe),
+                    on_wait=lambda: prog.edit_text("💾 Waiting for free disk space...")
                 )
-                if result == 'UNSUPPORTED':
-                    # Send failed link
-                    await send_failed_link(
-                        client, message.chat.id, item['title'],
-                        item['url'], idx, "Unsupported video format"
+                workspace = Workspace(user_id, str(idx))
+                reservation.track(workspace.path)
+                
+                if item['type'] == 'video':
+                    result = await process_video(
+                        client, message, item, quality, 
+                        serial_caption, idx, prog, user_id, workspace, fit,
+                        probe=probe
                     )
-                    failed += 1
-                elif result:
-                    success += 1
-                else:
-                    failed += 1
-                    
-            elif item['type'] == 'image':
-                result = await process_image(
-                    client, message, item, 
-                    serial_caption, idx, prog, user_id
-                )
-                if result:
-                    success += 1
-                else:
-                    # Send failed link
-                    await send_failed_link(
-                        client, message.chat.id, item['title'],
-                        item['url'], idx, "Image download failed"
+                    if result == 'UNSUPPORTED':
+                        # Send failed link
+                        await failures.add(
+                            item['title'], item['url'], idx, "Unsupported video format"
+                        )
+                        failed += 1
+                    elif result:
+                        success += 1
+                    else:
+                        failed += 1
+                        
+                elif item['type'] == 'image':
+                    result = await process_image(
+                        client, message, item, 
+                        serial_caption, idx, prog, user_id, workspace, probe
                     )
-                    failed += 1
-                    
-            elif item['type'] == 'document':
-                result = await process_document(
-                    client, message, item,
-                    serial_caption, idx, prog, user_id
-                )
-                if result:
-                    success += 1
-                else:
-                    # Send failed link
-                    await send_failed_link(
-                        client, message.chat.id, item['title'],
-                        item['url'], idx, "Document download failed"
+                    if result:
+                        success += 1
+                    else:
+                        # Send failed link
+                        await failures.add(
+                            item['title'], item['url'], idx, "Image download failed"
+                        )
+                        failed += 1
+                        
+                elif item['type'] == 'document':
+                    result = await process_document(
+                        client, message, item,
+                        serial_caption, idx, prog, user_id, workspace, probe
                     )
-                    failed += 1
+                    if result:
+                        success += 1
+                    else:
+                        # Send failed link
+                        await failures.add(
+                            item['title'], item['url'], idx, "Document download failed"
+                        )
+                        failed += 1
+            
+            except Exception as e:
+                logger.error(f"Item {idx} error: {e}")
+                try:
+                    await prog.delete()
+                    # Send failed link on exception
+                    await failures.add(
+                        item['title'], item['url'], idx, f"Error: {str(e)[:50]}"
+                    )
+                except:
+                    pass
+                failed += 1
+            finally:
+                dashboard.finish(idx)
+                if workspace:
+                    workspace.cleanup()
+                if reservation:
+                    await disk_budget.release(reservation)
+            
+            await asyncio.sleep(0.3)  # Reduced delay for faster processing
         
+        await flush_album()
+    finally:
+        for task in windows.values():
+            task.cancel()
+        # Also on a hard cancel (grace period over, shutdown): keep the failed links
+        try:
+            await failures.flush(final=True)
         except Exception as e:
-            logger.error(f"Item {idx} error: {e}")
-            try:
-                await prog.delete()
-                # Send failed link on exception
-                await send_failed_link(
-                    client, message.chat.id, item['title'],
-                    item['url'], idx, f"Error: {str(e)[:50]}"
-                )
-            except:
-                pass
-            failed += 1
-        
-        await asyncio.sleep(0.3)  # Reduced delay for faster processing
+            logger.error(f"Failed-link digest error: {e}")
+        dashboard.counts(success, failed, youtube_links)
+        await dashboard.close(
+            "✅ **Complete** - summary below" if active_downloads.get(user_id, False)
+            else "⛔ **Stopped**"
+        )
     
     # Final summary
     summary_msg = (
@@ -379,6 +716,12 @@ async def process_batch(
     
     if youtube_links > 0:
         summary_msg += f"🎬 YouTube Links: {youtube_links}\n"
+    if dead_links > 0:
+        summary_msg += f"💀 Dead Links Skipped: {dead_links}\n"
+    if host_down > 0:
+        summary_msg += f"🔴 Host Down (failed fast): {host_down}\n"
+    if failures.reported and not report_each:
+        summary_msg += f"📋 Failed Links: {failures.reported} (see digest)\n"
     
     summary_msg += (
         f"📊 Total: {len(items)}\n"
@@ -390,6 +733,200 @@ async def process_batch(
     await message.reply_text(summary_msg)
 
 
+def is_album_kind(item) -> bool:
+    """Item type that can be grouped into a send_media_group album"""
+    return ALBUM_SIZE > 1 and (item['type'] == 'image' or (item['type'] == 'document' and ALBUM_DOCUMENTS))
+
+
+async def send_album(
+    client: Client, message: Message, members: list, user_id: int,
+    failures: FailedLinkDigest, dashboard: BatchDashboard
+) -> Tuple[int, int]:
+    """
+    Download a run of images/documents concurrently and send them as one
+    media group. Members that cannot go in the album are sent one by one,
+    in their place in the batch. Returns (delivered, failed).
+    """
+    if len(members) == 1:
+        idx, item, probe = members[0]
+        return (1, 0) if await process_single_file(client, message, item, idx, probe, user_id, failures, dashboard) else (0, 1)
+    
+    chat_id = message.chat.id
+    kind = members[0][1]['type']
+    emoji = "🖼️" if kind == 'image' else "📄"
+    default_ext = '.jpg' if kind == 'image' else '.pdf'
+    prog = dashboard.item(members[0][0], f"Album of {len(members)} {kind}s (#{members[0][0]}-#{members[-1][0]})")
+    await prog.edit_text(f"⚡ Downloading {len(members)} {kind}s together...")
+    
+    reservation = await disk_budget.reserve(
+        sum(expected_item_bytes(item, None, False, probe) for _, item, probe in members),
+        on_wait=lambda: prog.edit_text("💾 Waiting for free disk space...")
+    )
+    workspace = Workspace(user_id, f"album{members[0][0]}")
+    reservation.track(workspace.path)
+    prepared = []
+    
+    async def prepare(idx, item, probe):
+        """(source, digest, by_url) ready for the album, None to send individually"""
+        if content_index.lookup_url(chat_id, item['url']):
+            return None  # Already delivered: the single path re-sends it
+        if can_pass_through(probe, kind):
+            return item['url'], None, True
+        ext = os.path.splitext(item['url'])[1] or default_ext
+        source = await fetch_small_file(
+            item, f"{sanitize_filename(item['title'])}_{idx}{ext}", None, user_id, workspace, probe
+        )
+        if not source:
+            return None
+        digest = source.digest if isinstance(source, MemoryFile) else read_digest(source)
+        if content_index.lookup_digest(chat_id, digest):
+            discard_source(source)
+            return None
+        return source, digest, False
+    
+    delivered, lost = 0, 0
+    
+    async def send_single(idx, item, probe):
+        nonlocal delivered, lost
+        if not active_downloads.get(user_id, False):
+            return
+        # Inside the album's workspace: its reservation already covers this member
+        if await process_single_file(client, message, item, idx, probe, user_id, failures, dashboard, workspace):
+            delivered += 1
+        else:
+            lost += 1
+    
+    async def send_run(run):
+        """Consecutive prepared members as one album, one by one if it is refused"""
+        nonlocal delivered, lost
+        if not active_downloads.get(user_id, False):
+            return
+        sent = None
+        if len(run) > 1:
+            await prog.edit_text(f"📤 Uploading album of {len(run)} {kind}s...")
+            entries = [(result[0], f"{emoji} {member[0]}. {member[1]['title']}") for member, result in run]
+            try:
+                sent = await upload_media_group(client, chat_id, kind, entries)
+            except FloodWait as e:
+                # Still rate-limited: sending the members one by one would only add API calls
+                logger.error(f"Album gave up after repeated flood waits ({e.value}s)")
+                for (idx, item, _), _ in run:
+                    await failures.add(item['title'], item['url'], idx, f"Telegram flood wait ({e.value}s)")
+                lost += len(run)
+                return
+            except Exception as e:
+                logger.error(f"Album upload error: {e}")
+            if not sent and any(result[2] for _, result in run):
+                # Telegram refused a URL member: album the downloaded members around them
+                for by_url, part in groupby(run, key=lambda entry: entry[1][2]):
+                    part = list(part)
+                    if by_url:
+                        for member, _ in part:
+                            await send_single(*member)
+                    else:
+                        await send_run(part)
+                return
+        if sent:
+            for (member, result), msg in zip(run, sent):
+                content_index.remember(chat_id, member[1]['url'], msg.id, result[1])
+            delivered += len(run)
+        else:
+            for member, _ in run:
+                await send_single(*member)
+    
+    try:
+        results = await asyncio.gather(*(prepare(*m) for m in members), return_exceptions=True)
+        for member, result in zip(members, results):
+            if isinstance(result, Exception):
+                logger.error(f"Album item {member[0]} error: {result}")
+                result = None
+            prepared.append((member, result))
+        
+        # In batch order: prepared runs as albums, the rest one by one between them
+        for ready, group in groupby(prepared, key=lambda entry: bool(entry[1])):
+            group = list(group)
+            if ready:
+                await send_run(group)
+            else:
+                for member, _ in group:
+                    await send_single(*member)
+    finally:
+        for _, result in prepared:
+            if result and not result[2]:
+                discard_source(result[0])
+        workspace.cleanup()
+        await disk_budget.release(reservation)
+        try:
+            await prog.delete()
+        except Exception:
+            pass
+    
+    return delivered, lost
+
+
+async def process_single_file(
+    client: Client, message: Message, item, idx: int, probe: Optional[dict],
+    user_id: int, failures: FailedLinkDigest, dashboard: BatchDashboard,
+    workspace: Optional[Workspace] = None
+) -> bool:
+    """
+    One image/document outside an album, failed link on error. A caller
+    that passes its workspace has already reserved disk space for the item.
+    """
+    prog = dashboard.item(idx, item['title'])
+    reservation = None
+    owned = workspace is None
+    if owned:
+        reservation = await disk_budget.reserve(expected_item_bytes(item, None, False, probe))
+        workspace = Workspace(user_id, str(idx))
+        reservation.track(workspace.path)
+    try:
+        handler = process_image if item['type'] == 'image' else process_document
+        result = await handler(
+            client, message, item, f"{idx}. {item['title']}", idx, prog, user_id, workspace, probe
+        )
+        if not result:
+            await failures.add(
+                item['title'], item['url'], idx,
+                "Image download failed" if item['type'] == 'image' else "Document download failed"
+            )
+        return bool(result)
+    finally:
+        dashboard.finish(idx)
+        if owned:
+            workspace.cleanup()
+            await disk_budget.release(reservation)
+
+
+def expected_item_bytes(item, quality: str, fit: bool, probe: Optional[dict]) -> int:
+    """Disk bytes an item will need, including split/fit working copies"""
+    if item['type'] != 'video':
+        return (probe or {}).get('size') or DISK_DEFAULT_FILE_RESERVATION
+    
+    max_bytes = MAX_FILE_SIZE * 1024 * 1024
+    q_val = QUALITY_MAP[quality]
+    height = pick_auto_height(item['url'], max_bytes, 1080) if q_val == 'auto' else int(q_val)
+    size = estimate_item_bytes(item['url'], height) or DISK_DEFAULT_VIDEO_RESERVATION
+    
+    if size > max_bytes:
+        # Fit mode keeps the source plus chunks and output, split keeps parts
+        size = size * 2 + (2 * max_bytes if fit else 0)
+    return size
+
+
+async def resend_known(client: Client, chat_id: int, message_id: Optional[int], caption: str) -> bool:
+    """Re-send already delivered content with copy_message instead of uploading"""
+    if not message_id:
+        return False
+    try:
+        await client.copy_message(chat_id, chat_id, message_id, caption=caption)
+        logger.info(f"♻️ Reused message {message_id} in chat {chat_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"Could not reuse message {message_id}: {e}")
+        return False
+
+
 async def process_video(
     client: Client,
     message: Message,
@@ -397,20 +934,45 @@ async def process_video(
     quality: str,
     caption: str,
     idx: int,
-    prog: Message,
-    user_id: int
+    prog: ItemProgress,
+    user_id: int,
+    workspace: Workspace,
+    fit: bool = False,
+    probe: Optional[dict] = None
 ) -> bool:
     """Process video download and upload with enhanced error handling"""
+    prefetch = None
     try:
         q_val = QUALITY_MAP[quality]
+        if q_val == 'auto':
+            # Highest variant that fits under the upload limit (no split needed)
+            q_val = str(pick_auto_height(item['url'], MAX_FILE_SIZE * 1024 * 1024, 1080))
+            quality = f"auto→{q_val}p"
         safe = sanitize_filename(item['title'])
         fname = f"{safe}_{idx}.mp4"
+        thumb_path = str(workspace.file(f"thumb_{idx}.jpg"))
+        chat_id = message.chat.id
         
-        vpath = await download_video(
-            item['url'], q_val, fname, prog, 
-            user_id, active_downloads, download_progress
+        # Same URL at the same quality already delivered to this chat
+        source_key = f"{item['url']} @{q_val}{' fit' if fit else ''}"
+        if await resend_known(client, chat_id, content_index.lookup_url(chat_id, source_key), f"🎬 {caption}\n⚡ {quality}"):
+            await prog.delete()
+            return True
+        
+        # Probe + thumbnail from the remote URL while the download runs
+        if can_prefetch(item['url']):
+            prefetch = asyncio.create_task(prefetch_media_meta(
+                item['url'], str(workspace.file(f"thumb_{idx}_remote.jpg"))
+            ))
+        
+        # Native HTTP/HLS when possible, yt-dlp for DASH and pages
+        vpath = await download_routed(
+            item['url'], q_val, fname, prog,
+            user_id, active_downloads, download_progress, workspace.path, probe
         )
         
+        meta = await collect_prefetch(prefetch)
+        
         # Check for unsupported video
         if vpath == 'UNSUPPORTED':
             logger.warning(f"Unsupported video format: {item['url']}")
@@ -421,37 +983,72 @@ async def process_video(
             await prog.delete()
             return False
         
-        if not os.path.exists(vpath) or not validate_video_file(vpath):
+        loop = asyncio.get_running_loop()
+        if not os.path.exists(vpath) or not await loop.run_in_executor(None, validate_video_file, vpath):
             await prog.delete()
             return False
         
-        # Get video info
-        await prog.edit_text("🎬 Analyzing video...")
-        video_info = get_video_info(vpath)
+        # Direct and native HLS downloads are hashed while written: same bytes behind another URL?
+        digest = read_digest(vpath)
+        known = content_index.lookup_digest(chat_id, digest)
+        if await resend_known(client, chat_id, known, f"🎬 {caption}\n⚡ {quality}"):
+            content_index.remember(chat_id, source_key, known, digest)
+            os.remove(vpath)
+            await prog.delete()
+            return True
         
-        # Generate thumbnail with multiple attempts
-        thumb_path = str(DOWNLOAD_DIR / f"thumb_{user_id}_{idx}.jpg")
-        has_thumb = generate_thumbnail(vpath, thumb_path, video_info['duration'])
+        # Use prefetched info, fall back to probing the local file
+        video_info = meta.get('info')
+        if not video_info:
+            await prog.edit_text("🎬 Analyzing video...")
+            video_info = await loop.run_in_executor(None, get_video_info, vpath)
         
-        if not has_thumb:
-            logger.warning(f"Thumbnail generation failed for {vpath}, retrying...")
-            await asyncio.sleep(1)
-            has_thumb = generate_thumbnail(vpath, thumb_path, video_info['duration'])
+        if meta.get('thumb'):
+            thumb_path = meta['thumb']
+            has_thumb = True
+        else:
+            has_thumb = await extract_thumbnail(vpath, thumb_path, video_info['duration'])
         
-        # Upload
         fsize = os.path.getsize(vpath) / (1024 * 1024)
+        fitted = False
+        
+        if fit and fsize > MAX_FILE_SIZE:
+            await prog.edit_text(
+                f"🎯 **Fitting video under 2GB**\n\n"
+                f"Size: {fsize:.1f}MB\n"
+                f"Re-encoding on {os.cpu_count() or 1} cores..."
+            )
+            fit_path = vpath.rsplit('.', 1)[0] + "_fit.mp4"
+            fitted = await loop.run_in_executor(
+                None, transcode_to_fit, vpath, fit_path,
+                video_info['duration'], MAX_FILE_SIZE
+            )
+            if fitted:
+                os.remove(vpath)
+                vpath = fit_path
+                fsize = os.path.getsize(vpath) / (1024 * 1024)
+            else:
+                logger.warning(f"Fit mode failed for {vpath}, falling back to split")
+        
+        if not fitted:
+            # Move moov to the front only when the file is not already streamable
+            await loop.run_in_executor(None, ensure_faststart, vpath)
+        
+        # Upload
         upload_caption = f"🎬 {caption}\n⚡ {quality} | 💾 {fsize:.1f}MB"
         
-        if fsize > 1990:
+        if fsize > MAX_FILE_SIZE:
             upload_caption += f"\n📦 Large file - Will be split automatically"
         
         await prog.edit_text("📤 Starting upload with progress tracking...")
         
         upload_success = await upload_video(
-            client, message.chat.id, vpath, upload_caption,
+            client, chat_id, vpath, upload_caption,
             prog, thumb_path if has_thumb else None,
             video_info['duration'], video_info['width'], video_info['height']
         )
+        if isinstance(upload_success, Message):
+            content_index.remember(chat_id, source_key, upload_success.id, digest)
         
         # Cleanup
         try:
@@ -467,6 +1064,25 @@ async def process_video(
     except Exception as e:
         logger.error(f"Video processing error: {e}")
         return False
+    finally:
+        # Download raised or the batch was cancelled: stop the prefetch's ffmpeg first
+        await collect_prefetch(prefetch)
+
+
+@timed('download')
+async def fetch_small_file(item, fname: str, prog: Optional[ItemProgress], user_id: int, workspace: Workspace, probe: Optional[dict]):
+    """Image/document download: pooled memory buffer when small, else the workspace"""
+    if failed_urls.get(item['url']):
+        return None
+    size = (probe or {}).get('size') or 0
+    if 0 < size <= MEMORY_PATH_MAX:
+        source = await download_to_memory(item['url'], fname, user_id, active_downloads)
+        # Only a size/pool miss goes on to disk, not a URL that just failed
+        if source or failed_urls.get(item['url']) or not active_downloads.get(user_id, False):
+            return source
+    
+    path = await download_file(item['url'], fname, prog, user_id, active_downloads, workspace.path)
+    return path if path and os.path.exists(path) else None
 
 
 async def process_image(
@@ -475,36 +1091,57 @@ async def process_image(
     item: dict,
     caption: str,
     idx: int,
-    prog: Message,
-    user_id: int
+    prog: ItemProgress,
+    user_id: int,
+    workspace: Workspace,
+    probe: Optional[dict] = None
 ) -> bool:
     """Process image download and upload"""
     try:
         safe = sanitize_filename(item['title'])
         ext = os.path.splitext(item['url'])[1] or '.jpg'
         fname = f"{safe}_{idx}{ext}"
+        chat_id = message.chat.id
         
-        ipath = await download_file(item['url'], fname, prog, user_id, active_downloads)
+        if await resend_known(client, chat_id, content_index.lookup_url(chat_id, item['url']), f"🖼️ {caption}"):
+            await prog.delete()
+            return True
+        
+        # Small public file: Telegram fetches it, nothing touches our disk
+        if can_pass_through(probe, 'image'):
+            sent = await send_by_url(client, chat_id, item['url'], f"🖼️ {caption}", 'image')
+            if sent:
+                content_index.remember(chat_id, item['url'], sent.id)
+                await prog.delete()
+                return True
+        
+        ipath = await fetch_small_file(item, fname, prog, user_id, workspace, probe)
         
         if not ipath or not active_downloads.get(user_id, False):
+            if ipath:
+                discard_source(ipath)
             await prog.delete()
             return False
         
-        if not os.path.exists(ipath):
+        # Same bytes already delivered from another URL?
+        digest = ipath.digest if isinstance(ipath, MemoryFile) else read_digest(ipath)
+        known = content_index.lookup_digest(chat_id, digest)
+        if await resend_known(client, chat_id, known, f"🖼️ {caption}"):
+            content_index.remember(chat_id, item['url'], known, digest)
+            discard_source(ipath)
             await prog.delete()
-            return False
+            return True
         
         await prog.edit_text("📤 Uploading image with progress...")
         
         upload_success = await upload_photo(
-            client, message.chat.id, ipath, 
+            client, chat_id, ipath, 
             f"🖼️ {caption}", prog
         )
+        if isinstance(upload_success, Message):
+            content_index.remember(chat_id, item['url'], upload_success.id, digest)
         
-        try:
-            os.remove(ipath)
-        except:
-            pass
+        discard_source(ipath)
         
         await prog.delete()
         return upload_success
@@ -520,36 +1157,57 @@ async def process_document(
     item: dict,
     caption: str,
     idx: int,
-    prog: Message,
-    user_id: int
+    prog: ItemProgress,
+    user_id: int,
+    workspace: Workspace,
+    probe: Optional[dict] = None
 ) -> bool:
     """Process document download and upload"""
     try:
         safe = sanitize_filename(item['title'])
         ext = os.path.splitext(item['url'])[1] or '.pdf'
         fname = f"{safe}_{idx}{ext}"
+        chat_id = message.chat.id
         
-        dpath = await download_file(item['url'], fname, prog, user_id, active_downloads)
+        if await resend_known(client, chat_id, content_index.lookup_url(chat_id, item['url']), f"📄 {caption}"):
+            await prog.delete()
+            return True
+        
+        # Small public file: Telegram fetches it, nothing touches our disk
+        if can_pass_through(probe, 'document'):
+            sent = await send_by_url(client, chat_id, item['url'], f"📄 {caption}", 'document')
+            if sent:
+                content_index.remember(chat_id, item['url'], sent.id)
+                await prog.delete()
+                return True
+        
+        dpath = await fetch_small_file(item, fname, prog, user_id, workspace, probe)
         
         if not dpath or not active_downloads.get(user_id, False):
+            if dpath:
+                discard_source(dpath)
             await prog.delete()
             return False
         
-        if not os.path.exists(dpath):
+        # Same bytes already delivered from another URL?
+        digest = dpath.digest if isinstance(dpath, MemoryFile) else read_digest(dpath)
+        known = content_index.lookup_digest(chat_id, digest)
+        if await resend_known(client, chat_id, known, f"📄 {caption}"):
+            content_index.remember(chat_id, item['url'], known, digest)
+            discard_source(dpath)
             await prog.delete()
-            return False
+            return True
         
         await prog.edit_text("📤 Uploading document with progress...")
         
         upload_success = await upload_document(
-            client, message.chat.id, dpath,
+            client, chat_id, dpath,
             f"📄 {caption}", prog
         )
+        if isinstance(upload_success, Message):
+            content_index.remember(chat_id, item['url'], upload_success.id, digest)
         
-        try:
-            os.remove(dpath)
-        except:
-            pass
+        discard_source(dpath)
         
         await prog.delete()
         return upload_success
@@ -559,6 +1217,33 @@ async def process_document(
         return False
 
 
+async def spill_idle_sessions():
+    """Background task: move idle sessions' item stores out of memory"""
+    while True:
+        await asyncio.sleep(SESSION_JANITOR_INTERVAL)
+        for user_id, session in list(user_data.items()):
+            store = session['items']
+            if active_downloads.get(user_id) or store.spilled:
+                continue
+            if store.idle_for() >= SESSION_SPILL_AFTER:
+                path = str(DOWNLOAD_DIR / f"session_{user_id}.items")
+                # Only the write runs in a thread: get() on the loop never sees a half-dropped store
+                if not await asyncio.get_running_loop().run_in_executor(None, store.dump, path):
+                    continue
+                session = user_data.get(user_id)
+                if (
+                    session and session['items'] is store
+                    and not active_downloads.get(user_id) and store.idle_for() >= SESSION_SPILL_AFTER
+                ):
+                    store.drop(path)
+                else:
+                    # Session ended or was used while we wrote: keep it in memory
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
 def cleanup_user_data(user_id: int, file_path: str):
     """Cleanup user data and temp files"""
     try:
@@ -567,16 +1252,11 @@ def cleanup_user_data(user_id: int, file_path: str):
     except:
         pass
     
-    # Remove temp files
-    for pattern in [f"temp_{user_id}_*", f"thumb_{user_id}_*", f"*_part*"]:
-        for tf in DOWNLOAD_DIR.glob(pattern):
-            try:
-                os.remove(tf)
-            except:
-                pass
+    # Item files live in per-job workspaces, removed as each item finishes
     
     # Clear user data
     if user_id in user_data:
+        user_data[user_id]['items'].discard()
         del user_data[user_id]
     if user_id in active_downloads:
         del active_downloads[user_id]
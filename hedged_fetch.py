@@ -0,0 +1,277 @@
+import time
+import socket
+import asyncio
+import logging
+import statistics
+from typing import Callable, Dict, List, Optional
+import aiohttp
+from config import (
+    RANGED_PART_SIZE, RANGED_MAX_PARTS, STALL_MIN_RATE, STALL_GRACE,
+    HEDGE_SLOW_RATIO, HEDGE_MIN_REMAINING, HEDGE_MAX_PER_PART,
+    HEDGE_CHECK_INTERVAL, WRITE_BUFFER_SIZE
+)
+from utils import format_size
+from disk_writer import BufferedFileWriter, adaptive_chunk_size
+
+logger = logging.getLogger(__name__)
+
+
+class _RotatingResolver(aiohttp.ThreadedResolver):
+    """Resolver that tries a different address first than the main pool"""
+    
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict]:
+        hosts = await super().resolve(host, port, family)
+        return hosts[1:] + hosts[:1] if len(hosts) > 1 else hosts
+
+
+def can_split(response: aiohttp.ClientResponse, total_size: int) -> bool:
+    """Server answers byte ranges and the body is not transfer-compressed"""
+    return (
+        total_size > 0
+        and response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        and response.headers.get('Content-Encoding', 'identity').lower() == 'identity'
+    )
+
+
+class _Copy:
+    """One request fetching (the rest of) a range"""
+    
+    def __init__(self, start: int, hedge: bool):
+        self.start = start
+        self.pos = start  # Bytes received up to here
+        self.flushed = start  # Bytes handed to the writer up to here
+        self.hedge = hedge
+        self.task: Optional[asyncio.Task] = None
+
+
+class _Part:
+    """Byte range [start, end) of a segmented download"""
+    
+    def __init__(self, index: int, start: int, end: int):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.copies: List[_Copy] = []
+        self.done = False
+        self.failures = 0
+        self.started = time.monotonic()
+        self.launched = self.started  # Latest copy, for the grace period
+        self.finished = 0.0
+        self.rate = 0.0
+        self._sample_pos = start
+        self._sample_time = self.started
+    
+    def position(self) -> int:
+        return max((c.pos for c in self.copies), default=self.start)
+    
+    def flushed(self) -> int:
+        return max((c.flushed for c in self.copies), default=self.start)
+    
+    def live(self) -> List[_Copy]:
+        return [c for c in self.copies if c.task and not c.task.done()]
+    
+    def hedges(self) -> int:
+        return sum(1 for c in self.copies if c.hedge)
+    
+    def sample(self, now: float) -> float:
+        """Throughput since the last check (bytes/s, smoothed)"""
+        pos = self.position()
+        elapsed = now - self._sample_time
+        if elapsed > 0:
+            rate = (pos - self._sample_pos) / elapsed
+            self.rate = rate if self._sample_pos == self.start else 0.5 * rate + 0.5 * self.rate
+        self._sample_pos, self._sample_time = pos, now
+        return self.rate
+    
+    def average_rate(self) -> float:
+        end = self.finished or time.monotonic()
+        return (self.end - self.start) / max(end - self.started, 1e-3)
+
+
+class HedgedRangeFetcher:
+    """
+    Fetches one file as parallel byte ranges. Every range is measured
+    against a throughput floor and against its peers; a slow or stalled
+    range gets a duplicate request on a fresh connection (to another
+    resolved address when there is one) and the first copy to finish wins.
+    """
+    
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: Dict[str, str],
+        total_size: int,
+        writer: BufferedFileWriter,
+        ssl_context,
+        chunk_size: int
+    ):
+        self.session = session
+        self.url = url
+        self.headers = dict(headers, **{'Accept-Encoding': 'identity'})
+        self.total_size = total_size
+        self.writer = writer
+        self.ssl_context = ssl_context
+        self.chunk_size = chunk_size
+        self.hedges_issued = 0
+        self._hedge_session: Optional[aiohttp.ClientSession] = None
+        self._changed = asyncio.Event()
+        
+        count = max(1, min(RANGED_MAX_PARTS, total_size // RANGED_PART_SIZE))
+        step = -(-total_size // count)
+        self.parts = [
+            _Part(i, start, min(start + step, total_size))
+            for i, start in enumerate(range(0, total_size, step))
+        ]
+    
+    def downloaded(self) -> int:
+        return sum(p.position() - p.start for p in self.parts)
+    
+    def _fresh_session(self) -> aiohttp.ClientSession:
+        if self._hedge_session is None:
+            connector = aiohttp.TCPConnector(
+                ssl=self.ssl_context,
+                resolver=_RotatingResolver(),
+                force_close=True,
+            )
+            self._hedge_session = aiohttp.ClientSession(
+                connector=connector, timeout=self.session.timeout
+            )
+        return self._hedge_session
+    
+    async def _stream(self, part: _Part, copy: _Copy, response: aiohttp.ClientResponse):
+        buf = bytearray()
+        while copy.pos < part.end:
+            chunk = await response.content.read(min(self.chunk_size, part.end - copy.pos))
+            if not chunk:
+                raise aiohttp.ClientPayloadError(f"range {part.index} ended early")
+            buf += chunk
+            copy.pos += len(chunk)
+            if len(buf) >= WRITE_BUFFER_SIZE:
+                data = bytes(buf)
+                buf.clear()
+                await self.writer.write_at(copy.flushed, data)
+                copy.flushed += len(data)
+        if buf:
+            await self.writer.write_at(copy.flushed, bytes(buf))
+            copy.flushed += len(buf)
+    
+    async def _run_copy(self, part: _Part, copy: _Copy, response: Optional[aiohttp.ClientResponse]):
+        try:
+            if response is not None:
+                await self._stream(part, copy, response)
+            else:
+                session = self._fresh_session() if copy.hedge else self.session
+                headers = dict(self.headers, Range=f"bytes={copy.start}-{part.end - 1}")
+                async with session.get(self.url, headers=headers) as resp:
+                    if resp.status != 206:
+                        raise aiohttp.ClientResponseError(
+                            resp.request_info, resp.history, status=resp.status,
+                            message="range request not honoured"
+                        )
+                    await self._stream(part, copy, resp)
+            
+            if not part.done:
+                part.done = True
+                part.finished = time.monotonic()
+                if copy.hedge:
+                    logger.info(f"🏁 Hedge won range {part.index}")
+                for other in part.copies:
+                    if other is not copy and other.task:
+                        other.task.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            part.failures += 1
+            logger.debug(f"Range {part.index} copy failed at {copy.pos}: {e}")
+        finally:
+            self._changed.set()
+    
+    def _launch(self, part: _Part, start: int, hedge: bool, response=None):
+        copy = _Copy(start, hedge)
+        part.copies.append(copy)
+        part.launched = time.monotonic()  # Grace period restarts for every new copy
+        copy.task = asyncio.create_task(self._run_copy(part, copy, response))
+    
+    def _is_slow(self, part: _Part, rate: float, peer_rate: float) -> bool:
+        if rate < STALL_MIN_RATE:
+            return True
+        return peer_rate > 0 and rate < HEDGE_SLOW_RATIO * peer_rate
+    
+    def _check(self, now: float) -> bool:
+        """Hedge slow ranges, restart failed ones; False when a range is lost"""
+        running = [p for p in self.parts if not p.done]
+        rates = {p.index: p.sample(now) for p in running}
+        
+        for part in running:
+            remaining = part.end - part.flushed()
+            
+            if not part.live():
+                # Every copy of this range failed: retry on a fresh connection
+                if part.failures > HEDGE_MAX_PER_PART + 1:
+                    logger.error(f"Range {part.index} failed {part.failures} times")
+                    return False
+                self._launch(part, part.flushed(), hedge=True)
+                continue
+            
+            if (
+                now - part.launched < STALL_GRACE
+                or remaining < HEDGE_MIN_REMAINING
+                or part.hedges() >= HEDGE_MAX_PER_PART
+            ):
+                continue
+            
+            peers = [
+                rates[p.index] if not p.done else p.average_rate()
+                for p in self.parts if p is not part and (p.done or now - p.launched >= STALL_GRACE)
+            ]
+            peer_rate = statistics.median(peers) if peers else 0.0
+            
+            if self._is_slow(part, rates[part.index], peer_rate):
+                logger.warning(
+                    f"🐢 Range {part.index} at {format_size(int(rates[part.index]))}/s "
+                    f"(peers {format_size(int(peer_rate))}/s), hedging "
+                    f"{format_size(remaining)} on a fresh connection"
+                )
+                self.hedges_issued += 1
+                self._launch(part, part.flushed(), hedge=True)
+        return True
+    
+    async def run(
+        self,
+        first_response: aiohttp.ClientResponse,
+        is_active: Callable[[], bool],
+        on_progress: Optional[Callable] = None
+    ) -> bool:
+        """Download every range; first_response serves range 0"""
+        for part in self.parts:
+            self._launch(part, part.start, hedge=False, response=first_response if part.index == 0 else None)
+        
+        ok = True
+        try:
+            while not all(p.done for p in self.parts):
+                try:
+                    await asyncio.wait_for(self._changed.wait(), HEDGE_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._changed.clear()
+                
+                if not is_active() or not self._check(time.monotonic()):
+                    ok = False
+                    break
+                
+                running = [p.rate for p in self.parts if not p.done]
+                if running:
+                    self.chunk_size = adaptive_chunk_size(sum(running) / len(running))
+                if on_progress:
+                    await on_progress(self.downloaded())
+            return ok
+        finally:
+            tasks = [c.task for p in self.parts for c in p.copies if c.task and not c.task.done()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._hedge_session:
+                await self._hedge_session.close()
+            if self.hedges_issued:
+                logger.info(f"Hedged {self.hedges_issued} slow range(s) for {self.url}")
@@ -0,0 +1,206 @@
+import re
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+import aiohttp
+from yt_dlp.aes import aes_cbc_decrypt_bytes
+from config import FRAGMENT_RETRIES, MANIFEST_MAX_BYTES
+from disk_writer import BufferedFileWriter
+from retry_policy import is_retryable, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+_RESOLUTION = re.compile(r'\d+x(\d+)')
+
+
+class HlsUnsupported(Exception):
+    """Playlist feature the native engine leaves to yt-dlp"""
+
+
+def _attrs(text: str) -> Dict[str, str]:
+    return {k: v.strip('"') for k, v in _ATTR.findall(text)}
+
+
+class Segment:
+    def __init__(self, uri: str, seq: int, key: Optional[Dict[str, str]]):
+        self.uri = uri
+        self.seq = seq
+        self.key = key
+
+
+def parse_master(text: str, base_url: str) -> Tuple[List[Tuple[int, int, str]], bool]:
+    """
+    Variants (height, bandwidth, uri) with muxed audio, and whether any
+    variant was dropped because its audio is a separate rendition playlist
+    """
+    variants = []
+    split_groups = set()
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-MEDIA:'):
+            attrs = _attrs(line[13:])
+            if attrs.get('TYPE') == 'AUDIO' and 'URI' in attrs:
+                split_groups.add(attrs.get('GROUP-ID'))
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = _attrs(line[18:])
+            uri = next((l.strip() for l in lines[i + 1:] if l.strip() and not l.startswith('#')), None)
+            if uri:
+                resolution = _RESOLUTION.match(attrs.get('RESOLUTION', ''))
+                variants.append((
+                    int(resolution.group(1)) if resolution else 0,
+                    int(attrs.get('BANDWIDTH', 0) or 0),
+                    urljoin(base_url, uri),
+                    attrs.get('AUDIO')
+                ))
+    muxed = [(h, bw, uri) for h, bw, uri, group in variants if group not in split_groups]
+    return muxed, len(muxed) < len(variants)
+
+
+def parse_media(text: str, base_url: str) -> Tuple[Optional[str], List[Segment]]:
+    """Init section URI (fMP4) and segments of a VOD media playlist"""
+    if '#EXT-X-ENDLIST' not in text:
+        raise HlsUnsupported("live playlist")
+    if '#EXT-X-BYTERANGE' in text:
+        raise HlsUnsupported("byte-range segments")
+    
+    init_uri = None
+    key = None
+    seq = 0
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            seq = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = _attrs(line[11:])
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128' and attrs.get('URI'):
+                key = dict(attrs, URI=urljoin(base_url, attrs['URI']))
+            else:
+                raise HlsUnsupported(f"{method} encryption")
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = _attrs(line[11:])
+            if 'BYTERANGE' in attrs or init_uri:
+                raise HlsUnsupported("multiple or ranged init sections")
+            init_uri = urljoin(base_url, attrs['URI'])
+        elif not line.startswith('#'):
+            segments.append(Segment(urljoin(base_url, line), seq, key))
+            seq += 1
+    
+    if not segments:
+        raise HlsUnsupported("empty playlist")
+    return init_uri, segments
+
+
+def _decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    # yt-dlp uses pycryptodome when installed, pure-Python AES otherwise
+    plain = aes_cbc_decrypt_bytes(data, key, iv)
+    return plain[:-plain[-1]] if plain and 1 <= plain[-1] <= 16 else plain
+
+
+class HlsFetcher:
+    """
+    Native HLS engine for VOD playlists: picks the variant yt-dlp would
+    pick, fetches segments concurrently over the shared session, decrypts
+    AES-128 and appends them in order through the disk writer. Anything it
+    does not handle raises HlsUnsupported so the caller can use yt-dlp.
+    """
+    
+    def __init__(self, session: aiohttp.ClientSession, url: str, headers: Dict[str, str], max_height: int, concurrency: int):
+        self.session = session
+        self.url = url
+        self.headers = headers
+        self.max_height = max_height
+        self.concurrency = max(1, concurrency)
+        self.init_uri: Optional[str] = None
+        self.segments: List[Segment] = []
+        self.done_segments = 0
+        self.downloaded = 0
+        self._keys: Dict[str, bytes] = {}
+    
+    async def _get(self, url: str, limit: int = -1) -> Tuple[bytes, str]:
+        for attempt in range(FRAGMENT_RETRIES + 1):
+            try:
+                async with self.session.get(url, headers=self.headers) as response:
+                    if response.status != 200:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason or ""
+                        )
+                    return await response.content.read(limit), str(response.url)
+            except Exception as e:
+                if not is_retryable(e) or attempt == FRAGMENT_RETRIES:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+    
+    async def resolve(self) -> bool:
+        """Load the playlist; True if the output is fMP4 rather than MPEG-TS"""
+        data, final_url = await self._get(self.url, MANIFEST_MAX_BYTES)
+        text = data.decode('utf-8', errors='replace')
+        if '#EXTM3U' not in text:
+            raise HlsUnsupported("not an HLS playlist")
+        
+        if '#EXT-X-STREAM-INF' in text:
+            variants, split_audio = parse_master(text, final_url)
+            if split_audio:
+                raise HlsUnsupported("separate audio renditions")
+            if not variants:
+                raise HlsUnsupported("no variants")
+            fitting = [v for v in variants if v[0] <= self.max_height]
+            height, bandwidth, media_url = max(fitting) if fitting else min(variants)
+            logger.info(f"📺 HLS variant {height}p ({bandwidth // 1000}kbps) for {self.url}")
+            data, final_url = await self._get(media_url, MANIFEST_MAX_BYTES)
+            text = data.decode('utf-8', errors='replace')
+        
+        self.init_uri, self.segments = parse_media(text, final_url)
+        return self.init_uri is not None
+    
+    async def _segment(self, segment: Segment) -> bytes:
+        data, _ = await self._get(segment.uri)
+        if segment.key:
+            key_uri = segment.key['URI']
+            if key_uri not in self._keys:
+                self._keys[key_uri] = (await self._get(key_uri))[0]
+            iv = segment.key.get('IV')
+            iv = bytes.fromhex(iv[2:].zfill(32)) if iv else segment.seq.to_bytes(16, 'big')
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, _decrypt, data, self._keys[key_uri], iv
+            )
+        return data
+    
+    async def run(
+        self,
+        writer: BufferedFileWriter,
+        is_active: Callable[[], bool],
+        on_progress: Optional[Callable] = None
+    ) -> bool:
+        """Fetch every segment (up to `concurrency` ahead) and write them in order"""
+        if self.init_uri:
+            await writer.write((await self._get(self.init_uri))[0])
+        
+        pending: Dict[int, asyncio.Task] = {}
+        try:
+            for i in range(len(self.segments)):
+                for ahead in range(i, min(i + self.concurrency, len(self.segments))):
+                    if ahead not in pending:
+                        pending[ahead] = asyncio.create_task(self._segment(self.segments[ahead]))
+                
+                data = await pending.pop(i)
+                if not is_active():
+                    return False
+                await writer.write(data)
+                self.done_segments += 1
+                self.downloaded += len(data)
+                if on_progress:
+                    await on_progress(self)
+            return True
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
@@ -0,0 +1,174 @@
+import os
+import time
+import pickle
+import logging
+from array import array
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Interned type codes (one byte per item instead of a str per dict)
+TYPE_NAMES = ('video', 'image', 'document', 'unknown')
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+
+class BatchItem:
+    """Lightweight item record, supports item['title'] style access"""
+
+    __slots__ = ('title', 'url', 'type')
+
+    def __init__(self, title: str, url: str, ftype: str):
+        self.title = title
+        self.url = url
+        self.type = ftype
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"BatchItem({self.title!r}, {self.url!r}, {self.type!r})"
+
+
+class ItemView:
+    """Lazy [start, end) window over an ItemStore, records built on access"""
+
+    def __init__(self, store: 'ItemStore', start: int, end: int):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __iter__(self) -> Iterator[BatchItem]:
+        for i in range(self.start, self.end):
+            yield self.store.get(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, _ = key.indices(len(self))
+            return ItemView(self.store, self.start + start, self.start + max(start, end))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("item index out of range")
+        return self.store.get(self.start + key)
+
+
+class ItemStore:
+    """
+    Compact array-backed batch items: all titles and URLs live in ONE
+    string arena addressed by an offsets array, types are byte codes.
+    Idle stores can be spilled to disk and are reloaded on next access.
+    """
+
+    def __init__(self, records: Iterable[Tuple[str, str, str]] = ()):
+        parts = []
+        offsets = array('Q', [0])
+        types = bytearray()
+        pos = 0
+
+        for title, url, ftype in records:
+            parts.append(title)
+            pos += len(title)
+            offsets.append(pos)
+            parts.append(url)
+            pos += len(url)
+            offsets.append(pos)
+            types.append(TYPE_CODES[ftype])
+
+        self._arena: Optional[str] = ''.join(parts)
+        self._offsets: Optional[array] = offsets
+        self._types: Optional[bytearray] = types
+        self._count = len(types)
+        self._spill_path: Optional[str] = None
+        self.last_access = time.monotonic()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[BatchItem]:
+        return iter(ItemView(self, 0, self._count))
+
+    def __getitem__(self, key):
+        return ItemView(self, 0, self._count)[key]
+
+    def _ensure_loaded(self):
+        self.last_access = time.monotonic()
+        if self._arena is not None:
+            return
+
+        with open(self._spill_path, 'rb') as f:
+            arena, offsets, types = pickle.load(f)
+        self._arena = arena
+        self._offsets = array('Q')
+        self._offsets.frombytes(offsets)
+        self._types = bytearray(types)
+        logger.info(f"Reloaded spilled items: {self._spill_path}")
+
+    def get(self, index: int) -> BatchItem:
+        """Build the record for item `index` (0-based)"""
+        self._ensure_loaded()
+        o = self._offsets
+        t0, t1, t2 = o[2 * index], o[2 * index + 1], o[2 * index + 2]
+        return BatchItem(
+            self._arena[t0:t1], self._arena[t1:t2], TYPE_NAMES[self._types[index]]
+        )
+
+    def type_counts(self) -> Dict[str, int]:
+        """Number of items per type"""
+        self._ensure_loaded()
+        counts = {}
+        for code in self._types:
+            name = TYPE_NAMES[code]
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    @property
+    def spilled(self) -> bool:
+        return self._arena is None
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_access
+
+    def dump(self, path: str) -> bool:
+        """Write the arena to disk; only reads the store, so it may run in a worker thread"""
+        arena, offsets, types = self._arena, self._offsets, self._types
+        if arena is None:
+            return True
+        try:
+            with open(path, 'wb') as f:
+                pickle.dump(
+                    (arena, offsets.tobytes(), bytes(types)),
+                    f, protocol=pickle.HIGHEST_PROTOCOL
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Item spill error: {e}")
+            return False
+
+    def drop(self, path: str):
+        """Free the arena after dump(path); call from the thread that reads the store"""
+        if self.spilled:
+            return
+        self._spill_path = path
+        self._arena = self._offsets = self._types = None
+        logger.info(f"Spilled {self._count} idle items to {path}")
+
+    def spill(self, path: str) -> bool:
+        """Write the arena to disk and drop it from memory"""
+        if not self.dump(path):
+            return False
+        self.drop(path)
+        return True
+
+    def discard(self):
+        """Remove the spill file, if any"""
+        if self._spill_path:
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
@@ -2,8 +2,21 @@ import logging
 import asyncio
 from aiohttp import web
 from pyrogram import Client, idle
-from config import API_ID, API_HASH, BOT_TOKEN, PORT
-from handlers import setup_handlers
+from config import API_ID, API_HASH, BOT_TOKEN, PORT, DOWNLOAD_DIR
+from handlers import setup_handlers, spill_idle_sessions
+from disk_budget import disk_budget
+from workspace import workspace_janitor, active_workspaces
+from disk_writer import writer_stats
+from content_index import content_index
+from memory_pool import memory_pool
+from retry_policy import circuit_breaker, failed_urls
+from batch_tasks import batch_registry
+from ydl_pool import ydl_pool
+from downloader import route_stats, throughput
+from video_processor import _thumbnail_executor
+import youtube
+import metrics
+from utils import format_size
 
 # Enhanced logging configuration
 logging.basicConfig(
@@ -19,6 +32,8 @@ logger = logging.getLogger(__name__)
 # Suppress unnecessary logs
 logging.getLogger('pyrogram').setLevel(logging.WARNING)
 logging.getLogger('aiohttp').setLevel(logging.WARNING)
+# pyrogram sleeps through FloodWaits under sleep_threshold and only logs them
+logging.getLogger('pyrogram.session.session').addHandler(metrics.FloodWaitLogCounter())
 
 # Initialize bot client with ULTRA-OPTIMIZED settings
 app = Client(
@@ -31,6 +46,9 @@ app = Client(
     max_concurrent_transmissions=10  # More concurrent uploads
 )
 
+# Installed as the loop's default executor in main(), so /metrics can count its work
+default_executor = metrics.CountingExecutor(thread_name_prefix="default")
+
 # Web server for health checks and monitoring
 web_app = web.Application()
 
@@ -56,6 +74,59 @@ async def stats(request):
 
 💪 STATUS: Active and Ready!
     """
+    batches = batch_registry.counts()
+    stats_text += (
+        f"\n📦 BATCHES:\n"
+        f"- Running: {batches['running']} (limit {batch_registry.max_running})\n"
+        f"- Queued: {batches['queued']}\n"
+        f"- Stopping: {batches['stopping']}\n"
+        f"- Finished: {batch_registry.completed} done, {batch_registry.failed} crashed, {batch_registry.cancelled} cancelled\n"
+    )
+    disk = disk_budget.usage()
+    stats_text += (
+        f"\n💾 DISK ({DOWNLOAD_DIR}):\n"
+        f"- Free: {format_size(disk['free'])} / {format_size(disk['total'])}\n"
+        f"- Reserved: {format_size(disk['reserved'])}\n"
+        f"- Active Jobs: {disk['active_jobs']}\n"
+        f"- Job Workspaces: {active_workspaces()}\n"
+        f"- Waiting For Space: {disk['waiting_jobs']}\n"
+    )
+    writer = writer_stats.snapshot()
+    stats_text += (
+        f"\n✍️ DISK WRITER:\n"
+        f"- Active Writers: {writer['active_writers']}\n"
+        f"- Queue Depth: {writer['queue_depth']}\n"
+        f"- Flush Latency: {writer['flush_latency_ms']:.1f}ms (max {writer['max_flush_latency_ms']:.1f}ms)\n"
+        f"- Written: {format_size(writer['bytes_written'])}\n"
+    )
+    pool = memory_pool.stats()
+    stats_text += (
+        f"\n🧠 MEMORY PATH:\n"
+        f"- Buffers In Use: {pool['in_use']} ({format_size(pool['in_use_bytes'])} / {format_size(pool['cap_bytes'])})\n"
+        f"- Sent To Disk (cap reached): {pool['fallbacks']}\n"
+    )
+    stats_text += (
+        f"\n🔁 RETRY POLICY:\n"
+        f"- Hosts Tripped Now: {circuit_breaker.open_hosts()}\n"
+        f"- Circuit Trips: {circuit_breaker.trips}\n"
+        f"- Recently Failed URLs: {len(failed_urls)}\n"
+    )
+    stats_text += (
+        f"\n🧭 VIDEO ROUTES:\n"
+        + "".join(f"- {route}: {count}\n" for route, count in route_stats.counts.items())
+        + f"- Native HLS Handed To yt-dlp: {route_stats.fallbacks}\n"
+    )
+    ydl = ydl_pool.stats()
+    stats_text += (
+        f"\n🎞️ YT-DLP POOL:\n"
+        f"- Idle Instances: {ydl['idle']}\n"
+        f"- Built: {ydl['created']} | Reused: {ydl['reused']} | Retired: {ydl['retired']}\n"
+    )
+    stats_text += (
+        f"\n♻️ DEDUPE:\n"
+        f"- Hits: {content_index.hits}\n"
+        f"- Misses: {content_index.misses}\n"
+    )
     return web.Response(text=stats_text, content_type="text/plain")
 
 async def root(request):
@@ -64,13 +135,69 @@ async def root(request):
         content_type="text/plain"
     )
 
+# Scrape-time metrics read from the same objects /stats reports
+metrics.Collected(
+    'queue_depth', 'Work waiting for a slot', ('queue',),
+    lambda: {
+        ('disk_writer',): writer_stats.snapshot()['queue_depth'],
+        ('disk_space',): disk_budget.usage()['waiting_jobs'],
+        ('batches',): batch_registry.counts()['queued'],
+    }
+)
+metrics.Collected(
+    'in_flight', 'Jobs currently in progress', ('kind',),
+    lambda: {
+        ('batches',): batch_registry.counts()['running'] + batch_registry.counts()['stopping'],
+        ('disk_jobs',): disk_budget.usage()['active_jobs'],
+        ('workspaces',): active_workspaces(),
+        ('disk_writers',): writer_stats.snapshot()['active_writers'],
+        ('memory_buffers',): memory_pool.stats()['in_use'],
+    }
+)
+metrics.Collected(
+    'executor', 'Thread pool running work, limit and backlog', ('executor', 'stat'),
+    lambda: {
+        **metrics.executor_stats('default', default_executor),
+        **metrics.executor_stats('thumbnail', _thumbnail_executor),
+    }
+)
+metrics.Collected(
+    'download_rate_bytes', 'Smoothed download throughput over finished jobs (bytes/s)', (),
+    lambda: {(): throughput.rate}
+)
+metrics.Collected(
+    'cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'),
+    lambda: {
+        ('content_index', 'hit'): content_index.hits,
+        ('content_index', 'miss'): content_index.misses,
+        ('ydl_pool', 'hit'): ydl_pool.stats()['reused'],
+        ('ydl_pool', 'miss'): ydl_pool.stats()['created'],
+        ('youtube_info', 'hit'): youtube.info_cache_stats['hits'],
+        ('youtube_info', 'miss'): youtube.info_cache_stats['misses'],
+    },
+    kind='counter'
+)
+metrics.Collected(
+    'video_routes_total', 'Videos per download engine', ('route',),
+    lambda: {(route,): count for route, count in route_stats.counts.items()},
+    kind='counter'
+)
+
+async def metrics_endpoint(request):
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
 web_app.router.add_get("/", root)
 web_app.router.add_get("/health", health_check)
 web_app.router.add_get("/stats", stats)
+web_app.router.add_get("/metrics", metrics_endpoint)
 
 
 async def main():
     """Main bot initialization with enhanced error handling"""
+    asyncio.get_running_loop().set_default_executor(default_executor)
     try:
         # Start web server
         runner = web.AppRunner(web_app)
@@ -80,11 +207,16 @@ async def main():
         logger.info(f"✅ Web server started on port {PORT}")
         logger.info(f"📊 Health check: http://0.0.0.0:{PORT}/health")
         logger.info(f"📈 Stats: http://0.0.0.0:{PORT}/stats")
+        logger.info(f"📉 Metrics: http://0.0.0.0:{PORT}/metrics")
         
         # Setup bot handlers
         setup_handlers(app)
         logger.info("✅ Bot handlers configured")
         
+        # Background maintenance
+        asyncio.create_task(spill_idle_sessions())
+        asyncio.create_task(workspace_janitor())
+        
         # Start bot
         await app.start()
         
@@ -104,7 +236,7 @@ async def main():
         logger.info("   • Auto File Splitting (>1.9GB)")
         logger.info("   • YouTube Link Support")
         logger.info("   • Failed Link Handling")
-        logger.info("   • Enhanced Thumbnail Generation (6 methods)")
+        logger.info("   • Single-Pass Thumbnail Generation")
         logger.info("   • Parallel Processing")
         logger.info("   • Adaptive Connection Pooling")
         logger.info("=" * 70)
@@ -117,6 +249,7 @@ async def main():
         raise
     finally:
         try:
+            await batch_registry.shutdown()
             await app.stop()
             logger.info("🛑 Bot stopped gracefully")
         except:
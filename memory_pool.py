@@ -0,0 +1,112 @@
+import io
+import os
+import logging
+from typing import Dict, List, Optional, Union
+from config import MEMORY_PATH_MAX, MEMORY_POOL_CAP, MEMORY_POOL_IDLE_BUFFERS
+
+logger = logging.getLogger(__name__)
+
+
+class BufferPool:
+    """Fixed-size reusable buffers for small downloads, under a global cap"""
+    
+    def __init__(self, buffer_size: int, cap: int, idle: int):
+        self.buffer_size = buffer_size
+        self.max_buffers = max(1, cap // buffer_size)
+        self.idle = idle
+        self.in_use = 0
+        self.misses = 0
+        self._free: List[bytearray] = []
+    
+    def acquire(self) -> Optional[bytearray]:
+        """A buffer, or None when the cap is reached (caller goes to disk)"""
+        if self.in_use >= self.max_buffers:
+            self.misses += 1
+            return None
+        self.in_use += 1
+        return self._free.pop() if self._free else bytearray(self.buffer_size)
+    
+    def release(self, buffer: bytearray):
+        self.in_use -= 1
+        if len(self._free) < self.idle:
+            self._free.append(buffer)
+    
+    def stats(self) -> Dict:
+        return {
+            'in_use': self.in_use,
+            'in_use_bytes': self.in_use * self.buffer_size,
+            'cap_bytes': self.max_buffers * self.buffer_size,
+            'idle': len(self._free),
+            'fallbacks': self.misses,
+        }
+
+
+memory_pool = BufferPool(MEMORY_PATH_MAX, MEMORY_POOL_CAP, MEMORY_POOL_IDLE_BUFFERS)
+
+
+class MemoryFile(io.RawIOBase):
+    """Read-only file object over a pooled buffer, uploadable by pyrogram"""
+    
+    def __init__(self, buffer: bytearray, name: str):
+        super().__init__()
+        self.buffer = buffer
+        self.name = name
+        self.size = 0
+        self.digest: Optional[str] = None
+        self._pos = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), self.size - self._pos))
+        with memoryview(self.buffer) as view:
+            b[:n] = view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def close(self):
+        """Hand the buffer back to the pool"""
+        if self.buffer is not None:
+            memory_pool.release(self.buffer)
+            self.buffer = None
+        super().close()
+
+
+def open_memory_file(name: str) -> Optional[MemoryFile]:
+    """Empty in-memory file backed by a pooled buffer, None if the pool is full"""
+    buffer = memory_pool.acquire()
+    return MemoryFile(buffer, name) if buffer is not None else None
+
+
+Source = Union[str, MemoryFile]
+
+
+def source_name(source: Source) -> str:
+    return source.name if isinstance(source, MemoryFile) else os.path.basename(source)
+
+
+def source_size(source: Source) -> int:
+    return source.size if isinstance(source, MemoryFile) else os.path.getsize(source)
+
+
+def discard_source(source: Source):
+    """Release a downloaded item: buffer back to the pool, or file removed"""
+    try:
+        if isinstance(source, MemoryFile):
+            source.close()
+        else:
+            os.remove(source)
+    except OSError:
+        pass
@@ -0,0 +1,257 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from config import METRICS_PREFIX, METRICS_MAX_HOSTS, METRICS_STAGE_BUCKETS
+from utils import get_host
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+    
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        registry.append(self)
+    
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+    
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Collected(_Metric):
+    """Gauge or counter read at scrape time from existing stats objects"""
+    
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...],
+        collect: Callable[[], Dict[Labels, float]],
+        kind: str = 'gauge'
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+        self.kind = kind
+    
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.debug(f"Metric {self.name} collect error: {e}")
+            return []
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets: Iterable[float]):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = sorted(buckets) + [float('inf')]
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), s, n) for k, (c, s, n) in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+registry: List[_Metric] = []
+
+stage_seconds = Histogram(
+    'stage_seconds', 'Time spent per pipeline stage', ('stage',), METRICS_STAGE_BUCKETS
+)
+transfer_bytes = Counter(
+    'transfer_bytes_total', 'Bytes moved, by direction and remote host', ('direction', 'host')
+)
+transfer_seconds = Counter(
+    'transfer_seconds_total', 'Seconds spent moving those bytes (bytes/s = bytes / seconds)', ('direction', 'host')
+)
+floodwaits = Counter('floodwait_total', 'Telegram FloodWait responses', ('source',))
+floodwait_seconds = Counter('floodwait_seconds_total', 'Seconds Telegram asked us to wait', ('source',))
+
+_hosts: set = set()
+
+
+def host_label(url: str) -> str:
+    """Host for a per-host label, capped at METRICS_MAX_HOSTS distinct values"""
+    host = get_host(url) or 'unknown'
+    if host in _hosts:
+        return host
+    if len(_hosts) >= METRICS_MAX_HOSTS:
+        return 'other'
+    _hosts.add(host)
+    return host
+
+
+def record_transfer(direction: str, host: str, nbytes: int, seconds: float):
+    if nbytes <= 0:
+        return
+    transfer_bytes.inc(nbytes, direction=direction, host=host)
+    transfer_seconds.inc(max(seconds, 0.0), direction=direction, host=host)
+
+
+def record_floodwait(source: str, seconds: float):
+    floodwaits.inc(source=source)
+    floodwait_seconds.inc(seconds, source=source)
+
+
+def timed(stage: str):
+    """Decorator: observe the call's duration (sync or async) in stage_seconds"""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    stage_seconds.observe(time.perf_counter() - start, stage=stage)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    stage_seconds.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+class FloodWaitLogCounter(logging.Handler):
+    """Counts the FloodWaits pyrogram sleeps through itself (it only logs them)"""
+    
+    def emit(self, record: logging.LogRecord):
+        # Never raise: an exception here would surface in pyrogram's logging call
+        try:
+            if (
+                isinstance(record.msg, str) and record.msg.startswith('[%s] Waiting for')
+                and isinstance(record.args, tuple) and len(record.args) >= 2
+            ):
+                record_floodwait('pyrogram', float(record.args[1]))
+        except Exception:
+            pass
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that counts its own queued and running work"""
+    
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = ''):
+        # Same default as ThreadPoolExecutor, kept so it can be reported
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        super().__init__(max_workers=self.max_workers, thread_name_prefix=thread_name_prefix)
+        self.queued = 0
+        self.active = 0
+        self._count_lock = threading.Lock()
+    
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._count_lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self.active -= 1
+        
+        def done(future):
+            if future.cancelled():
+                with self._count_lock:
+                    self.queued -= 1  # Never ran
+        
+        with self._count_lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            with self._count_lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(done)
+        return future
+
+
+def executor_stats(name: str, executor: Optional[CountingExecutor]) -> Dict[Labels, float]:
+    """Running work, limit and backlog of a CountingExecutor"""
+    if executor is None:
+        return {}
+    return {
+        (name, 'active'): executor.active,
+        (name, 'max_workers'): executor.max_workers,
+        (name, 'queued'): executor.queued,
+    }
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    return '\n'.join(m.render() for m in registry) + '\n'
@@ -0,0 +1,366 @@
+import re
+import ssl
+import time
+import asyncio
+import aiohttp
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin
+from config import (
+    PREFLIGHT_CONCURRENCY, PREFLIGHT_TIMEOUT, PREFLIGHT_CACHE_TTL,
+    CONNECTION_POOL_SIZE, DNS_CACHE_TTL, MANIFEST_MAX_BYTES,
+    ESTIMATE_SAMPLE_SIZE, URL_PASSTHROUGH, URL_PHOTO_MAX, URL_DOCUMENT_MAX,
+    URL_PHOTO_TYPES, URL_DOCUMENT_TYPES
+)
+from utils import is_youtube_url
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that mean the link is gone for good
+DEAD_STATUSES = {404, 410, 451}
+
+# Content types that override the URL-based classification
+_CONTENT_TYPE_MAP = (
+    ('application/vnd.apple.mpegurl', 'video'),
+    ('application/x-mpegurl', 'video'),
+    ('application/dash+xml', 'video'),
+    ('video/', 'video'),
+    ('image/', 'image'),
+    ('application/pdf', 'document'),
+    ('application/zip', 'document'),
+    ('application/msword', 'document'),
+    ('application/vnd.openxmlformats', 'document'),
+    ('application/x-rar', 'document'),
+    ('application/vnd.rar', 'document'),
+)
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0',
+    'Accept': '*/*',
+}
+
+# url -> (timestamp, probe result)
+_probe_cache: Dict[str, tuple] = {}
+
+# manifest url -> (timestamp, {'duration': seconds, 'variants': [(height, bits/s)]})
+_variant_cache: Dict[str, tuple] = {}
+
+_HLS_STREAM_INF = re.compile(r'#EXT-X-STREAM-INF:(.*)')
+_HLS_BANDWIDTH = re.compile(r'(?:^|,)BANDWIDTH=(\d+)')
+_HLS_RESOLUTION = re.compile(r'RESOLUTION=\d+x(\d+)')
+_HLS_EXTINF = re.compile(r'#EXTINF:([\d.]+)')
+_DASH_DURATION = re.compile(r'mediaPresentationDuration="P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?"')
+_DASH_REPRESENTATION = re.compile(r'<Representation\b([^>]*)>')
+_DASH_ATTR = re.compile(r'\b(bandwidth|height)="(\d+)"')
+
+
+def type_from_content_type(content_type: str) -> Optional[str]:
+    """Map a Content-Type header to an item type"""
+    content_type = (content_type or '').lower()
+    for prefix, ftype in _CONTENT_TYPE_MAP:
+        if content_type.startswith(prefix):
+            return ftype
+    return None
+
+
+def is_direct_media(probe: Optional[Dict]) -> bool:
+    """True if the probe shows a plain media file (no playlist/page extraction needed)"""
+    if not probe or not probe.get('reachable'):
+        return False
+    content_type = probe.get('content_type', '')
+    return content_type.startswith('video/') and 'mpegurl' not in content_type
+
+
+def can_pass_through(probe: Optional[Dict], kind: str) -> bool:
+    """True if Telegram can fetch this image/document from its URL directly"""
+    if not URL_PASSTHROUGH or not probe or not probe.get('reachable') or not probe.get('size'):
+        return False
+    content_type = probe.get('content_type', '').split(';', 1)[0].strip().lower()
+    if kind == 'image':
+        return content_type in URL_PHOTO_TYPES and probe['size'] <= URL_PHOTO_MAX
+    return content_type in URL_DOCUMENT_TYPES and probe['size'] <= URL_DOCUMENT_MAX
+
+
+def get_cached_probe(url: str) -> Optional[Dict]:
+    """Return a fresh cached probe for url, if any"""
+    return _cache_get(_probe_cache, url)
+
+
+def _is_manifest(url: str, content_type: str) -> bool:
+    content_type = content_type.lower()
+    path = url.split('?', 1)[0].lower()
+    return (
+        path.endswith(('.m3u8', '.mpd'))
+        or 'mpegurl' in content_type
+        or 'dash+xml' in content_type
+    )
+
+
+def _parse_total_size(response: aiohttp.ClientResponse) -> int:
+    """Size from Content-Range (ranged GET) or Content-Length (HEAD)"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total)
+    if response.status == 200:
+        length = response.headers.get('Content-Length', '')
+        if length.isdigit():
+            return int(length)
+    return 0
+
+
+async def probe_url(session: aiohttp.ClientSession, url: str) -> Dict:
+    """HEAD the URL, falling back to a 1-byte Range GET when HEAD is refused"""
+    cached = get_cached_probe(url)
+    if cached:
+        return cached
+    
+    result = {'url': url, 'status': 0, 'reachable': None, 'content_type': '', 'size': 0}
+    try:
+        async with session.head(url, headers=HEADERS, allow_redirects=True) as response:
+            status = response.status
+            if status < 400:
+                result.update(
+                    status=status,
+                    content_type=response.headers.get('Content-Type', ''),
+                    size=_parse_total_size(response),
+                    final_url=str(response.url)
+                )
+        
+        if not result['status']:
+            headers = dict(HEADERS, Range='bytes=0-0')
+            async with session.get(url, headers=headers, allow_redirects=True) as response:
+                result.update(
+                    status=response.status,
+                    content_type=response.headers.get('Content-Type', ''),
+                    size=_parse_total_size(response),
+                    final_url=str(response.url)
+                )
+        
+        if result['status'] in DEAD_STATUSES:
+            result['reachable'] = False
+        elif result['status'] < 400:
+            result['reachable'] = True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Transient network errors are not proof that the link is dead
+        logger.debug(f"Pre-flight failed for {url}: {e}")
+    
+    _probe_cache[url] = (time.monotonic(), result)
+    return result
+
+
+def _cache_get(cache: Dict[str, tuple], key: str):
+    entry = cache.get(key)
+    if entry and time.monotonic() - entry[0] < PREFLIGHT_CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def _prune_caches():
+    now = time.monotonic()
+    for cache in (_probe_cache, _variant_cache):
+        for key in [k for k, (ts, _) in cache.items() if now - ts >= PREFLIGHT_CACHE_TTL]:
+            del cache[key]
+
+
+def get_cached_variants(url: str) -> Optional[Dict]:
+    """Return cached HLS/DASH variant info for url, if any"""
+    return _cache_get(_variant_cache, url)
+
+
+async def _fetch_text(session: aiohttp.ClientSession, url: str) -> Tuple[str, str]:
+    """GET a manifest (size-capped), returns (text, final url after redirects)"""
+    async with session.get(url, headers=HEADERS) as response:
+        if response.status >= 400:
+            return '', url
+        data = await response.content.read(MANIFEST_MAX_BYTES)
+        return data.decode('utf-8', errors='replace'), str(response.url)
+
+
+def _parse_hls_master(text: str, base_url: str) -> Tuple[List[Tuple[int, int]], Optional[str]]:
+    """Variants (height, bandwidth) and the first media playlist URL"""
+    variants = []
+    first_uri = None
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        match = _HLS_STREAM_INF.match(line)
+        if not match:
+            continue
+        attrs = match.group(1)
+        bandwidth = _HLS_BANDWIDTH.search(attrs)
+        resolution = _HLS_RESOLUTION.search(attrs)
+        if bandwidth:
+            variants.append((int(resolution.group(1)) if resolution else 0, int(bandwidth.group(1))))
+        if first_uri is None:
+            uri = next((l.strip() for l in lines[i + 1:] if l.strip() and not l.startswith('#')), None)
+            first_uri = urljoin(base_url, uri) if uri else None
+    return variants, first_uri
+
+
+def _hls_duration(text: str) -> float:
+    return sum(float(x) for x in _HLS_EXTINF.findall(text))
+
+
+def _parse_dash(text: str) -> Dict:
+    """Duration and (height, bandwidth) variants from an MPD manifest"""
+    duration = 0.0
+    match = _DASH_DURATION.search(text)
+    if match:
+        days, hours, minutes, seconds = match.groups()
+        duration = (
+            int(days or 0) * 86400 + int(hours or 0) * 3600
+            + int(minutes or 0) * 60 + float(seconds or 0)
+        )
+    
+    videos, audio_bandwidth = [], 0
+    for rep in _DASH_REPRESENTATION.findall(text):
+        attrs = dict(_DASH_ATTR.findall(rep))
+        bandwidth = int(attrs.get('bandwidth', 0))
+        if 'height' in attrs:
+            videos.append((int(attrs['height']), bandwidth))
+        else:
+            audio_bandwidth = max(audio_bandwidth, bandwidth)
+    
+    # yt-dlp merges the best audio into whichever video is picked
+    variants = [(h, bw + audio_bandwidth) for h, bw in videos]
+    return {'duration': duration, 'variants': variants}
+
+
+async def probe_variants(session: aiohttp.ClientSession, url: str) -> Optional[Dict]:
+    """Read HLS/DASH manifests for variant bandwidths and total duration"""
+    cached = get_cached_variants(url)
+    if cached is not None:
+        return cached
+    
+    info = None
+    try:
+        text, final_url = await _fetch_text(session, url)
+        if '#EXTM3U' in text:
+            variants, media_url = _parse_hls_master(text, final_url)
+            if variants and media_url:
+                duration = _hls_duration((await _fetch_text(session, media_url))[0])
+            else:
+                duration = _hls_duration(text)
+            info = {'duration': duration, 'variants': variants}
+        elif '<MPD' in text:
+            info = _parse_dash(text)
+    except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError) as e:
+        logger.debug(f"Manifest probe failed for {url}: {e}")
+    
+    if info is not None:
+        _variant_cache[url] = (time.monotonic(), info)
+    return info
+
+
+def pick_variant(info: Optional[Dict], max_height: int) -> Optional[Tuple[int, int]]:
+    """The variant yt-dlp would pick for best[height<=max_height]/best"""
+    if not info or not info['variants']:
+        return None
+    fitting = [v for v in info['variants'] if v[0] <= max_height]
+    if fitting:
+        return max(fitting)
+    return min(info['variants'])
+
+
+def estimate_item_bytes(url: str, max_height: int) -> int:
+    """Expected download size from cached probes (0 = unknown)"""
+    info = get_cached_variants(url)
+    variant = pick_variant(info, max_height)
+    if variant and info['duration'] > 0:
+        return int(variant[1] / 8 * info['duration'])
+    
+    probe = get_cached_probe(url)
+    return probe['size'] if probe else 0
+
+
+def pick_auto_height(url: str, max_bytes: int, default: int) -> int:
+    """Highest variant height whose estimated size fits under max_bytes"""
+    info = get_cached_variants(url)
+    if not info or info['duration'] <= 0 or not info['variants']:
+        return default
+    
+    fitting = [
+        h for h, bw in info['variants']
+        if h and bw / 8 * info['duration'] <= max_bytes
+    ]
+    if fitting:
+        return max(fitting)
+    return min((h for h, _ in info['variants'] if h), default=default)
+
+
+async def preflight_items(items: Iterable) -> Dict[str, Dict]:
+    """
+    Probe all items concurrently (HEAD / Range GET) and return url -> probe.
+    YouTube links are skipped, results are cached for PREFLIGHT_CACHE_TTL.
+    """
+    _prune_caches()
+    
+    urls = list(dict.fromkeys(
+        item['url'] for item in items if not is_youtube_url(item['url'])
+    ))
+    if not urls:
+        return {}
+    
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=CONNECTION_POOL_SIZE,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=PREFLIGHT_TIMEOUT)
+    semaphore = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+    
+    async def bounded(session, url):
+        async with semaphore:
+            probe = await probe_url(session, url)
+            if probe['reachable'] and _is_manifest(url, probe['content_type']):
+                await probe_variants(session, url)
+            return probe
+    
+    start = time.monotonic()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        results = await asyncio.gather(*(bounded(session, url) for url in urls))
+    
+    dead = sum(1 for r in results if r['reachable'] is False)
+    logger.info(f"Pre-flight: {len(urls)} URLs in {time.monotonic() - start:.1f}s, {dead} dead")
+    return {r['url']: r for r in results}
+
+
+async def estimate_batch(items, heights: Iterable[int], max_bytes: int) -> Dict:
+    """
+    Estimate total download bytes per quality (and for auto quality) from
+    manifest bandwidth x duration or Content-Length. Large batches are
+    sampled evenly; the average of the items with a known size is
+    extrapolated to the whole batch.
+    """
+    total = len(items)
+    step = max(1, total // ESTIMATE_SAMPLE_SIZE)
+    sample = [items[i] for i in range(0, total, step)]
+    await preflight_items(sample)
+    
+    heights = list(heights)
+    totals = {h: 0 for h in heights}
+    auto_total = 0
+    known = 0
+    for item in sample:
+        sizes = {h: estimate_item_bytes(item['url'], h) for h in heights}
+        if not any(sizes.values()):
+            continue
+        known += 1
+        for h, size in sizes.items():
+            totals[h] += size
+        auto_height = pick_auto_height(item['url'], max_bytes, max(heights))
+        auto_total += estimate_item_bytes(item['url'], auto_height)
+    
+    # Unknown sizes are not zero: scale by the items actually measured
+    scale = total / known if known else 0
+    return {
+        'totals': {h: int(v * scale) for h, v in totals.items()},
+        'auto': int(auto_total * scale),
+        'known': known,
+        'sampled': len(sample),
+    }
@@ -0,0 +1,164 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple, Union
+import aiohttp
+from yt_dlp.utils import YoutubeDLError
+from config import (
+    RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX, CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_OPEN_SECONDS, FAILED_URL_TTL, FAILED_URL_CACHE_SIZE
+)
+from utils import get_host
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt; any other 4xx means the URL itself is bad
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524}
+
+# yt-dlp reports errors as text only
+_FATAL_MARKERS = (
+    'unsupported url', 'http error 400', 'http error 401', 'http error 403',
+    'http error 404', 'http error 410', 'http error 451', 'private video',
+    'video unavailable', 'not available', 'drm', 'requested format is not available',
+)
+
+
+def is_local_fault(error: Union[BaseException, int, str]) -> bool:
+    """Exception raised on our side (disk full, bad data, cancel), not by the host"""
+    return isinstance(error, BaseException) and not isinstance(error, (
+        asyncio.TimeoutError, aiohttp.ClientError, ConnectionError, TimeoutError, YoutubeDLError
+    ))
+
+
+def is_retryable(error: Union[BaseException, int, str]) -> bool:
+    """Sort an exception, HTTP status or yt-dlp message into retryable/fatal"""
+    if isinstance(error, int):
+        return error in RETRYABLE_STATUSES or error >= 500
+    if isinstance(error, aiohttp.ClientResponseError):
+        return is_retryable(error.status)
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError, TimeoutError)):
+        return True
+    if is_local_fault(error):
+        return False
+    text = str(error).lower()
+    return not any(marker in text for marker in _FATAL_MARKERS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter (attempt counts from 0)"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker: CIRCUIT_FAILURE_THRESHOLD consecutive failures open it
+    for CIRCUIT_OPEN_SECONDS, then a single trial request decides whether it
+    closes again. Shared by the asyncio side and yt-dlp worker threads.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._trial: Dict[str, bool] = {}
+        self.trips = 0
+    
+    def is_open(self, url: str) -> bool:
+        """Read-only check: host tripped and not yet due for a trial"""
+        host = get_host(url)
+        with self._lock:
+            until = self._open_until.get(host)
+            return until is not None and (time.monotonic() < until or bool(self._trial.get(host)))
+    
+    def allow(self, url: str) -> bool:
+        """False while the URL's host is tripped"""
+        host = get_host(url)
+        with self._lock:
+            until = self._open_until.get(host)
+            if until is None:
+                return True
+            if time.monotonic() < until or self._trial.get(host):
+                return False
+            # Half-open: let one request through
+            self._trial[host] = True
+            return True
+    
+    def record_success(self, url: str):
+        host = get_host(url)
+        with self._lock:
+            self._failures.pop(host, None)
+            self._trial.pop(host, None)
+            if self._open_until.pop(host, None) is not None:
+                logger.info(f"🟢 Circuit closed for {host}")
+    
+    def record_failure(self, url: str):
+        host = get_host(url)
+        with self._lock:
+            count = self._failures.get(host, 0) + 1
+            self._failures[host] = count
+            trial_failed = self._trial.pop(host, False)
+            if count >= CIRCUIT_FAILURE_THRESHOLD or trial_failed:
+                if host not in self._open_until or time.monotonic() >= self._open_until[host]:
+                    self.trips += 1
+                    logger.warning(f"🔴 Circuit open for {host} after {count} failures")
+                self._open_until[host] = time.monotonic() + CIRCUIT_OPEN_SECONDS
+    
+    def open_hosts(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for until in self._open_until.values() if until > now)
+
+
+class FailedUrlCache:
+    """Short negative cache: URLs that just failed are not fetched again"""
+    
+    def __init__(self, ttl: float = FAILED_URL_TTL, max_entries: int = FAILED_URL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, str]] = {}
+    
+    def add(self, url: str, reason: str):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {u: e for u, e in self._entries.items() if e[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[url] = (time.monotonic() + self.ttl, reason)
+    
+    def get(self, url: str) -> Optional[str]:
+        """Failure reason if the URL failed within the TTL"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[url]
+                return None
+            return entry[1]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def record_outcome(url: str, error: Optional[Union[BaseException, int, str]] = None):
+    """Feed one finished request into the breaker and the negative cache"""
+    if error is None:
+        circuit_breaker.record_success(url)
+        return
+    if is_local_fault(error):
+        return  # Says nothing about the host or the URL
+    reason = f"HTTP {error}" if isinstance(error, int) else (str(error)[:100] or type(error).__name__)
+    failed_urls.add(url, reason)
+    if is_retryable(error):
+        circuit_breaker.record_failure(url)
+    else:
+        # The host answered; only this URL is bad
+        circuit_breaker.record_success(url)
+
+
+circuit_breaker = CircuitBreaker()
+failed_urls = FailedUrlCache()
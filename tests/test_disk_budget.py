@@ -0,0 +1,91 @@
+import asyncio
+
+import disk_budget as disk_budget_module
+from disk_budget import DiskBudget, Reservation
+
+MB = 1024 * 1024
+
+
+def make_budget(tmp_path, monkeypatch, free: int, min_free: int = 100 * MB) -> DiskBudget:
+    budget = DiskBudget(tmp_path, min_free)
+    monkeypatch.setattr(budget, '_free', lambda: free)
+    # Waiters recheck quickly instead of every DISK_RECHECK_INTERVAL seconds
+    monkeypatch.setattr(disk_budget_module, 'DISK_RECHECK_INTERVAL', 0.01)
+    return budget
+
+
+def test_reserve_within_headroom(tmp_path, monkeypatch):
+    budget = make_budget(tmp_path, monkeypatch, free=1000 * MB)
+
+    async def run():
+        first = await budget.reserve(400 * MB)
+        second = await budget.reserve(400 * MB)
+        assert budget.reserved() == 800 * MB
+        assert budget.headroom() == 100 * MB
+        await budget.release(first)
+        await budget.release(second)
+        assert budget.active == []
+
+    asyncio.run(run())
+
+
+def test_reserve_waits_for_release(tmp_path, monkeypatch):
+    budget = make_budget(tmp_path, monkeypatch, free=1000 * MB)
+
+    async def run():
+        first = await budget.reserve(600 * MB)
+        notified = []
+
+        async def on_wait():
+            notified.append(True)
+
+        waiter = asyncio.create_task(budget.reserve(600 * MB, on_wait=on_wait))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        assert budget.waiting == 1
+        assert notified == [True]
+
+        await budget.release(first)
+        second = await asyncio.wait_for(waiter, 1)
+        assert budget.active == [second]
+        assert budget.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_oversized_job_runs_alone(tmp_path, monkeypatch):
+    budget = make_budget(tmp_path, monkeypatch, free=50 * MB)
+
+    async def run():
+        reservation = await asyncio.wait_for(budget.reserve(10_000 * MB), 1)
+        assert budget.active == [reservation]
+
+    asyncio.run(run())
+
+
+def test_release_is_idempotent(tmp_path, monkeypatch):
+    budget = make_budget(tmp_path, monkeypatch, free=1000 * MB)
+
+    async def run():
+        reservation = await budget.reserve(10 * MB)
+        await budget.release(reservation)
+        await budget.release(reservation)
+        assert budget.active == []
+
+    asyncio.run(run())
+
+
+def test_written_bytes_count_against_reservation(tmp_path):
+    workspace = tmp_path / "job"
+    (workspace / "chunks").mkdir(parents=True)
+    (workspace / "video.mp4").write_bytes(b'x' * 300)
+    (workspace / "chunks" / "part0.mp4").write_bytes(b'y' * 200)
+
+    reservation = Reservation(1000)
+    reservation.track(workspace)
+    reservation.track(tmp_path / "missing.bin")
+    assert reservation.written() == 500
+    assert reservation.outstanding() == 500
+
+    (workspace / "extra.bin").write_bytes(b'z' * 900)
+    assert reservation.outstanding() == 0
@@ -0,0 +1,97 @@
+import struct
+
+from video_processor import ensure_faststart
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def chunk_offsets(kind: bytes, offsets) -> bytes:
+    fmt = '>I' if kind == b'stco' else '>Q'
+    return box(kind, struct.pack('>II', 0, len(offsets)) + b''.join(struct.pack(fmt, o) for o in offsets))
+
+
+def moov_with(kind: bytes, offsets) -> bytes:
+    stbl = box(b'stbl', chunk_offsets(kind, offsets))
+    return box(b'moov', box(b'trak', box(b'mdia', box(b'minf', stbl))))
+
+
+def read_offsets(data: bytes, kind: bytes):
+    pos = data.index(kind) + 4
+    count = struct.unpack_from('>I', data, pos + 4)[0]
+    fmt, width = ('>I', 4) if kind == b'stco' else ('>Q', 8)
+    return [struct.unpack_from(fmt, data, pos + 8 + i * width)[0] for i in range(count)]
+
+
+def write_moov_at_end(path, kind: bytes, chunks):
+    """ftyp, mdat holding the chunks, then moov whose offsets point at them"""
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isommp41')
+    mdat_payload = b''.join(chunks)
+    offsets, pos = [], len(ftyp) + 8
+    for chunk in chunks:
+        offsets.append(pos)
+        pos += len(chunk)
+    path.write_bytes(ftyp + box(b'mdat', mdat_payload) + moov_with(kind, offsets))
+    return offsets
+
+
+def assert_relocated(path, kind: bytes, chunks, old_offsets):
+    data = path.read_bytes()
+    assert data.index(b'moov') < data.index(b'mdat')
+    new_offsets = read_offsets(data, kind)
+    moov_size = len(moov_with(kind, old_offsets))
+    assert new_offsets == [o + moov_size for o in old_offsets]
+    for offset, chunk in zip(new_offsets, chunks):
+        assert data[offset:offset + len(chunk)] == chunk
+
+
+def test_stco_offsets_follow_the_media(tmp_path):
+    path = tmp_path / "clip.mp4"
+    chunks = [b'A' * 100, b'B' * 37, b'C' * 5000]
+    offsets = write_moov_at_end(path, b'stco', chunks)
+    assert ensure_faststart(str(path))
+    assert_relocated(path, b'stco', chunks, offsets)
+
+
+def test_co64_offsets_follow_the_media(tmp_path):
+    path = tmp_path / "clip.mp4"
+    chunks = [bytes(range(256)) * 3, b'Z' * 10]
+    offsets = write_moov_at_end(path, b'co64', chunks)
+    assert ensure_faststart(str(path))
+    assert_relocated(path, b'co64', chunks, offsets)
+
+
+def test_shift_larger_than_copy_window(tmp_path, monkeypatch):
+    import video_processor
+    monkeypatch.setattr(video_processor, 'FASTSTART_COPY_CHUNK', 64)
+    path = tmp_path / "clip.mp4"
+    chunks = [bytes([i]) * 100 for i in range(10)]
+    offsets = write_moov_at_end(path, b'stco', chunks)
+    assert ensure_faststart(str(path))
+    assert_relocated(path, b'stco', chunks, offsets)
+
+
+def test_already_faststart_is_untouched(tmp_path):
+    path = tmp_path / "clip.mp4"
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00')
+    moov = moov_with(b'stco', [0])
+    original = ftyp + moov + box(b'mdat', b'payload')
+    path.write_bytes(original)
+    assert ensure_faststart(str(path))
+    assert path.read_bytes() == original
+
+
+def test_compressed_moov_leaves_file_alone(tmp_path):
+    path = tmp_path / "clip.mp4"
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00')
+    original = ftyp + box(b'mdat', b'payload') + box(b'moov', box(b'cmov', b'zlib'))
+    path.write_bytes(original)
+    assert not ensure_faststart(str(path))
+    assert path.read_bytes() == original
+
+
+def test_not_an_mp4(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b'\x1aE\xdf\xa3 not an mp4 at all')
+    assert not ensure_faststart(str(path))
@@ -0,0 +1,87 @@
+from utils import _parse_line, iter_items, get_file_type
+
+
+def test_title_and_url():
+    assert _parse_line("Intro: https://cdn.example.com/a/intro.mp4\n") == (
+        "Intro", "https://cdn.example.com/a/intro.mp4"
+    )
+
+
+def test_title_may_contain_colons():
+    assert _parse_line("Lecture 1: Setup:https://cdn.example.com/l1.m3u8") == (
+        "Lecture 1: Setup", "https://cdn.example.com/l1.m3u8"
+    )
+
+
+def test_url_after_separator_keeps_spaces():
+    assert _parse_line("Title: https://a.com/my file.mp4  \n") == (
+        "Title", "https://a.com/my file.mp4"
+    )
+
+
+def test_bare_url_stops_at_whitespace():
+    assert _parse_line("https://a.com/clip.mp4 trailing notes") == (
+        "clip", "https://a.com/clip.mp4"
+    )
+
+
+def test_prose_and_plain_lines_are_ignored():
+    assert _parse_line("see https://a.com/clip.mp4 for details") is None
+    assert _parse_line("no links here") is None
+    assert _parse_line("") is None
+
+
+def test_file_type_from_path_extension():
+    assert get_file_type("https://a.com/v/clip.MP4?token=1") == 'video'
+    assert get_file_type("https://a.com/p/photo.jpg#x") == 'image'
+    assert get_file_type("https://a.com/notes.pdf") == 'document'
+    assert get_file_type("https://www.youtube.com/watch?v=abc") == 'video'
+    # Extension-like text outside the last path segment does not count
+    assert get_file_type("https://a.com/get?file=video.mp4") == 'unknown'
+
+
+def test_iter_items_txt_dedupes_and_keeps_unknown(tmp_path):
+    batch = tmp_path / "batch.txt"
+    batch.write_text(
+        "One: https://a.com/one.mp4\n"
+        "Again: https://a.com/one.mp4\n"
+        "\n"
+        "Two: https://a.com/get?file=two.mp4\n"
+        "Three: https://a.com/three.png\n",
+        encoding='utf-8'
+    )
+    assert list(iter_items(str(batch))) == [
+        ("One", "https://a.com/one.mp4", 'video'),
+        ("Two", "https://a.com/get?file=two.mp4", 'unknown'),
+        ("Three", "https://a.com/three.png", 'image'),
+    ]
+
+
+def test_iter_items_html_links_and_sources(tmp_path):
+    page = tmp_path / "course.html"
+    page.write_text(
+        "<html><body>"
+        "<img src='https://a.com/logo.png'>"
+        "<iframe src='https://a.com/embed.html'></iframe>"
+        "<a href='https://a.com/one.mp4'>First   lesson</a>"
+        "<a href='/relative.mp4'>Skipped</a>"
+        "<p>Second lesson</p><video><source src='https://a.com/two.mp4'></video>"
+        "<pre>Notes: https://a.com/notes.pdf\n</pre>"
+        "</body></html>",
+        encoding='utf-8'
+    )
+    assert list(iter_items(str(page))) == [
+        ("First lesson", "https://a.com/one.mp4", 'video'),
+        ("Second lesson", "https://a.com/two.mp4", 'video'),
+        ("Notes", "https://a.com/notes.pdf", 'document'),
+    ]
+
+
+def test_iter_items_html_text_split_across_chunks(tmp_path, monkeypatch):
+    import utils
+    monkeypatch.setattr(utils, '_HTML_CHUNK', 7)
+    page = tmp_path / "dump.htm"
+    page.write_text("<div>Long title here: https://a.com/long/path/video.mp4</div>", encoding='utf-8')
+    assert list(iter_items(str(page))) == [
+        ("Long title here", "https://a.com/long/path/video.mp4", 'video'),
+    ]
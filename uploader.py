@@ -2,14 +2,27 @@ import os
 import asyncio
 import logging
 import time
-from typing import Optional, List
+from typing import Optional, List, Tuple, Union
 from pyrogram import Client
-from pyrogram.types import Message
-from utils import format_size, format_time, create_progress_bar, split_large_file
-from config import UPLOAD_CHUNK_SIZE, MAX_FILE_SIZE, UPLOAD_PROGRESS_INTERVAL
+from pyrogram.errors import BadRequest, FloodWait
+from pyrogram.types import Message, InputMediaPhoto, InputMediaDocument
+from utils import format_size, format_time, create_progress_bar, split_large_file, create_failed_links_file
+from config import (
+    UPLOAD_CHUNK_SIZE, MAX_FILE_SIZE, UPLOAD_PROGRESS_INTERVAL,
+    FAILED_DIGEST_INTERVAL, FAILED_DIGEST_MAX_CHARS, ALBUM_FLOODWAIT_RETRIES
+)
+from memory_pool import MemoryFile, Source, source_name, source_size
+from metrics import timed, record_transfer, record_floodwait
 
 logger = logging.getLogger(__name__)
 
+# Telegram error IDs that mean "this media/URL was refused", not "try later"
+_MEDIA_REFUSALS = ('MEDIA_', 'WEBPAGE_', 'PHOTO_', 'IMAGE_', 'EXTERNAL_URL_', 'FILE_', 'DOCUMENT_')
+
+
+def is_media_refusal(error: BaseException) -> bool:
+    return isinstance(error, BadRequest) and str(getattr(error, 'ID', '')).startswith(_MEDIA_REFUSALS)
+
 
 class UploadProgressTracker:
     """Enhanced upload progress tracker with better display"""
@@ -23,12 +36,17 @@ class UploadProgressTracker:
         self.start_time = time.time()
         self.last_percent = -1
         self.speeds = []
+        self.recorded = False
     
     async def progress_callback(self, current: int, total: int):
         """Callback for upload progress with enhanced display"""
         try:
             now = time.time()
             
+            if total > 0 and current >= total and not self.recorded:
+                self.recorded = True
+                record_transfer('upload', 'telegram', total, now - self.start_time)
+            
             # Update at intervals for performance
             if now - self.last_update < UPLOAD_PROGRESS_INTERVAL:
                 return
@@ -69,6 +87,7 @@ class UploadProgressTracker:
             logger.debug(f"Upload progress error: {e}")
 
 
+@timed('upload')
 async def upload_video(
     client: Client,
     chat_id: int,
@@ -79,8 +98,11 @@ async def upload_video(
     duration: int = 0,
     width: int = 1280,
     height: int = 720
-) -> bool:
-    """Upload video with progress tracking and auto-splitting for large files"""
+) -> Union[Message, bool]:
+    """
+    Upload video with progress tracking and auto-splitting for large files.
+    Returns the sent message (True for split uploads, False on failure).
+    """
     try:
         file_size_mb = os.path.getsize(video_path) / (1024 * 1024)
         
@@ -137,7 +159,7 @@ async def upload_video(
         # Normal upload for files under limit
         tracker = UploadProgressTracker(progress_msg, os.path.basename(video_path))
         
-        await client.send_video(
+        sent = await client.send_video(
             chat_id=chat_id,
             video=video_path,
             caption=caption,
@@ -150,49 +172,133 @@ async def upload_video(
         )
         
         logger.info(f"Video uploaded: {video_path}")
-        return True
+        return sent
         
     except Exception as e:
         logger.error(f"Video upload error: {e}")
         return False
 
 
+@timed('upload')
 async def upload_photo(
     client: Client,
     chat_id: int,
-    photo_path: str,
+    photo_path: Source,
     caption: str,
     progress_msg: Message
-) -> bool:
-    """Upload photo with progress tracking"""
+) -> Union[Message, bool]:
+    """Upload photo (file path or in-memory file) with progress, returns the sent message or False"""
     try:
-        tracker = UploadProgressTracker(progress_msg, os.path.basename(photo_path))
+        tracker = UploadProgressTracker(progress_msg, source_name(photo_path))
         
-        await client.send_photo(
+        sent = await client.send_photo(
             chat_id=chat_id,
             photo=photo_path,
             caption=caption,
             progress=tracker.progress_callback
         )
         
-        logger.info(f"Photo uploaded: {photo_path}")
-        return True
+        logger.info(f"Photo uploaded: {source_name(photo_path)}")
+        return sent
         
     except Exception as e:
         logger.error(f"Photo upload error: {e}")
         return False
 
 
+async def send_by_url(
+    client: Client,
+    chat_id: int,
+    url: str,
+    caption: str,
+    kind: str
+) -> Optional[Message]:
+    """
+    Let Telegram fetch the URL itself (no download/upload). None if it
+    refuses the URL or media; waits out one FloodWait, other errors are raised.
+    """
+    send = client.send_photo if kind == 'image' else client.send_document
+    media_arg = 'photo' if kind == 'image' else 'document'
+    for attempt in range(2):
+        try:
+            sent = await send(chat_id=chat_id, caption=caption, **{media_arg: url})
+            logger.info(f"🔗 Sent by URL: {url}")
+            return sent
+        except FloodWait as e:
+            # Falling back to download + upload would only add API calls
+            if attempt:
+                raise
+            logger.warning(f"URL pass-through flood wait {e.value}s")
+            record_floodwait('upload', e.value)
+            await asyncio.sleep(e.value)
+        except BadRequest as e:
+            if not is_media_refusal(e):
+                raise
+            logger.info(f"URL pass-through refused, downloading instead: {e}")
+            return None
+
+
+@timed('upload')
+async def upload_media_group(
+    client: Client,
+    chat_id: int,
+    kind: str,
+    entries: List[Tuple[Source, str]]
+) -> Optional[List[Message]]:
+    """
+    Send up to 10 images or documents (source, caption) as one album.
+    None if Telegram refuses the media; sits out up to
+    ALBUM_FLOODWAIT_RETRIES flood waits and retries the whole group,
+    other errors are raised.
+    """
+    media_type = InputMediaPhoto if kind == 'image' else InputMediaDocument
+    # Only local members are uploaded by us; URL members are fetched by Telegram
+    local_bytes = sum(
+        source_size(source) for source, _ in entries
+        if isinstance(source, MemoryFile) or os.path.isfile(source)
+    )
+    for attempt in range(ALBUM_FLOODWAIT_RETRIES + 1):
+        for source, _ in entries:
+            if isinstance(source, MemoryFile):
+                source.seek(0)
+        start_time = time.time()
+        try:
+            sent = await client.send_media_group(
+                chat_id=chat_id,
+                media=[media_type(source, caption=caption) for source, caption in entries]
+            )
+            break
+        except FloodWait as e:
+            if attempt == ALBUM_FLOODWAIT_RETRIES:
+                raise
+            logger.warning(f"Album flood wait {e.value}s")
+            record_floodwait('album', e.value)
+            await asyncio.sleep(e.value)
+        except BadRequest as e:
+            if not is_media_refusal(e):
+                raise
+            logger.warning(f"Album upload refused: {e}")
+            return None
+    
+    record_transfer('upload', 'telegram', local_bytes, time.time() - start_time)
+    logger.info(f"📚 Album of {len(entries)} {kind}s uploaded")
+    return sent
+
+
+@timed('upload')
 async def upload_document(
     client: Client,
     chat_id: int,
-    document_path: str,
+    document_path: Source,
     caption: str,
     progress_msg: Message
-) -> bool:
-    """Upload document with progress tracking and auto-splitting"""
+) -> Union[Message, bool]:
+    """
+    Upload document with progress tracking and auto-splitting.
+    Returns the sent message (True for split uploads, False on failure).
+    """
     try:
-        file_size_mb = os.path.getsize(document_path) / (1024 * 1024)
+        file_size_mb = source_size(document_path) / (1024 * 1024)
         
         # Check if file needs splitting
         if file_size_mb > MAX_FILE_SIZE:
@@ -240,17 +346,17 @@ async def upload_document(
             return True
         
         # Normal upload for files under limit
-        tracker = UploadProgressTracker(progress_msg, os.path.basename(document_path))
+        tracker = UploadProgressTracker(progress_msg, source_name(document_path))
         
-        await client.send_document(
+        sent = await client.send_document(
             chat_id=chat_id,
             document=document_path,
             caption=caption,
             progress=tracker.progress_callback
         )
         
-        logger.info(f"Document uploaded: {document_path}")
-        return True
+        logger.info(f"Document uploaded: {source_name(document_path)}")
+        return sent
         
     except Exception as e:
         logger.error(f"Document upload error: {e}")
@@ -287,3 +393,79 @@ async def send_failed_link(
     except Exception as e:
         logger.error(f"Failed to send link info: {e}")
         return False
+
+
+class FailedLinkDigest:
+    """
+    Collects a batch's failed and skipped links and reports them together:
+    periodically and at the end of the batch, as one message or as a TXT
+    file when the list is long. immediate=True keeps per-item messages.
+    """
+    
+    def __init__(self, client: Client, chat_id: int, immediate: bool = False):
+        self.client = client
+        self.chat_id = chat_id
+        self.immediate = immediate
+        self.entries: List[Tuple[int, str, str, str]] = []
+        self.reported = 0
+        self.last_flush = time.time()
+    
+    async def add(self, title: str, url: str, serial_num: int, reason: str = "Download failed"):
+        if self.immediate:
+            await send_failed_link(self.client, self.chat_id, title, url, serial_num, reason)
+            return
+        self.entries.append((serial_num, title, url, reason))
+        if time.time() - self.last_flush >= FAILED_DIGEST_INTERVAL:
+            await self.flush()
+    
+    async def flush(self, final: bool = False):
+        """
+        Send everything collected so far as one message or one file. On
+        failure the links are kept for the next flush; the final flush falls
+        back to one message per link.
+        """
+        self.last_flush = time.time()
+        if not self.entries:
+            return
+        entries = list(self.entries)
+        
+        if await self._send(entries):
+            self.reported += len(entries)
+        elif final:
+            for serial_num, title, url, reason in entries:
+                if await send_failed_link(self.client, self.chat_id, title, url, serial_num, reason):
+                    self.reported += 1
+        else:
+            return
+        self.entries = self.entries[len(entries):]
+    
+    async def _send(self, entries: List[Tuple[int, str, str, str]]) -> bool:
+        lines = [f"⚠️ **{len(entries)} link(s) not downloaded**\n"]
+        for serial_num, title, url, reason in entries:
+            lines.append(f"#{serial_num} {title[:40]} — {reason}\n{url}")
+        text = "\n".join(lines)
+        
+        try:
+            if len(text) <= FAILED_DIGEST_MAX_CHARS:
+                await self.client.send_message(
+                    chat_id=self.chat_id, text=text, disable_web_page_preview=True
+                )
+            else:
+                path = await create_failed_links_file(
+                    entries, f"failed_links_{self.chat_id}_{int(time.time())}.txt"
+                )
+                if not path:
+                    return False
+                try:
+                    await self.client.send_document(
+                        chat_id=self.chat_id,
+                        document=path,
+                        caption=f"⚠️ **{len(entries)} link(s) not downloaded**\n💡 Open them manually from this file."
+                    )
+                finally:
+                    os.remove(path)
+            logger.info(f"Failed-link digest sent: {len(entries)} link(s)")
+            return True
+        except Exception as e:
+            logger.error(f"Failed-link digest error: {e}")
+            return False
@@ -2,50 +2,179 @@ import re
 import os
 import asyncio
 import logging
-from typing import List, Dict
+from html.parser import HTMLParser
+from typing import List, Iterator, Optional, Tuple
 from pathlib import Path
+from urllib.parse import urlsplit, unquote
 from config import SUPPORTED_TYPES, SPLIT_FILE_SIZE
+from item_store import ItemStore
 
 logger = logging.getLogger(__name__)
 
 
+_EXTENSION_TYPES = {
+    ext.lstrip('.'): ftype
+    for ftype, extensions in SUPPORTED_TYPES.items()
+    for ext in extensions
+}
+# One pass over the URL: group 1 = host, group 2 = path extension (if supported)
+_URL_RE = re.compile(
+    r'^[a-z][a-z0-9+.-]*://(?:[^/?#@]*@)?([^/?#:]*)'
+    r'(?:[^?#]*\.(' + '|'.join(sorted(map(re.escape, _EXTENSION_TYPES), key=len, reverse=True)) + r')/?|[^?#]*)'
+    r'(?:[?#]|$)',
+    re.IGNORECASE
+)
+_YOUTUBE_HOST_RE = re.compile(r'(?:^|\.)(?:youtube\.com|youtu\.be)$', re.IGNORECASE)
+
+
 def get_file_type(url: str) -> str:
-    """Determine file type from URL with enhanced detection"""
-    url_lower = url.lower()
+    """Determine file type from the URL path extension with one compiled regex"""
+    match = _URL_RE.match(url)
+    if not match:
+        return 'unknown'
+    host, ext = match.groups()
     
     # Check for YouTube links
-    if 'youtube.com' in url_lower or 'youtu.be' in url_lower:
+    if _YOUTUBE_HOST_RE.search(host):
         return 'video'
     
-    for ftype, extensions in SUPPORTED_TYPES.items():
-        if any(ext in url_lower for ext in extensions):
-            return ftype
+    if ext:
+        return _EXTENSION_TYPES[ext.lower()]
     
     return 'unknown'
 
 
-def parse_content(text: str) -> List[Dict]:
-    """Parse content and identify all supported file types"""
-    lines = text.strip().split('\n')
-    items = []
+def get_host(url: str) -> str:
+    """Lower-cased host part of a URL ('' when it has none)"""
+    match = _URL_RE.match(url)
+    return match.group(1).lower() if match else ''
+
+
+_LINE_URL = re.compile(r'https?://\S+')  # Bare URLs: stop at whitespace
+_HTML_CHUNK = 65536
+
+
+def _title_from_url(url: str) -> str:
+    """Fallback title: last path segment without extension"""
+    name = os.path.basename(urlsplit(url).path)
+    return unquote(os.path.splitext(name)[0]) or "Untitled"
+
+
+def _parse_line(line: str) -> Optional[Tuple[str, str]]:
+    """Parse one `title:url` (or bare url) TXT line; the title may contain colons"""
+    if 'http' not in line:
+        return None
+    match = _LINE_URL.search(line)
+    if not match:
+        return None
+    title = line[:match.start()].strip()
+    if not title:
+        url = match.group(0)
+    elif title.endswith(':'):
+        # Everything after the separator is the URL, spaces included
+        title = title[:-1].strip()
+        url = line[match.start():].strip()
+    else:
+        return None
+    return title or _title_from_url(url), url
+
+
+class _LinkExtractor(HTMLParser):
+    """Incremental HTML link extractor: <a href>, <source src>, <video src>"""
     
-    for line in lines:
-        if ':' in line and ('http://' in line or 'https://' in line):
-            parts = line.split(':', 1)
-            if len(parts) == 2:
-                title = parts[0].strip()
-                url = parts[1].strip()
-                
-                file_type = get_file_type(url)
-                
-                if file_type != 'unknown':
-                    items.append({
-                        'title': title, 
-                        'url': url, 
-                        'type': file_type
-                    })
+    MEDIA_TAGS = {'source', 'video'}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found: List[Tuple[str, str]] = []
+        self._href = None
+        self._href_title = ''
+        self._text = []
+        self._last_text = ''
+        self._pending: List[str] = []  # Text between tags, may span feed() chunks
+    
+    def _flush_text(self):
+        """Plain `title:url` lines pasted into the HTML body"""
+        if not self._pending:
+            return
+        data = ''.join(self._pending)
+        self._pending.clear()
+        for line in data.splitlines():
+            parsed = _parse_line(line)
+            if parsed:
+                self.found.append(parsed)
+            elif line.strip():
+                self._last_text = line.strip()[:200]
+    
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        attrs = dict(attrs)
+        if tag == 'a' and attrs.get('href', '').startswith(('http://', 'https://')):
+            self._href = attrs['href'].strip()
+            self._href_title = attrs.get('title') or ''
+            self._text = []
+        elif tag in self.MEDIA_TAGS:
+            src = (attrs.get('src') or '').strip()
+            if src.startswith(('http://', 'https://')):
+                title = attrs.get('title') or self._last_text
+                self.found.append((title or _title_from_url(src), src))
+    
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if tag == 'a' and self._href:
+            title = ' '.join(''.join(self._text).split()) or self._href_title
+            self.found.append((title or _title_from_url(self._href), self._href))
+            self._href = None
+    
+    def handle_data(self, data):
+        if self._href:
+            self._text.append(data)
+        else:
+            self._pending.append(data)
     
-    return items
+    def close(self):
+        super().close()
+        self._flush_text()
+
+
+def _iter_raw_links(file_path: str) -> Iterator[Tuple[str, str]]:
+    """Stream (title, url) pairs from a TXT or HTML file without loading it whole"""
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        if file_path.lower().endswith(('.html', '.htm')):
+            parser = _LinkExtractor()
+            while True:
+                chunk = f.read(_HTML_CHUNK)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                yield from parser.found
+                parser.found.clear()
+            parser.close()
+            yield from parser.found
+        else:
+            for line in f:
+                parsed = _parse_line(line)
+                if parsed:
+                    yield parsed
+
+
+def iter_items(file_path: str) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yield de-duplicated (title, url, type) records from an uploaded batch file.
+    Links without a known extension are kept as 'unknown' for the pre-flight
+    probe to classify by Content-Type.
+    """
+    seen = set()
+    for title, url in _iter_raw_links(file_path):
+        if url in seen:
+            continue
+        seen.add(url)
+        yield title, url, get_file_type(url)
+
+
+def parse_file(file_path: str) -> ItemStore:
+    """Parse an uploaded TXT/HTML file into a compact item store"""
+    return ItemStore(iter_items(file_path))
 
 
 def format_size(bytes_size: int) -> str:
@@ -143,6 +272,7 @@ def is_youtube_url(url: str) -> bool:
         r'youtu\.be/',
         r'youtube\.com/embed/',
         r'youtube\.com/v/',
+        r'youtube\.com/shorts/',
     ]
     
     return any(re.search(pattern, url, re.IGNORECASE) for pattern in youtube_patterns)
@@ -164,36 +294,43 @@ def extract_video_id(url: str) -> str:
     return ""
 
 
-async def create_failed_link_file(title: str, url: str, serial_num: int, reason: str = "Download failed") -> str:
-    """Create a text file with failed link information"""
-    try:
-        from config import DOWNLOAD_DIR
-        
-        safe_title = sanitize_filename(title)
-        file_name = f"failed_link_{serial_num}_{safe_title}.txt"
-        file_path = DOWNLOAD_DIR / file_name
-        
-        content = f"""
-═══════════════════════════════════════
-   DOWNLOAD FAILED - LINK INFORMATION
-═══════════════════════════════════════
+_FAILED_LINK_RULE = "═══════════════════════════════════════"
+
 
-Item Number: #{serial_num}
+def _failed_link_block(serial_num: int, title: str, reason: str, url: str) -> str:
+    return f"""Item Number: #{serial_num}
 Title: {title}
 
 Reason: {reason}
 
 Original Link:
-{url}
+{url}"""
 
-═══════════════════════════════════════
-You can copy and open this link manually
-to access the content.
-═══════════════════════════════════════
-"""
+
+async def create_failed_links_file(entries: List[Tuple[int, str, str, str]], file_name: str) -> str:
+    """Create one text file listing many failed links: (serial, title, url, reason)"""
+    try:
+        from config import DOWNLOAD_DIR
+        
+        file_path = DOWNLOAD_DIR / file_name
+        single = len(entries) == 1
+        title = "DOWNLOAD FAILED - LINK INFORMATION" if single else f"{len(entries)} LINKS NOT DOWNLOADED"
+        
+        blocks = [
+            _failed_link_block(serial_num, item_title, reason, url)
+            for serial_num, item_title, url, reason in entries
+        ]
+        content = (
+            f"{_FAILED_LINK_RULE}\n   {title}\n{_FAILED_LINK_RULE}\n\n"
+            + f"\n\n{'-' * len(_FAILED_LINK_RULE)}\n\n".join(blocks)
+            + f"\n\n{_FAILED_LINK_RULE}\n"
+            f"You can copy and open {'this link' if single else 'these links'} manually\n"
+            f"to access the content.\n"
+            f"{_FAILED_LINK_RULE}"
+        )
         
         with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content.strip())
+            f.write(content)
         
         return str(file_path)
         
@@ -1,24 +1,307 @@
 import os
 import json
+import mmap
+import shutil
+import struct
+import time
+import tempfile
+import asyncio
+import threading
 import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
-from config import THUMBNAIL_TIME, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+from urllib.parse import urlsplit
+from typing import Dict, List, Optional
+from config import (
+    THUMBNAIL_SIZE, THUMBNAIL_QUALITY, THUMBNAIL_SCAN_FRAMES,
+    THUMBNAIL_TIMEOUT, THUMBNAIL_WORKERS, PREFETCH_EXTENSIONS,
+    REMOTE_PROBE_TIMEOUT, PREFETCH_CANCEL_WAIT, FASTSTART_COPY_CHUNK, FIT_SIZE_MARGIN,
+    FIT_AUDIO_BITRATE, FIT_MIN_VIDEO_BITRATE, FIT_MIN_CHUNK_SECONDS,
+    FIT_X264_PRESET, FIT_STEP_TIMEOUT, REMUX_TIMEOUT
+)
+from metrics import timed, CountingExecutor
 
 logger = logging.getLogger(__name__)
 
+# Bounded pool so concurrent items never fork more ffmpeg processes than cores
+_thumbnail_executor = CountingExecutor(
+    max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumb"
+)
 
-def get_video_info(filepath: str) -> Dict:
+REMOTE_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0'
+
+
+def _input_args(source: str) -> List[str]:
+    """Extra ffmpeg/ffprobe input options for remote sources"""
+    if source.startswith(('http://', 'https://')):
+        return [
+            '-rw_timeout', str(REMOTE_PROBE_TIMEOUT * 1_000_000),
+            '-user_agent', REMOTE_USER_AGENT,
+        ]
+    return []
+
+
+class ToolCancelled(Exception):
+    """ffmpeg/ffprobe run killed because its caller gave up on it"""
+
+
+def _run_tool(cmd: List[str], timeout: float, cancel: Optional[threading.Event] = None, text: bool = False):
+    """subprocess.run that also kills the tool as soon as `cancel` is set"""
+    if cancel is None:
+        return subprocess.run(cmd, capture_output=True, text=text, timeout=timeout)
+    if cancel.is_set():
+        raise ToolCancelled(cmd[0])
+    
+    deadline = time.monotonic() + timeout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text) as proc:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=0.2)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                if cancel.is_set() or time.monotonic() > deadline:
+                    proc.kill()
+                    proc.communicate()
+                    if cancel.is_set():
+                        raise ToolCancelled(cmd[0])
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+
+
+# ─── In-process container header parsing (MP4 / MKV / WebM) ───
+
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+_EBML_HEADER = 0x1A45DFA3
+_EBML_DOCTYPE = 0x4282
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_DURATION = 0x4489
+_MKV_TRACKS = 0x1654AE6B
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE = 0x83
+_MKV_CODEC_ID = 0x86
+_MKV_VIDEO = 0xE0
+_MKV_PIXEL_WIDTH = 0xB0
+_MKV_PIXEL_HEIGHT = 0xBA
+_MKV_CLUSTER = 0x1F43B675
+
+
+def _mp4_boxes(buf, start: int, end: int):
+    """Yield (type, box_start, payload_start, box_end) for each box in buf[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos, pos + header, pos + size
+        pos += size
+
+
+def _parse_mp4(buf) -> Optional[Dict]:
+    """Read duration, video dimensions, codec and atom order from MP4 boxes"""
+    moov = mdat = None
+    for box_type, _, payload, box_end in _mp4_boxes(buf, 0, len(buf)):
+        if box_type == b'moov' and moov is None:
+            moov = (payload, box_end)
+        elif box_type == b'mdat' and mdat is None:
+            mdat = payload
+    if moov is None:
+        return None
+    
+    info = {'duration': 0.0, 'width': 0, 'height': 0, 'codec': None}
+    
+    def walk(start: int, end: int, track: Dict):
+        for box_type, _, payload, box_end in _mp4_boxes(buf, start, end):
+            if box_type == b'mvhd':
+                version = buf[payload]
+                if version == 1:
+                    timescale, duration = struct.unpack_from('>IQ', buf, payload + 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', buf, payload + 12)
+                if timescale:
+                    info['duration'] = duration / timescale
+            elif box_type == b'tkhd':
+                offset = 88 if buf[payload] == 1 else 76
+                w, h = struct.unpack_from('>II', buf, payload + offset)
+                track['width'], track['height'] = w >> 16, h >> 16
+            elif box_type == b'hdlr':
+                track['handler'] = bytes(buf[payload + 8:payload + 12])
+            elif box_type == b'stsd' and box_end - payload >= 16:
+                track['codec'] = bytes(buf[payload + 12:payload + 16]).decode('latin-1')
+            elif box_type == b'trak':
+                sub = {}
+                walk(payload, box_end, sub)
+                if sub.get('handler') == b'vide' and not info['codec']:
+                    info['width'] = sub.get('width', 0)
+                    info['height'] = sub.get('height', 0)
+                    info['codec'] = sub.get('codec')
+            elif box_type in _MP4_CONTAINERS:
+                walk(payload, box_end, track)
+    
+    walk(moov[0], moov[1], info)
+    info['faststart'] = mdat is None or moov[0] < mdat
+    info['container'] = 'mp4'
+    return info
+
+
+def _ebml_vint(buf, pos: int, keep_marker: bool):
+    """Decode an EBML variable-length integer, returns (value, length)"""
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML vint")
+    value = first if keep_marker else first & (mask - 1)
+    for b in buf[pos + 1:pos + length]:
+        value = (value << 8) | b
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1  # Unknown size
+    return value, length
+
+
+def _ebml_elements(buf, start: int, end: int):
+    """Yield (id, data_start, data_end) for each EBML element in buf[start:end]"""
+    pos = start
+    while pos < end:
+        el_id, id_len = _ebml_vint(buf, pos, True)
+        size, size_len = _ebml_vint(buf, pos + id_len, False)
+        data = pos + id_len + size_len
+        data_end = end if size < 0 else min(data + size, end)
+        yield el_id, data, data_end
+        if size < 0 and el_id != _MKV_SEGMENT:
+            return
+        pos = data_end
+
+
+def _ebml_uint(buf, start: int, end: int) -> int:
+    return int.from_bytes(buf[start:end], 'big')
+
+
+def _parse_mkv(buf) -> Optional[Dict]:
+    """Read duration, video dimensions and codec from Matroska/WebM headers"""
+    info = {'duration': 0.0, 'width': 0, 'height': 0, 'codec': None, 'faststart': None}
+    segment = None
+    for el_id, data, data_end in _ebml_elements(buf, 0, len(buf)):
+        if el_id == _EBML_HEADER:
+            for sub_id, s, e in _ebml_elements(buf, data, data_end):
+                if sub_id == _EBML_DOCTYPE:
+                    info['container'] = bytes(buf[s:e]).decode('ascii', 'ignore').strip('\x00')
+        elif el_id == _MKV_SEGMENT:
+            segment = (data, data_end)
+            break
+    if segment is None or 'container' not in info:
+        return None
+    
+    scale = 1000000
+    raw_duration = 0.0
+    for el_id, data, data_end in _ebml_elements(buf, *segment):
+        if el_id == _MKV_CLUSTER:
+            break
+        if el_id == _MKV_INFO:
+            for sub_id, s, e in _ebml_elements(buf, data, data_end):
+                if sub_id == _MKV_TIMECODE_SCALE:
+                    scale = _ebml_uint(buf, s, e)
+                elif sub_id == _MKV_DURATION:
+                    raw_duration = struct.unpack('>f' if e - s == 4 else '>d', buf[s:e])[0]
+        elif el_id == _MKV_TRACKS:
+            for entry_id, s, e in _ebml_elements(buf, data, data_end):
+                if entry_id != _MKV_TRACK_ENTRY:
+                    continue
+                track = {}
+                for sub_id, ts, te in _ebml_elements(buf, s, e):
+                    if sub_id == _MKV_TRACK_TYPE:
+                        track['type'] = _ebml_uint(buf, ts, te)
+                    elif sub_id == _MKV_CODEC_ID:
+                        track['codec'] = bytes(buf[ts:te]).decode('ascii', 'ignore').strip('\x00')
+                    elif sub_id == _MKV_VIDEO:
+                        for vid_id, vs, ve in _ebml_elements(buf, ts, te):
+                            if vid_id == _MKV_PIXEL_WIDTH:
+                                track['width'] = _ebml_uint(buf, vs, ve)
+                            elif vid_id == _MKV_PIXEL_HEIGHT:
+                                track['height'] = _ebml_uint(buf, vs, ve)
+                if track.get('type') == 1 and not info['codec']:
+                    info['width'] = track.get('width', 0)
+                    info['height'] = track.get('height', 0)
+                    info['codec'] = track.get('codec')
+    
+    info['duration'] = raw_duration * scale / 1e9
+    return info
+
+
+def probe_header(filepath: str) -> Optional[Dict]:
+    """
+    Parse MP4/MKV/WebM headers in-process via mmap (no ffprobe fork).
+    Returns duration, width, height, codec, faststart and container,
+    or None when the file is unusual and ffprobe should be used instead.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                magic = buf[:4]
+                if magic == b'\x1a\x45\xdf\xa3':
+                    info = _parse_mkv(buf)
+                elif buf[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+                    info = _parse_mp4(buf)
+                else:
+                    return None
+        
+        if not info or info['duration'] <= 0 or not info['codec'] or info['width'] <= 0:
+            return None
+        return info
+        
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        logger.debug(f"Header parse fallback for {filepath}: {e}")
+        return None
+
+
+def _video_info_from_header(filepath: str) -> Optional[Dict]:
+    """get_video_info result built from probe_header, if the header is parseable"""
+    if filepath.startswith(('http://', 'https://')):
+        return None
+    
+    header = probe_header(filepath)
+    if not header:
+        return None
+    
+    width = header['width'] - (header['width'] % 2)
+    height = header['height'] - (header['height'] % 2)
+    duration = int(header['duration'])
+    logger.info(f"Video info (header): {width}x{height}, {duration}s, {header['codec']}")
+    return {
+        'duration': duration, 'width': width, 'height': height,
+        'codec': header['codec'], 'faststart': header['faststart']
+    }
+
+
+@timed('probe')
+def get_video_info(filepath: str, cancel: Optional[threading.Event] = None) -> Dict:
     """Get video duration and dimensions with enhanced error handling"""
+    info = _video_info_from_header(filepath)
+    if info:
+        return info
+    
     try:
         cmd = [
             'ffprobe', '-v', 'quiet',
             '-print_format', 'json',
             '-show_format', '-show_streams',
+            *_input_args(filepath),
             filepath
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = _run_tool(cmd, 30, cancel, text=True)
         
         if result.returncode != 0:
             logger.error(f"FFprobe failed: {result.stderr}")
@@ -58,6 +341,8 @@ def get_video_info(filepath: str) -> Dict:
     except subprocess.TimeoutExpired:
         logger.error("FFprobe timeout")
         return {'duration': 0, 'width': 1280, 'height': 720}
+    except ToolCancelled:
+        return {'duration': 0, 'width': 1280, 'height': 720}
     except json.JSONDecodeError as e:
         logger.error(f"FFprobe JSON error: {e}")
         return {'duration': 0, 'width': 1280, 'height': 720}
@@ -66,112 +351,344 @@ def get_video_info(filepath: str) -> Dict:
         return {'duration': 0, 'width': 1280, 'height': 720}
 
 
-def generate_thumbnail(video_path: str, thumb_path: str, video_duration: int = 0) -> bool:
+def _thumbnail_seek(video_duration: int) -> float:
+    """Pick the seek offset for the thumbnail scan window"""
+    if video_duration > 10:
+        return float(min(video_duration // 4, 15))  # 1/4 into video or 15s max
+    if video_duration > 5:
+        return 3.0
+    return 0.0
+
+
+def generate_thumbnail(
+    video_path: str, thumb_path: str, video_duration: int = 0, cancel: Optional[threading.Event] = None
+) -> bool:
     """
-    Generate high-quality thumbnail from video with MULTIPLE fallback methods
-    NEVER returns blank thumbnails!
+    Generate thumbnail in ONE ffmpeg run: input-seek to the nearest keyframe,
+    decode a short window and let the `thumbnail` filter pick the most
+    representative (non-blank) frame. If that yields nothing (a failed
+    seek, a short or oddly indexed file) it is retried once from the start.
     """
     try:
-        # Determine best time for thumbnail
-        if video_duration > 10:
-            thumb_time = min(video_duration // 4, 15)  # 1/4 into video or 15s max
-        elif video_duration > 5:
-            thumb_time = 3
-        else:
-            thumb_time = 1
-        
-        # Method 1: Primary extraction at calculated time
-        thumb_time_str = f"00:00:{thumb_time:02d}"
-        
-        cmd = [
-            'ffmpeg', '-ss', thumb_time_str,
-            '-i', video_path,
-            '-vframes', '1',
-            '-vf', f'scale={THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease',
-            '-q:v', str(THUMBNAIL_QUALITY),
-            thumb_path,
-            '-y'
-        ]
-        
-        logger.info(f"Thumbnail Method 1: Extracting at {thumb_time_str}")
-        result = subprocess.run(cmd, capture_output=True, timeout=60)
-        
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-            logger.info(f"✅ Thumbnail Method 1 success: {os.path.getsize(thumb_path)} bytes")
-            return True
-        
-        # Method 2: Try at 0 seconds
-        logger.warning("Method 1 failed, trying Method 2 (0 seconds)")
-        cmd[1] = '00:00:00'
-        result = subprocess.run(cmd, capture_output=True, timeout=60)
-        
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-            logger.info("✅ Thumbnail Method 2 success")
-            return True
-        
-        # Method 3: Middle of video
-        if video_duration > 5:
-            mid_time = video_duration // 2
-            mid_str = f"00:00:{mid_time:02d}"
-            logger.warning(f"Method 2 failed, trying Method 3 (middle: {mid_str})")
-            cmd[1] = mid_str
-            result = subprocess.run(cmd, capture_output=True, timeout=60)
+        seek = _thumbnail_seek(video_duration)
+        
+        for offset in dict.fromkeys((seek, 0.0)):
+            cmd = [
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-ss', f"{offset:.3f}",
+                *_input_args(video_path),
+                '-i', video_path,
+                '-an', '-sn', '-dn',
+                '-vf', (
+                    f'thumbnail={THUMBNAIL_SCAN_FRAMES},'
+                    f'scale={THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease'
+                ),
+                '-frames:v', '1',
+                '-q:v', str(THUMBNAIL_QUALITY),
+                '-y', thumb_path
+            ]
+            
+            logger.info(f"Thumbnail: scanning {THUMBNAIL_SCAN_FRAMES} frames from {offset:.1f}s")
+            _run_tool(cmd, THUMBNAIL_TIMEOUT, cancel)
             
             if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-                logger.info("✅ Thumbnail Method 3 success")
+                logger.info(f"✅ Thumbnail ready: {os.path.getsize(thumb_path)} bytes")
                 return True
         
-        # Method 4: Simple extraction without seeking (most reliable)
-        logger.warning("Method 3 failed, trying Method 4 (simple extraction)")
-        simple_cmd = [
-            'ffmpeg', '-i', video_path,
-            '-vframes', '1',
-            '-vf', f'scale={THUMBNAIL_SIZE}',
-            '-q:v', '2',
-            thumb_path,
-            '-y'
-        ]
-        result = subprocess.run(simple_cmd, capture_output=True, timeout=60)
+        logger.error("❌ Thumbnail generation failed")
+        return False
         
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-            logger.info("✅ Thumbnail Method 4 success")
-            return True
+    except subprocess.TimeoutExpired:
+        logger.error("Thumbnail generation timeout")
+        return False
+    except ToolCancelled:
+        return False
+    except Exception as e:
+        logger.error(f"Thumbnail error: {e}")
+        return False
+
+
+@timed('thumbnail')
+async def extract_thumbnail(
+    video_path: str, thumb_path: str, video_duration: int = 0, cancel: Optional[threading.Event] = None
+) -> bool:
+    """Run generate_thumbnail on the bounded thumbnail pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _thumbnail_executor,
+        generate_thumbnail,
+        video_path, thumb_path, video_duration, cancel
+    )
+
+
+def can_prefetch(url: str) -> bool:
+    """Check if ffmpeg can read the URL directly (direct media, HLS, DASH)"""
+    path = urlsplit(url).path.lower()
+    return url.startswith(('http://', 'https://')) and path.endswith(PREFETCH_EXTENSIONS)
+
+
+async def prefetch_media_meta(url: str, thumb_path: str) -> Dict:
+    """
+    Probe metadata and grab a thumbnail straight from the remote URL
+    while the download is still running (moov atom / first segments).
+    """
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+    
+    async def in_thread(job: asyncio.Future):
+        # Cancelling the task does not stop the thread: kill its tool and wait for it
+        try:
+            return await asyncio.shield(job)
+        except asyncio.CancelledError:
+            cancel.set()
+            await asyncio.wait([job], timeout=PREFETCH_CANCEL_WAIT)
+            raise
+    
+    info = await in_thread(loop.run_in_executor(None, get_video_info, url, cancel))
+    if info['duration'] <= 0:
+        return {}
+    
+    has_thumb = await in_thread(asyncio.ensure_future(extract_thumbnail(url, thumb_path, info['duration'], cancel)))
+    logger.info(f"Prefetched metadata for {url} (thumb: {has_thumb})")
+    return {'info': info, 'thumb': thumb_path if has_thumb else None}
+
+
+async def collect_prefetch(task: Optional[asyncio.Task]) -> Dict:
+    """Return a finished prefetch result, or {} if it failed or is still running"""
+    if task is None:
+        return {}
+    if not task.done():
+        task.cancel()
+        # Let it stop its ffmpeg/ffprobe before the caller removes the workspace
+        await asyncio.wait([task])
+        return {}
+    try:
+        return task.result()
+    except (asyncio.CancelledError, Exception) as e:
+        logger.debug(f"Prefetch unavailable: {e}")
+        return {}
+
+
+def _patch_chunk_offsets(moov: bytearray, start: int, end: int, lo: int, hi: int, delta: int) -> bool:
+    """Shift stco/co64 entries pointing into [lo, hi) by delta, returns False on overflow"""
+    for box_type, _, payload, box_end in _mp4_boxes(moov, start, end):
+        if box_type in _MP4_CONTAINERS:
+            if not _patch_chunk_offsets(moov, payload, box_end, lo, hi, delta):
+                return False
+        elif box_type in (b'stco', b'co64'):
+            fmt, width = ('>I', 4) if box_type == b'stco' else ('>Q', 8)
+            count = struct.unpack_from('>I', moov, payload + 4)[0]
+            pos = payload + 8
+            if pos + count * width > box_end:
+                return False
+            for _ in range(count):
+                offset = struct.unpack_from(fmt, moov, pos)[0]
+                if lo <= offset < hi:
+                    offset += delta
+                    if width == 4 and offset > 0xFFFFFFFF:
+                        return False
+                    struct.pack_into(fmt, moov, pos, offset)
+                pos += width
+        elif box_type == b'cmov':
+            return False  # Compressed movie header, leave to ffmpeg
+    return True
+
+
+def ensure_faststart(filepath: str) -> bool:
+    """
+    Make an MP4 streamable by moving moov in front of mdat IN PLACE:
+    only the moov chunk offsets are rewritten and the media bytes are
+    shifted once, no temp file and no remux. Returns True if the file
+    is (now) faststart, False if it was left untouched.
+    """
+    try:
+        with open(filepath, 'r+b') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[4:8] not in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+                    return False
+                moov_pos = mdat_pos = None
+                for box_type, box_start, _, box_end in _mp4_boxes(buf, 0, file_size):
+                    if box_type == b'moov' and moov_pos is None:
+                        moov_pos, moov_end = box_start, box_end
+                    elif box_type == b'mdat' and mdat_pos is None:
+                        mdat_pos = box_start
+                
+                if moov_pos is None or mdat_pos is None:
+                    return False
+                if moov_pos < mdat_pos:
+                    logger.info(f"Already faststart: {filepath}")
+                    return True
+                
+                moov = bytearray(buf[moov_pos:moov_end])
+            
+            moov_size = len(moov)
+            moov_header = 16 if struct.unpack_from('>I', moov)[0] == 1 else 8
+            if not _patch_chunk_offsets(moov, moov_header, moov_size, mdat_pos, moov_pos, moov_size):
+                logger.warning(f"Cannot relocate moov in place: {filepath}")
+                return False
+            
+            # Shift [mdat_pos, moov_pos) forward by moov_size, back to front
+            fd = f.fileno()
+            chunk = FASTSTART_COPY_CHUNK
+            src_end = moov_pos
+            while src_end > mdat_pos:
+                src_start = max(mdat_pos, src_end - chunk)
+                data = os.pread(fd, src_end - src_start, src_start)
+                os.pwrite(fd, data, src_start + moov_size)
+                src_end = src_start
+            
+            os.pwrite(fd, bytes(moov), mdat_pos)
+            os.fsync(fd)
         
-        # Method 5: Extract ANY frame without filters
-        logger.warning("Method 4 failed, trying Method 5 (raw extraction)")
-        raw_cmd = [
-            'ffmpeg', '-i', video_path,
-            '-vframes', '1',
-            thumb_path,
-            '-y'
-        ]
-        result = subprocess.run(raw_cmd, capture_output=True, timeout=60)
+        logger.info(f"✅ moov relocated in place ({moov_size} bytes): {filepath}")
+        return True
         
-        if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-            logger.info("✅ Thumbnail Method 5 success")
-            return True
+    except (OSError, ValueError, struct.error) as e:
+        logger.error(f"Faststart relocation error: {e}")
+        return False
+
+
+def _run_ffmpeg(cmd: List[str], timeout: int) -> bool:
+    """Run an ffmpeg command, True on exit code 0"""
+    result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    if result.returncode != 0:
+        logger.error(f"ffmpeg failed: {result.stderr.decode(errors='ignore')[-300:]}")
+        return False
+    return True
+
+
+def remux_to_mp4(src_path: str, dst_path: str) -> bool:
+    """Stream-copy a TS/fMP4 download into a regular MP4 (no re-encode)"""
+    try:
+        return _run_ffmpeg([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', src_path,
+            '-map', '0:v?', '-map', '0:a?', '-c', 'copy',
+            '-y', dst_path
+        ], REMUX_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.error(f"Remux error: {e}")
+        return False
+
+
+def merge_av(video_path: str, audio_path: str, dst_path: str) -> bool:
+    """Stream-copy separate video and audio downloads into one file"""
+    try:
+        return _run_ffmpeg([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', video_path, '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+            '-y', dst_path
+        ], REMUX_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.error(f"Merge error: {e}")
+        return False
+
+
+def transcode_to_fit(src_path: str, dst_path: str, duration: int, max_size_mb: int) -> bool:
+    """
+    Re-encode a video so it fits under max_size_mb as ONE playable file.
+    The source is cut at keyframes (stream copy), the chunks are encoded
+    with libx264 in parallel on all cores at the bitrate that fits the
+    size budget, then concatenated and muxed with the original audio.
+    """
+    if duration <= 0:
+        logger.error("Fit mode needs a known duration")
+        return False
+    
+    target_bits = max_size_mb * 1024 * 1024 * 8 * FIT_SIZE_MARGIN
+    video_kbps = int(target_bits / duration / 1000) - FIT_AUDIO_BITRATE
+    if video_kbps < FIT_MIN_VIDEO_BITRATE:
+        logger.warning(f"Fit mode: {duration}s needs {video_kbps}kbps video, too low")
+        return False
+    
+    cpus = os.cpu_count() or 1
+    segment_time = max(duration / cpus, FIT_MIN_CHUNK_SECONDS)
+    work_dir = tempfile.mkdtemp(prefix='fit_', dir=os.path.dirname(dst_path) or '.')
+    fitted = False
+    
+    try:
+        logger.info(f"Fit mode: {video_kbps}kbps, {segment_time:.0f}s chunks, {cpus} cores")
+        
+        # 1. Cut at keyframes without re-encoding
+        if not _run_ffmpeg([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', src_path,
+            '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', f"{segment_time:.3f}",
+            '-reset_timestamps', '1',
+            '-y', os.path.join(work_dir, 'src_%04d.mkv')
+        ], FIT_STEP_TIMEOUT):
+            return False
         
-        # Method 6: Last resort - extract from end of video
-        if video_duration > 10:
-            end_time = max(video_duration - 5, 1)
-            end_str = f"00:00:{end_time:02d}"
-            logger.warning(f"Method 5 failed, trying Method 6 (end: {end_str})")
-            cmd[1] = end_str
-            result = subprocess.run(cmd, capture_output=True, timeout=60)
-            
-            if os.path.exists(thumb_path) and os.path.getsize(thumb_path) > 2048:
-                logger.info("✅ Thumbnail Method 6 success")
-                return True
+        chunks = sorted(f for f in os.listdir(work_dir) if f.startswith('src_'))
+        if not chunks:
+            return False
         
-        logger.error("❌ ALL thumbnail generation methods failed")
-        return False
+        # 2. Encode chunks in parallel, splitting cores between jobs
+        threads = max(1, cpus // len(chunks))
+        
+        def encode(chunk: str) -> str:
+            out = os.path.join(work_dir, chunk.replace('src_', 'enc_').replace('.mkv', '.mp4'))
+            ok = _run_ffmpeg([
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-i', os.path.join(work_dir, chunk),
+                '-an', '-c:v', 'libx264', '-preset', FIT_X264_PRESET,
+                '-b:v', f"{video_kbps}k",
+                '-maxrate', f"{int(video_kbps * 1.5)}k",
+                '-bufsize', f"{video_kbps * 2}k",
+                '-pix_fmt', 'yuv420p',
+                '-threads', str(threads),
+                '-y', out
+            ], FIT_STEP_TIMEOUT)
+            return out if ok else ''
+        
+        with ThreadPoolExecutor(max_workers=cpus, thread_name_prefix="fit") as pool:
+            encoded = list(pool.map(encode, chunks))
+        
+        if not all(encoded):
+            return False
+        
+        list_path = os.path.join(work_dir, 'concat.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"file '{path}'\n" for path in encoded)
+        
+        # 3. Join video chunks and add the source audio
+        if not _run_ffmpeg([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', src_path,
+            '-map', '0:v:0', '-map', '1:a:0?',
+            '-c:v', 'copy', '-c:a', 'aac', '-b:a', f"{FIT_AUDIO_BITRATE}k",
+            '-y', dst_path
+        ], FIT_STEP_TIMEOUT):
+            return False
+        
+        size_mb = os.path.getsize(dst_path) / (1024 * 1024)
+        if size_mb > max_size_mb:
+            logger.warning(f"Fit mode overshoot: {size_mb:.1f}MB")
+            return False
+        
+        ensure_faststart(dst_path)
+        logger.info(f"✅ Fit mode output: {size_mb:.1f}MB")
+        fitted = True
+        return True
         
     except subprocess.TimeoutExpired:
-        logger.error("Thumbnail generation timeout")
+        logger.error("Fit mode timeout")
         return False
     except Exception as e:
-        logger.error(f"Thumbnail error: {e}")
+        logger.error(f"Fit mode error: {e}")
         return False
+    finally:
+        # Chunks always go; a partial or oversized output on any failure too
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not fitted:
+            try:
+                os.remove(dst_path)
+            except OSError:
+                pass
 
 
 def validate_video_file(filepath: str) -> bool:
@@ -186,6 +703,11 @@ def validate_video_file(filepath: str) -> bool:
             logger.error(f"File too small: {file_size} bytes")
             return False
         
+        # A parseable header with a video track is enough, skip ffprobe
+        if probe_header(filepath):
+            logger.info(f"✅ Video file validated (header): {filepath}")
+            return True
+        
         # Quick validation with ffprobe
         cmd = [
             'ffprobe', '-v', 'error',
@@ -0,0 +1,74 @@
+import os
+import time
+import shutil
+import uuid
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict
+from config import DOWNLOAD_DIR, WORKSPACE_ORPHAN_AGE, WORKSPACE_JANITOR_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = DOWNLOAD_DIR / "jobs"
+JOBS_DIR.mkdir(exist_ok=True)
+
+# Live workspaces by directory name; anything else under JOBS_DIR is an orphan
+_live: Dict[str, 'Workspace'] = {}
+
+
+class Workspace:
+    """Private directory for one job: every file it creates lives here"""
+    
+    def __init__(self, user_id: int, label: str = ""):
+        name = f"{user_id}_{label}_{uuid.uuid4().hex[:8]}" if label else f"{user_id}_{uuid.uuid4().hex[:8]}"
+        self.path = JOBS_DIR / name
+        self.user_id = user_id
+        _live[name] = self
+        self.path.mkdir(parents=True)
+    
+    def file(self, name: str) -> Path:
+        """Path for a new file inside the workspace (the directory is the job's record)"""
+        return self.path / name
+    
+    def cleanup(self):
+        """Remove the whole workspace in one go"""
+        _live.pop(self.path.name, None)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def active_workspaces() -> int:
+    """Workspaces currently owned by a running job"""
+    return len(_live)
+
+
+def reclaim_orphans(min_age: float = WORKSPACE_ORPHAN_AGE) -> int:
+    """Delete workspaces no live job owns (left behind by crashes/restarts)"""
+    now = time.time()
+    reclaimed = 0
+    for entry in os.scandir(JOBS_DIR):
+        if not entry.is_dir() or entry.name in _live:
+            continue
+        try:
+            if now - entry.stat().st_mtime < min_age:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        reclaimed += 1
+    
+    if reclaimed:
+        logger.info(f"🧹 Reclaimed {reclaimed} orphaned workspace(s)")
+    return reclaimed
+
+
+async def workspace_janitor():
+    """Background task: periodically reclaim orphaned workspaces"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, reclaim_orphans, 0)
+    while True:
+        await asyncio.sleep(WORKSPACE_JANITOR_INTERVAL)
+        try:
+            await loop.run_in_executor(None, reclaim_orphans, WORKSPACE_ORPHAN_AGE)
+        except Exception as e:
+            logger.error(f"Workspace janitor error: {e}")
@@ -0,0 +1,107 @@
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import yt_dlp
+from config import YDL_POOL_IDLE, YDL_POOL_MAX_USES
+
+logger = logging.getLogger(__name__)
+
+# Options read from params at download time: set per job, not part of the key
+JOB_OPTIONS = ('outtmpl', 'progress_hooks', 'format', 'concurrent_fragment_downloads', 'external_downloader_args')
+
+
+def fingerprint(opts: Dict) -> str:
+    """Stable key for the options baked into a YoutubeDL at construction"""
+    shared = {k: v for k, v in opts.items() if k not in JOB_OPTIONS}
+    text = json.dumps(shared, sort_keys=True, default=lambda o: getattr(o, '__qualname__', type(o).__name__))
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+class _Warm:
+    def __init__(self, ydl: yt_dlp.YoutubeDL):
+        self.ydl = ydl
+        self.uses = 0
+
+
+class YdlPool:
+    """
+    Warm yt_dlp.YoutubeDL instances keyed by option fingerprint, so a job
+    does not rebuild extractor tables, cookie jar and HTTP openers. A job
+    checks one out, gets its own outtmpl/hooks/format, and hands it back;
+    instances are retired after YDL_POOL_MAX_USES jobs or any error.
+    """
+    
+    def __init__(self, idle_per_key: int = YDL_POOL_IDLE, max_uses: int = YDL_POOL_MAX_USES):
+        self.idle_per_key = idle_per_key
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List[_Warm]] = {}
+        self.created = 0
+        self.reused = 0
+        self.retired = 0
+    
+    def _take(self, key: str, opts: Dict) -> _Warm:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return _Warm(yt_dlp.YoutubeDL({k: v for k, v in opts.items() if k != 'progress_hooks'}))
+    
+    def _give_back(self, key: str, warm: _Warm, failed: bool):
+        warm.ydl._progress_hooks = []
+        warm.uses += 1
+        if not failed and warm.uses < self.max_uses:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.idle_per_key:
+                    idle.append(warm)
+                    return
+        with self._lock:
+            self.retired += 1
+        try:
+            warm.ydl.close()
+        except Exception as e:
+            logger.debug(f"YoutubeDL close error: {e}")
+    
+    @contextmanager
+    def checkout(self, opts: Dict) -> Iterator[yt_dlp.YoutubeDL]:
+        """A YoutubeDL configured with opts, reused when one is idle"""
+        key = fingerprint(opts)
+        warm = self._take(key, opts)
+        ydl = warm.ydl
+        
+        # Per-job state
+        ydl.params['outtmpl']['default'] = opts['outtmpl']
+        for name in JOB_OPTIONS[2:]:
+            if name in opts:
+                ydl.params[name] = opts[name]
+            else:
+                ydl.params.pop(name, None)
+        # YoutubeDL compiles 'format' once in __init__: rebuild it for this job
+        spec = ydl.params.get('format')
+        ydl.format_selector = (
+            spec if spec in (None, '-') or callable(spec)
+            else ydl.build_format_selector(spec)
+        )
+        ydl._progress_hooks = list(opts.get('progress_hooks', []))
+        ydl._download_retcode = 0
+        
+        failed = True
+        try:
+            yield ydl
+            failed = ydl._download_retcode != 0
+        finally:
+            self._give_back(key, warm, failed)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {'idle': idle, 'created': self.created, 'reused': self.reused, 'retired': self.retired}
+
+
+ydl_pool = YdlPool()
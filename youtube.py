@@ -0,0 +1,120 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from config import (
+    YOUTUBE_DLP_OPTS, YOUTUBE_INFO_TTL, YOUTUBE_INFO_CACHE_SIZE,
+    MAX_RETRIES, FRAGMENT_RETRIES, HTTP_CHUNK_SIZE, BUFFER_SIZE, YTDLP_SOCKET_TIMEOUT
+)
+from retry_policy import backoff_delay
+from ydl_pool import ydl_pool
+
+logger = logging.getLogger(__name__)
+
+# Extracted info per URL; the stream URLs inside expire after a few hours
+_info_cache: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+_info_lock = threading.Lock()
+info_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _ydl_opts(outtmpl: str = '%(id)s.%(ext)s', hooks: Optional[List[Callable]] = None) -> Dict:
+    """One option set for extraction and stream downloads, so both share warm instances"""
+    return dict(
+        YOUTUBE_DLP_OPTS,
+        outtmpl=outtmpl,
+        progress_hooks=hooks or [],
+        quiet=True,
+        noprogress=True,
+        retries=MAX_RETRIES,
+        fragment_retries=FRAGMENT_RETRIES,
+        http_chunk_size=HTTP_CHUNK_SIZE,
+        buffersize=BUFFER_SIZE,
+        socket_timeout=YTDLP_SOCKET_TIMEOUT,
+        retry_sleep_functions={
+            'http': lambda n: backoff_delay(n),
+            'fragment': lambda n: backoff_delay(n),
+            'extractor': lambda n: backoff_delay(n),
+        },
+    )
+
+
+def extract_info(url: str) -> Optional[Dict]:
+    """Video info (formats with stream URLs), cached for YOUTUBE_INFO_TTL"""
+    with _info_lock:
+        entry = _info_cache.get(url)
+        if entry and time.monotonic() - entry[0] < YOUTUBE_INFO_TTL:
+            _info_cache.move_to_end(url)
+            info_cache_stats['hits'] += 1
+            return entry[1]
+        info_cache_stats['misses'] += 1
+    
+    with ydl_pool.checkout(_ydl_opts()) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info or not info.get('formats'):
+        return None
+    
+    with _info_lock:
+        _info_cache[url] = (time.monotonic(), info)
+        while len(_info_cache) > YOUTUBE_INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def _has(fmt: Dict, codec: str) -> bool:
+    return fmt.get(codec) not in (None, 'none')
+
+
+def _height(fmt: Dict) -> int:
+    return fmt.get('height') or 0
+
+
+def _best(formats: List[Dict], max_height: int, prefer_ext: str) -> Optional[Dict]:
+    """Tallest format under max_height (smallest if none fits), preferring prefer_ext"""
+    if not formats:
+        return None
+    fitting = [f for f in formats if _height(f) <= max_height]
+    if not fitting:
+        return min(formats, key=_height)
+    return max(fitting, key=lambda f: (_height(f), f.get('ext') == prefer_ext, f.get('tbr') or 0))
+
+
+def pick_formats(info: Dict, max_height: int) -> List[Dict]:
+    """
+    [progressive] when a pre-muxed format reaches the best height available
+    under max_height (no merge needed), otherwise [video, audio] streams
+    """
+    formats = [
+        f for f in info.get('formats') or []
+        if f.get('url') and f.get('protocol') in ('http', 'https')
+    ]
+    muxed = _best([f for f in formats if _has(f, 'vcodec') and _has(f, 'acodec')], max_height, 'mp4')
+    video = _best([f for f in formats if _has(f, 'vcodec') and not _has(f, 'acodec')], max_height, 'mp4')
+    
+    if muxed and (not video or _height(muxed) >= _height(video)):
+        return [muxed]
+    if not video:
+        return []
+    
+    audios = [f for f in formats if _has(f, 'acodec') and not _has(f, 'vcodec')]
+    if not audios:
+        return [muxed] if muxed else []
+    # m4a audio keeps an mp4 video stream-copyable into an .mp4
+    audio = max(audios, key=lambda f: (f.get('ext') == 'm4a' or video.get('ext') != 'mp4', f.get('abr') or 0))
+    return [video, audio]
+
+
+def merged_extension(video: Dict, audio: Dict) -> str:
+    return 'mp4' if video.get('ext') == 'mp4' and audio.get('ext') == 'm4a' else 'mkv'
+
+
+def download_stream(info: Dict, fmt: Dict, path: str, hook: Callable) -> bool:
+    """Fetch one format to path with yt-dlp's downloader (no re-extraction)"""
+    stream = dict(info)
+    for key in ('formats', 'requested_formats', 'requested_downloads'):
+        stream.pop(key, None)
+    stream.update(fmt)
+    
+    with ydl_pool.checkout(_ydl_opts(path, [hook])) as ydl:
+        success, _ = ydl.dl(path, stream)
+    return bool(success)